@@ -1,65 +1,162 @@
 import os
+import json
+import time
+import asyncio
 import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from agents import (GuardAgent,
                     ClassificationAgent,
+                    GatekeeperAgent,
                     DetailsAgent,
                     OrderTakingAgent,
                     RecommendationAgent,
-                    AgentProtocol
+                    AgentProtocol,
+                    DecisionCache,
+                    IntentClassifier,
+                    MenuOrderParser,
+                    get_embedding_cache,
+                    SemanticAnswerCache,
+                    get_client_registry,
+                    LazyAgentDict,
+                    ArtifactStore,
+                    ArtifactWatcher,
+                    ConversationView,
+                    InMemorySessionStore,
+                    SqliteSessionStore,
+                    prompt_stats,
+                    get_json_repair_stats,
+                    get_schema_stats,
+                    request_deadline,
+                    get_fallback_stats,
+                    start_trace,
+                    span,
+                    run_in_context,
+                    get_span_histograms
                     )
 
 logger = logging.getLogger(__name__)
 
+# "sequential" runs the guard and then the classifier, "speculative" starts both
+# at the same time and throws the classification away if the guard blocks the turn,
+# "gatekeeper" gets both decisions from a single GatekeeperAgent call
+EXECUTION_MODES = ("sequential", "speculative", "gatekeeper")
+
+# "eager" builds every agent in the constructor, "lazy" builds each agent on first
+# use and "background" returns at once and builds the agents in a daemon thread
+STARTUP_MODES = ("eager", "lazy", "background")
+
 class AgentController():
-    def __init__(self):
+    def __init__(self, execution_mode=None, speculate_agent=None, max_workers=None, startup_mode=None):
         try:
+            start = time.perf_counter()
+
             # Get the absolute path to the recommendation files
             current_dir = os.path.dirname(os.path.abspath(__file__))
             apriori_path = os.path.join(current_dir, 'recommendation_objects', 'apriori_recommendations.json')
             popularity_path = os.path.join(current_dir, 'recommendation_objects', 'popularity_recommendation.csv')
-            
-            # Initialize agents with error handling
-            self.guard_agent = GuardAgent()
-            self.classification_agent = ClassificationAgent()
-            self.recommendation_agent = RecommendationAgent(apriori_path, popularity_path)
-            
-            self.agent_dict: dict[str, AgentProtocol] = {
-                "details_agent": DetailsAgent(),
-                "order_taking_agent": OrderTakingAgent(self.recommendation_agent),
-                "recommendation_agent": self.recommendation_agent
+            # The image ships the menu next to the api code, a checkout also has it in ../products
+            menu_path = os.getenv("MENU_PATH", os.path.join(current_dir, 'products', 'products.jsonl'))
+            if "MENU_PATH" not in os.environ and not os.path.exists(menu_path):
+                menu_path = os.path.join(current_dir, '..', 'products', 'products.jsonl')
+            intent_classifier_path = os.getenv("INTENT_CLASSIFIER_PATH",
+                                               os.path.join(current_dir, 'classifier_objects', 'intent_classifier.npz'))
+
+            # Read the execution settings
+            self.execution_mode = execution_mode or os.getenv("AGENT_EXECUTION_MODE", "sequential")
+            if self.execution_mode not in EXECUTION_MODES:
+                raise ValueError(f"Unknown execution mode: {self.execution_mode}")
+            if speculate_agent is None:
+                speculate_agent = os.getenv("SPECULATE_AGENT", "false").lower() == "true"
+            self.speculate_agent = speculate_agent
+
+            # Cache for guard and routing decisions, a size of 0 disables it
+            self.decision_cache = None
+            decision_cache_size = int(os.getenv("DECISION_CACHE_SIZE", "1024"))
+            if decision_cache_size > 0:
+                self.decision_cache = DecisionCache(max_size=decision_cache_size,
+                                                    ttl_seconds=float(os.getenv("DECISION_CACHE_TTL_SECONDS", "3600")),
+                                                    db_path=os.getenv("DECISION_CACHE_PATH"))
+
+            # Time budget shared by every model call of a request, 0 disables it
+            self.request_deadline_seconds = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+
+            self.startup_mode = startup_mode or os.getenv("AGENT_STARTUP", "eager")
+            if self.startup_mode not in STARTUP_MODES:
+                raise ValueError(f"Unknown startup mode: {self.startup_mode}")
+
+            # Agents are built on first use unless the startup mode builds them up front
+            intent_classifier_threshold = float(os.getenv("INTENT_CLASSIFIER_THRESHOLD", "0.8"))
+            pipeline_factories = {
+                "guard_agent": lambda: GuardAgent(self.decision_cache),
+                "classification_agent": lambda: ClassificationAgent(self.decision_cache,
+                                                                    self._load_intent_classifier(intent_classifier_path),
+                                                                    intent_classifier_threshold)
             }
-            logger.info("AgentController initialized successfully")
-            
+            if self.execution_mode == "gatekeeper":
+                pipeline_factories["gatekeeper_agent"] = lambda: GatekeeperAgent(self.decision_cache)
+            self.pipeline_agents = LazyAgentDict(pipeline_factories)
+
+            self.agent_dict: LazyAgentDict[str, AgentProtocol] = LazyAgentDict({
+                "details_agent": lambda: DetailsAgent(self._build_answer_cache(menu_path)),
+                "order_taking_agent": lambda: OrderTakingAgent(self.agent_dict["recommendation_agent"],
+                                                               self._load_order_parser(menu_path)),
+                "recommendation_agent": lambda: self._build_recommendation_agent(apriori_path, popularity_path)
+            })
+            self.artifact_watcher = None
+
+            # Compact per-conversation state for clients that send a session_id instead of the history
+            self.session_store = self._build_session_store()
+
+            # Shared executor for the speculative stages
+            self.executor = None
+            if self.execution_mode == "speculative":
+                max_workers = max_workers or int(os.getenv("AGENT_EXECUTOR_WORKERS", "8"))
+                self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-stage")
+
+            self.startup_thread = None
+            if self.startup_mode == "eager":
+                self._build_agents()
+            elif self.startup_mode == "background":
+                self.startup_thread = threading.Thread(target=self._build_agents_in_background,
+                                                       name="agent-startup", daemon=True)
+                self.startup_thread.start()
+
+            self.startup_ms = self._elapsed_ms(start)
+            logger.info(f"AgentController initialized successfully in {self.execution_mode} mode "
+                        f"with {self.startup_mode} startup in {self.startup_ms} ms")
+
         except Exception as e:
             logger.error(f"Error initializing AgentController: {str(e)}")
             raise
-    
+
     def get_response(self, input):
         try:
             # Extract User Input
             job_input = input["input"]
-            messages = job_input["messages"]
-            
+            # One read-only view of the history is shared by every agent, nothing is copied
+            messages, session_id = self._load_conversation(job_input)
+
             # Log incoming request
             logger.info(f"Processing request with {len(messages)} messages")
-            
-            # Get GuardAgent's response
-            guard_agent_response = self.guard_agent.get_response(messages)
-            if guard_agent_response["memory"]["guard_decision"] == "not allowed":
-                logger.info("Request blocked by GuardAgent")
-                return guard_agent_response
-            
-            # Get ClassificationAgent's response
-            classification_agent_response = self.classification_agent.get_response(messages)
-            chosen_agent = classification_agent_response["memory"]["classification_decision"]
-            logger.info(f"Request classified to agent: {chosen_agent}")
-            
-            # Get the chosen agent's response
-            agent = self.agent_dict[chosen_agent]
-            response = agent.get_response(messages)
-            
-            return response
-            
+
+            timings = {}
+            start = time.perf_counter()
+            with request_deadline(self._get_deadline_seconds(job_input)), \
+                    start_trace("request", mode=self.execution_mode) as trace:
+                if self.execution_mode == "speculative":
+                    response = self._get_speculative_response(messages, timings)
+                elif self.execution_mode == "gatekeeper":
+                    response = self._get_gatekeeper_response(messages, timings)
+                else:
+                    response = self._get_sequential_response(messages, timings)
+            timings["total"] = self._elapsed_ms(start)
+            logger.info(f"Stage timings (ms): {timings}")
+
+            self._save_session(session_id, messages, response)
+            return self._add_timings(job_input, response, trace)
+
         except KeyError as e:
             logger.error(f"Invalid input format: {str(e)}")
             return {
@@ -74,3 +171,496 @@ class AgentController():
                 "content": "I apologize, but I encountered an error. Please try again.",
                 "memory": {"error": str(e)}
             }
+
+    async def aget_response(self, input):
+        """Async entry point, lets one worker serve many conversations while they wait on Gemini."""
+        try:
+            # Extract User Input
+            job_input = input["input"]
+            # One read-only view of the history is shared by every agent, nothing is copied
+            messages, session_id = self._load_conversation(job_input)
+
+            # Log incoming request
+            logger.info(f"Processing async request with {len(messages)} messages")
+
+            timings = {}
+            start = time.perf_counter()
+            with request_deadline(self._get_deadline_seconds(job_input)), \
+                    start_trace("request", mode=self.execution_mode) as trace:
+                if self.execution_mode == "speculative":
+                    response = await self._aget_speculative_response(messages, timings)
+                elif self.execution_mode == "gatekeeper":
+                    response = await self._aget_gatekeeper_response(messages, timings)
+                else:
+                    response = await self._aget_sequential_response(messages, timings)
+            timings["total"] = self._elapsed_ms(start)
+            logger.info(f"Stage timings (ms): {timings}")
+
+            self._save_session(session_id, messages, response)
+            return self._add_timings(job_input, response, trace)
+
+        except KeyError as e:
+            logger.error(f"Invalid input format: {str(e)}")
+            return {
+                "role": "assistant",
+                "content": "I apologize, but I encountered an error with the input format. Please try again.",
+                "memory": {"error": str(e)}
+            }
+        except Exception as e:
+            logger.error(f"Error processing request: {str(e)}")
+            return {
+                "role": "assistant",
+                "content": "I apologize, but I encountered an error. Please try again.",
+                "memory": {"error": str(e)}
+            }
+
+    def stream_response(self, input):
+        """Generator entry point, yields partial chunks and ends with the full response and its memory."""
+        # Every step runs in the request's own context, so its deadline and trace hold across the yields
+        yield from run_in_context(contextvars.copy_context(), self._stream_response(input))
+
+    def _stream_response(self, input):
+        try:
+            # Extract User Input
+            job_input = input["input"]
+            # One read-only view of the history is shared by every agent, nothing is copied
+            messages, session_id = self._load_conversation(job_input)
+
+            # Log incoming request
+            logger.info(f"Processing streaming request with {len(messages)} messages")
+
+            timings = {}
+            start = time.perf_counter()
+            with request_deadline(self._get_deadline_seconds(job_input)), \
+                    start_trace("request", mode=self.execution_mode, stream=True) as trace:
+                blocked_response, chosen_agent = self._get_route(messages, timings)
+                if blocked_response is not None:
+                    self._save_session(session_id, messages, blocked_response)
+                    yield self._add_timings(job_input, blocked_response, trace)
+                    return
+
+                # Stream the chosen agent's response, the last chunk carries the memory
+                agent = self.agent_dict[chosen_agent]
+                with span("agent"):
+                    for chunk in agent.stream_response(messages):
+                        if "first_chunk" not in timings:
+                            timings["first_chunk"] = self._elapsed_ms(start)
+                        if "memory" in chunk:
+                            self._save_session(session_id, messages, chunk)
+                            chunk = self._add_timings(job_input, chunk, trace)
+                        yield chunk
+            timings["total"] = self._elapsed_ms(start)
+            logger.info(f"Stage timings (ms): {timings}")
+
+        except KeyError as e:
+            logger.error(f"Invalid input format: {str(e)}")
+            yield {
+                "role": "assistant",
+                "content": "I apologize, but I encountered an error with the input format. Please try again.",
+                "memory": {"error": str(e)}
+            }
+        except Exception as e:
+            logger.error(f"Error processing request: {str(e)}")
+            yield {
+                "role": "assistant",
+                "content": "I apologize, but I encountered an error. Please try again.",
+                "memory": {"error": str(e)}
+            }
+
+    @property
+    def guard_agent(self):
+        return self.pipeline_agents["guard_agent"]
+
+    @property
+    def classification_agent(self):
+        return self.pipeline_agents["classification_agent"]
+
+    @property
+    def gatekeeper_agent(self):
+        return self.pipeline_agents.get("gatekeeper_agent")
+
+    @property
+    def recommendation_agent(self):
+        return self.agent_dict["recommendation_agent"]
+
+    def get_metrics(self):
+        """Counters of the pipeline's caches and fast paths, agents that aren't built yet are skipped."""
+        metrics = {
+            "startup": {
+                "mode": self.startup_mode,
+                "init_ms": self.startup_ms,
+                "build_ms": {**self.pipeline_agents.build_ms, **self.agent_dict.build_ms}
+            }
+        }
+        if self.decision_cache is not None:
+            metrics["decision_cache"] = self.decision_cache.stats()
+        metrics["clients"] = get_client_registry().stats()
+        metrics["prompts"] = prompt_stats()
+        metrics["json_repair"] = get_json_repair_stats().stats()
+        metrics["response_schemas"] = get_schema_stats().stats()
+        metrics["tracing"] = get_span_histograms().stats()
+        metrics["resilience"] = {
+            "request_deadline_seconds": self.request_deadline_seconds,
+            "fallbacks": get_fallback_stats().stats()
+        }
+        if self.session_store is not None:
+            metrics["sessions"] = self.session_store.stats()
+        if self.pipeline_agents.is_built("classification_agent"):
+            metrics["intent_classifier"] = self.classification_agent.stats()
+        if self.agent_dict.is_built("order_taking_agent"):
+            metrics["order_parser"] = self.agent_dict["order_taking_agent"].stats()
+        if self.agent_dict.is_built("recommendation_agent"):
+            metrics["recommendation_tables"] = self.recommendation_agent.recommendation_tables.stats()
+        if self.artifact_watcher is not None:
+            metrics["artifact_watcher"] = self.artifact_watcher.stats()
+        if self.agent_dict.is_built("details_agent"):
+            answer_cache = self.agent_dict["details_agent"].answer_cache
+            if answer_cache is not None:
+                metrics["answer_cache"] = answer_cache.stats()
+        embedding_cache = get_embedding_cache()
+        if embedding_cache is not None:
+            metrics["embedding_cache"] = embedding_cache.stats()
+        return metrics
+
+    def get_prometheus_metrics(self):
+        """Stage latency histograms in the Prometheus text format."""
+        return get_span_histograms().render_prometheus()
+
+    def _add_timings(self, job_input, response, trace):
+        """The response with the request's span tree in its memory, when the request sent include_timings."""
+        if trace is None or not job_input.get("include_timings"):
+            return response
+        return {**response, "memory": {**(response.get("memory") or {}), "timings": trace.to_dict()}}
+
+    def _get_deadline_seconds(self, job_input):
+        """Deadline for this request, a client can send a tighter one as deadline_ms."""
+        deadline_ms = job_input.get("deadline_ms")
+        if deadline_ms:
+            return float(deadline_ms) / 1000
+        return self.request_deadline_seconds
+
+    def _submit(self, stage, timings, func, *args):
+        """Run a timed stage on the executor, with the request's deadline carried into the worker thread."""
+        return self.executor.submit(contextvars.copy_context().run, self._timed, stage, timings, func, *args)
+
+    def _load_intent_classifier(self, path):
+        """Load the local intent classifier, the LLM handles every turn if it is missing."""
+        if os.getenv("INTENT_CLASSIFIER_ENABLED", "true").lower() != "true":
+            return None
+        try:
+            return IntentClassifier.load(path)
+        except Exception as e:
+            logger.error(f"Error loading intent classifier: {str(e)}")
+            return None
+
+    def _build_agents(self):
+        """Build every agent and open the shared client connections if CLIENT_WARMUP is set."""
+        self.pipeline_agents.build_all()
+        self.agent_dict.build_all()
+        if os.getenv("CLIENT_WARMUP", "false").lower() == "true":
+            self._warm_up_clients()
+
+    def _build_agents_in_background(self):
+        try:
+            self._build_agents()
+            logger.info(f"Agents built in the background: {self.agent_dict.build_ms}")
+        except Exception as e:
+            # Agents that failed here are built again on first use
+            logger.error(f"Error building agents in the background: {str(e)}")
+
+    def _warm_up_clients(self):
+        index_names = []
+        if os.getenv("VECTOR_BACKEND", "pinecone") == "pinecone" and os.getenv("PINECONE_INDEX_NAME"):
+            index_names.append(os.getenv("PINECONE_INDEX_NAME"))
+        get_client_registry().warm_up(model_names=[os.getenv("GEMINI_MODEL_NAME")], index_names=index_names)
+
+    def _build_session_store(self):
+        """Session store selected by SESSION_STORE, "none" turns session mode off."""
+        backend = os.getenv("SESSION_STORE", "memory")
+        ttl_seconds = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+        if backend == "memory":
+            return InMemorySessionStore(max_size=int(os.getenv("SESSION_STORE_SIZE", "10000")), ttl_seconds=ttl_seconds)
+        if backend == "sqlite":
+            return SqliteSessionStore(os.getenv("SESSION_STORE_PATH", "sessions.sqlite3"), ttl_seconds=ttl_seconds)
+        if backend != "none":
+            raise ValueError(f"Unknown session store: {backend}")
+        return None
+
+    def _load_conversation(self, job_input):
+        """Conversation view of the turn and its session_id (None without session mode).
+
+        In session mode the client sends only the new "message", the view is
+        rebuilt from the stored agent memories. A session_id sent together with
+        "messages" uses the messages and (re)seeds the session from them.
+        """
+        session_id = job_input.get("session_id")
+        if session_id is None or self.session_store is None or "messages" in job_input:
+            return ConversationView(job_input["messages"]), session_id
+
+        session = self.session_store.get(session_id)
+        if session is None:
+            logger.info(f"Starting session {session_id}")
+            session = {"memories": {}}
+        return ConversationView.from_session(session["memories"], job_input["message"]), session_id
+
+    def _save_session(self, session_id, messages, response):
+        """Keep the latest memory of every agent, errors are not stored so the next turn retries from the last good state."""
+        if session_id is None or self.session_store is None:
+            return
+        memory = response.get("memory") or {}
+        if "error" in memory:
+            return
+        try:
+            memories = messages.memories()
+            if memory.get("agent"):
+                memories[memory["agent"]] = memory
+            self.session_store.save(session_id, {"memories": memories})
+        except Exception as e:
+            logger.error(f"Error saving session {session_id}: {str(e)}")
+
+    def _build_recommendation_agent(self, apriori_path, popularity_path):
+        """RecommendationAgent on the shipped artifacts, or on the artifact store with a reload watcher."""
+        artifact_store = None
+        store_path = os.getenv("RECOMMENDATION_STORE_PATH")
+        if store_path:
+            artifact_store = ArtifactStore(store_path)
+
+        agent = RecommendationAgent(apriori_path, popularity_path, os.getenv("APRIORI_MERGE", "sum"), artifact_store)
+
+        reload_seconds = float(os.getenv("RECOMMENDATION_RELOAD_SECONDS", "60"))
+        if artifact_store is not None and reload_seconds > 0:
+            self.artifact_watcher = ArtifactWatcher(artifact_store, agent.reload_artifacts, reload_seconds,
+                                                    version=agent.recommendation_tables.version)
+            self.artifact_watcher.start()
+        return agent
+
+    def _build_answer_cache(self, menu_path):
+        """Semantic answer cache for DetailsAgent, a size of 0 disables it."""
+        max_size = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+        if max_size <= 0:
+            return None
+        return SemanticAnswerCache(max_size=max_size,
+                                   max_distance=float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.02")),
+                                   ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")),
+                                   key_terms=self._load_menu_names(menu_path))
+
+    def _load_menu_names(self, path):
+        """Menu item names, a cached answer is only reused for a question about the same items."""
+        try:
+            with open(path, 'r') as file:
+                return [json.loads(line)["name"] for line in file if line.strip()]
+        except Exception as e:
+            logger.error(f"Error loading menu names for the answer cache from {path}: {str(e)}")
+            return []
+
+    def _load_order_parser(self, path):
+        """Build the local order parser from the menu, the LLM takes every order if it is missing."""
+        if os.getenv("ORDER_PARSER_ENABLED", "true").lower() != "true":
+            return None
+        try:
+            return MenuOrderParser(path)
+        except Exception as e:
+            logger.error(f"Error loading order parser: {str(e)}")
+            return None
+
+    def _get_sequential_response(self, messages, timings):
+        """Run the guard, the classifier and the chosen agent one after the other."""
+        start = time.perf_counter()
+
+        # Get GuardAgent's response
+        guard_agent_response = self._timed("guard", timings, self.guard_agent.get_response, messages)
+        if guard_agent_response["memory"]["guard_decision"] == "not allowed":
+            logger.info("Request blocked by GuardAgent")
+            return guard_agent_response
+
+        # Get ClassificationAgent's response
+        classification_agent_response = self._timed("classification", timings, self.classification_agent.get_response, messages)
+        chosen_agent = classification_agent_response["memory"]["classification_decision"]
+        timings["pre_routing"] = self._elapsed_ms(start)
+        logger.info(f"Request classified to agent: {chosen_agent}")
+
+        # Get the chosen agent's response
+        agent = self.agent_dict[chosen_agent]
+        return self._timed("agent", timings, agent.get_response, messages)
+
+    def _get_speculative_response(self, messages, timings):
+        """Start the guard and the classifier together and drop the speculative work if the guard blocks."""
+        start = time.perf_counter()
+
+        guard_future = self._submit("guard", timings, self.guard_agent.get_response, messages)
+        classification_future = self._submit("classification", timings, self.classification_agent.get_response, messages)
+
+        # If the classifier wins the race, start the chosen agent before the guard has answered
+        agent_future = None
+        if self.speculate_agent:
+            done, _ = wait([guard_future, classification_future], return_when=FIRST_COMPLETED)
+            if classification_future in done and not guard_future.done():
+                chosen_agent = classification_future.result()["memory"]["classification_decision"]
+                agent = self.agent_dict[chosen_agent]
+                agent_future = self._submit("agent", timings, agent.get_response, messages)
+
+        guard_agent_response = guard_future.result()
+        if guard_agent_response["memory"]["guard_decision"] == "not allowed":
+            # The remaining futures keep running if already started, their results are ignored
+            classification_future.cancel()
+            if agent_future is not None:
+                agent_future.cancel()
+            timings["pre_routing"] = self._elapsed_ms(start)
+            logger.info("Request blocked by GuardAgent, discarding speculative results")
+            return guard_agent_response
+
+        classification_agent_response = classification_future.result()
+        chosen_agent = classification_agent_response["memory"]["classification_decision"]
+        timings["pre_routing"] = self._elapsed_ms(start)
+        logger.info(f"Request classified to agent: {chosen_agent}")
+
+        if agent_future is not None:
+            return agent_future.result()
+
+        # Get the chosen agent's response
+        agent = self.agent_dict[chosen_agent]
+        return self._timed("agent", timings, agent.get_response, messages)
+
+    def _get_gatekeeper_response(self, messages, timings):
+        """Get the guard and routing decisions from one call, then run the chosen agent."""
+        start = time.perf_counter()
+
+        # Get GatekeeperAgent's response
+        gatekeeper_agent_response = self._timed("gatekeeper", timings, self.gatekeeper_agent.get_response, messages)
+        timings["pre_routing"] = self._elapsed_ms(start)
+        if gatekeeper_agent_response["memory"]["guard_decision"] == "not allowed":
+            logger.info("Request blocked by GatekeeperAgent")
+            return gatekeeper_agent_response
+
+        chosen_agent = gatekeeper_agent_response["memory"]["classification_decision"]
+        logger.info(f"Request classified to agent: {chosen_agent}")
+
+        # Get the chosen agent's response
+        agent = self.agent_dict[chosen_agent]
+        return self._timed("agent", timings, agent.get_response, messages)
+
+    def _get_route(self, messages, timings):
+        """Guard and routing decisions for the streaming path, as (blocked_response, chosen_agent)."""
+        start = time.perf_counter()
+
+        if self.execution_mode == "gatekeeper":
+            gatekeeper_agent_response = self._timed("gatekeeper", timings, self.gatekeeper_agent.get_response, messages)
+            guard_agent_response = classification_agent_response = gatekeeper_agent_response
+        elif self.execution_mode == "speculative":
+            guard_future = self._submit("guard", timings, self.guard_agent.get_response, messages)
+            classification_future = self._submit("classification", timings, self.classification_agent.get_response, messages)
+            guard_agent_response = guard_future.result()
+            if guard_agent_response["memory"]["guard_decision"] == "not allowed":
+                classification_future.cancel()
+            else:
+                classification_agent_response = classification_future.result()
+        else:
+            guard_agent_response = self._timed("guard", timings, self.guard_agent.get_response, messages)
+            if guard_agent_response["memory"]["guard_decision"] != "not allowed":
+                classification_agent_response = self._timed("classification", timings, self.classification_agent.get_response, messages)
+
+        timings["pre_routing"] = self._elapsed_ms(start)
+        if guard_agent_response["memory"]["guard_decision"] == "not allowed":
+            logger.info("Request blocked by the guard")
+            return guard_agent_response, None
+
+        chosen_agent = classification_agent_response["memory"]["classification_decision"]
+        logger.info(f"Request classified to agent: {chosen_agent}")
+        return None, chosen_agent
+
+    async def _aget_sequential_response(self, messages, timings):
+        """Async variant of _get_sequential_response."""
+        start = time.perf_counter()
+
+        # Get GuardAgent's response
+        guard_agent_response = await self._atimed("guard", timings, self.guard_agent.aget_response(messages))
+        if guard_agent_response["memory"]["guard_decision"] == "not allowed":
+            logger.info("Request blocked by GuardAgent")
+            return guard_agent_response
+
+        # Get ClassificationAgent's response
+        classification_agent_response = await self._atimed("classification", timings, self.classification_agent.aget_response(messages))
+        chosen_agent = classification_agent_response["memory"]["classification_decision"]
+        timings["pre_routing"] = self._elapsed_ms(start)
+        logger.info(f"Request classified to agent: {chosen_agent}")
+
+        # Get the chosen agent's response
+        agent = self.agent_dict[chosen_agent]
+        return await self._atimed("agent", timings, agent.aget_response(messages))
+
+    async def _aget_speculative_response(self, messages, timings):
+        """Async variant of _get_speculative_response, blocked turns cancel the speculative tasks."""
+        start = time.perf_counter()
+
+        guard_task = asyncio.create_task(self._atimed("guard", timings, self.guard_agent.aget_response(messages)))
+        classification_task = asyncio.create_task(self._atimed("classification", timings, self.classification_agent.aget_response(messages)))
+
+        # If the classifier wins the race, start the chosen agent before the guard has answered
+        agent_task = None
+        if self.speculate_agent:
+            done, _ = await asyncio.wait([guard_task, classification_task], return_when=asyncio.FIRST_COMPLETED)
+            if classification_task in done and not guard_task.done():
+                chosen_agent = classification_task.result()["memory"]["classification_decision"]
+                agent = self.agent_dict[chosen_agent]
+                agent_task = asyncio.create_task(self._atimed("agent", timings, agent.aget_response(messages)))
+
+        guard_agent_response = await guard_task
+        if guard_agent_response["memory"]["guard_decision"] == "not allowed":
+            classification_task.cancel()
+            if agent_task is not None:
+                agent_task.cancel()
+            timings["pre_routing"] = self._elapsed_ms(start)
+            logger.info("Request blocked by GuardAgent, discarding speculative results")
+            return guard_agent_response
+
+        classification_agent_response = await classification_task
+        chosen_agent = classification_agent_response["memory"]["classification_decision"]
+        timings["pre_routing"] = self._elapsed_ms(start)
+        logger.info(f"Request classified to agent: {chosen_agent}")
+
+        if agent_task is not None:
+            return await agent_task
+
+        # Get the chosen agent's response
+        agent = self.agent_dict[chosen_agent]
+        return await self._atimed("agent", timings, agent.aget_response(messages))
+
+    async def _aget_gatekeeper_response(self, messages, timings):
+        """Async variant of _get_gatekeeper_response."""
+        start = time.perf_counter()
+
+        # Get GatekeeperAgent's response
+        gatekeeper_agent_response = await self._atimed("gatekeeper", timings, self.gatekeeper_agent.aget_response(messages))
+        timings["pre_routing"] = self._elapsed_ms(start)
+        if gatekeeper_agent_response["memory"]["guard_decision"] == "not allowed":
+            logger.info("Request blocked by GatekeeperAgent")
+            return gatekeeper_agent_response
+
+        chosen_agent = gatekeeper_agent_response["memory"]["classification_decision"]
+        logger.info(f"Request classified to agent: {chosen_agent}")
+
+        # Get the chosen agent's response
+        agent = self.agent_dict[chosen_agent]
+        return await self._atimed("agent", timings, agent.aget_response(messages))
+
+    def _timed(self, stage, timings, func, *args):
+        """Call func and record its wall time in milliseconds under the stage name."""
+        start = time.perf_counter()
+        try:
+            with span(stage):
+                return func(*args)
+        finally:
+            timings[stage] = self._elapsed_ms(start)
+
+    async def _atimed(self, stage, timings, coroutine):
+        """Await the coroutine and record its wall time in milliseconds under the stage name."""
+        start = time.perf_counter()
+        try:
+            with span(stage):
+                return await coroutine
+        finally:
+            timings[stage] = self._elapsed_ms(start)
+
+    @staticmethod
+    def _elapsed_ms(start):
+        return round((time.perf_counter() - start) * 1000, 2)
@@ -1,6 +1,29 @@
+from dotenv import load_dotenv
+
+# Read .env once for every agent module
+load_dotenv()
+
 from .guard_agent import GuardAgent
 from .classification_agent import ClassificationAgent
+from .gatekeeper_agent import GatekeeperAgent
 from .details_agent import DetailsAgent
 from .order_taking_agent import OrderTakingAgent
 from .recommendation_agent import RecommendationAgent
-from .agent_protocol import AgentProtocol
\ No newline at end of file
+from .agent_protocol import AgentProtocol
+from .decision_cache import DecisionCache
+from .intent_classifier import IntentClassifier
+from .order_parser import MenuOrderParser
+from .embedding_cache import EmbeddingCache, get_embedding_cache
+from .semantic_cache import SemanticAnswerCache
+from .client_registry import ClientRegistry, get_client_registry, set_client_registry
+from .recommendation_tables import RecommendationTables
+from .lazy_agent_dict import LazyAgentDict
+from .artifact_store import ArtifactStore, ArtifactWatcher
+from .conversation_view import ConversationView
+from .session_store import SessionStore, InMemorySessionStore, SqliteSessionStore
+from .prompts import PromptTemplate, prompt_stats
+from .json_repair import parse_json_output, repair_json, get_json_repair_stats, JsonRepairError
+from .response_schemas import (GuardOutput, ClassificationOutput, GatekeeperOutput, OrderOutput,
+                               RecommendationClassificationOutput, StructuredOutputError, get_schema_stats)
+from .resilience import ResilientCaller, CircuitBreaker, ModelUnavailableError, request_deadline, get_fallback_stats
+from .tracing import start_trace, span, traced, record_span, run_in_context, get_span_histograms
\ No newline at end of file
@@ -1,5 +1,11 @@
-from typing import Protocol, List, Dict, Any
+from typing import Protocol, List, Dict, Any, Iterator
 
 class AgentProtocol(Protocol):
     def get_response(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
-        ...
\ No newline at end of file
+        ...
+
+    async def aget_response(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        ...
+
+    def stream_response(self, messages: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        ...
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import time
+import logging
+import threading
+from .recommendation_tables import RecommendationTables
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMAT = 1
+REQUIRED_FILES = ("confidence.npy", "tables.json")
+
+class ArtifactStore():
+    """Versioned directory of compiled recommendation tables.
+
+    Every version is a folder with the binary tables and a manifest.json that
+    lists each file with its size and sha256. CURRENT names the active version.
+    Versions are written to a temporary folder and renamed into place, and
+    CURRENT is replaced with os.replace, so a reader never sees a half-written
+    version. Point several workers at the same store (e.g. a network volume)
+    to roll out new artifacts without rebuilding the image.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def current_version(self):
+        """Name of the active version, None if nothing was published yet."""
+        try:
+            with open(os.path.join(self.root, "CURRENT"), "r") as file:
+                return file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.isfile(os.path.join(self.root, name, "manifest.json")))
+
+    def publish(self, tables, version=None, activate=True):
+        """Write tables as a new version and make it the active one unless activate is False."""
+        version = version or time.strftime("%Y%m%d-%H%M%S")
+        directory = os.path.join(self.root, version)
+        if os.path.exists(directory):
+            raise ValueError(f"Artifact version {version} already exists")
+
+        staging = os.path.join(self.root, f".staging-{version}-{os.getpid()}")
+        tables.save(staging)
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "version": version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "files": {name: self._describe(os.path.join(staging, name)) for name in sorted(os.listdir(staging))}
+        }
+        with open(os.path.join(staging, "manifest.json"), "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.rename(staging, directory)
+
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version):
+        """Point CURRENT at an existing version, also used to roll back."""
+        self.read_manifest(version)
+        temp_path = os.path.join(self.root, f".CURRENT-{os.getpid()}")
+        with open(temp_path, "w") as file:
+            file.write(version)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, os.path.join(self.root, "CURRENT"))
+
+    def read_manifest(self, version):
+        with open(os.path.join(self.root, version, "manifest.json"), "r") as file:
+            manifest = json.load(file)
+        if manifest.get("format") != MANIFEST_FORMAT or manifest.get("version") != version:
+            raise ValueError(f"Invalid manifest for artifact version {version}")
+        return manifest
+
+    def verify(self, version):
+        """Raise ValueError unless every file in the manifest is present with the recorded checksum."""
+        manifest = self.read_manifest(version)
+        missing = [name for name in REQUIRED_FILES if name not in manifest["files"]]
+        if missing:
+            raise ValueError(f"Artifact version {version} is missing {missing}")
+        for name, expected in manifest["files"].items():
+            actual = self._describe(os.path.join(self.root, version, name))
+            if actual != expected:
+                raise ValueError(f"Checksum mismatch for {name} in artifact version {version}")
+        return manifest
+
+    def load_tables(self, version, merge="sum"):
+        """Verified and validated tables of a version, raises on any problem."""
+        self.verify(version)
+        tables = RecommendationTables.load(os.path.join(self.root, version), merge=merge, version=version)
+        tables.validate()
+        return tables
+
+    @staticmethod
+    def _describe(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return {"bytes": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+class ArtifactWatcher():
+    """Daemon thread that polls the store and hands a newly activated version to reload.
+
+    reload(version) loads and swaps the version in, or raises to keep the
+    current one. Loading happens on this thread, so requests only ever see
+    the attribute swap. A version that failed is not retried until CURRENT
+    changes again.
+    """
+    def __init__(self, store, reload, interval_seconds=60, version=None):
+        self.store = store
+        self.reload = reload
+        self.interval_seconds = interval_seconds
+        self.version = version
+        self.failed_version = None
+        self.last_error = None
+        self.last_reload_ms = None
+        self.checks = 0
+        self.reloads = 0
+        self.failed_reloads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="artifact-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def check(self):
+        """Reload if CURRENT names a new version, returns True when a version was swapped in."""
+        self.checks += 1
+        version = self.store.current_version()
+        if version is None or version == self.version or version == self.failed_version:
+            return False
+
+        start = time.perf_counter()
+        try:
+            self.reload(version)
+        except Exception as e:
+            self.failed_version = version
+            self.failed_reloads += 1
+            self.last_error = str(e)
+            logger.error(f"Error loading artifact version {version}, keeping {self.version}: {str(e)}")
+            return False
+
+        self.last_reload_ms = round((time.perf_counter() - start) * 1000, 2)
+        logger.info(f"Artifact version {version} loaded in {self.last_reload_ms} ms, replacing {self.version}")
+        self.version = version
+        self.failed_version = None
+        self.reloads += 1
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error checking the artifact store: {str(e)}")
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "checks": self.checks,
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+            "failed_version": self.failed_version,
+            "last_error": self.last_error,
+            "last_reload_ms": self.last_reload_ms
+        }
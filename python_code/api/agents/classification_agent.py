@@ -1,26 +1,16 @@
-from dotenv import load_dotenv
 import os
-import json
-from copy import deepcopy
-from .utils import get_chatbot_response
-import google.generativeai as genai
+from .utils import get_structured_response, aget_structured_response, get_last_user_message
+from .conversation_view import ConversationView
+from .decision_cache import DecisionCache
+from .client_registry import get_client_registry
+from .prompts import PromptTemplate
+from .response_schemas import ClassificationOutput
+from .resilience import ModelUnavailableError, get_fallback_stats
 import logging
 
 logger = logging.getLogger(__name__)
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-load_dotenv()
-
-class ClassificationAgent():
-    def __init__(self):
-        self.model_name = os.getenv("GEMINI_MODEL_NAME") 
-        self.client = genai.GenerativeModel(self.model_name)
-    
-    def get_response(self, messages):
-        try:
-            messages = deepcopy(messages)
-
-            system_prompt = """You are a helpful AI assistant for a coffee shop application.
+SYSTEM_PROMPT = """You are a helpful AI assistant for a coffee shop application.
             Your task is to determine what agent should handle the user input. You have 3 agents to choose from:
             
             1. details_agent: This agent is responsible for answering questions about the coffee shop, like location, delivery places, working hours, details about menu items. Or listing items in the menu items. Or by asking what we have.
@@ -29,87 +19,191 @@ class ClassificationAgent():
 
             Your output MUST be a valid JSON string with this exact format:
             {
-                "chain of thought": "your analysis of which agent should handle this request",
                 "decision": "details_agent OR order_taking_agent OR recommendation_agent",
                 "message": ""
             }
             """
 
+PROMPT = PromptTemplate("classification_agent", SYSTEM_PROMPT, "User message to classify: {user_message}")
+
+class ClassificationAgent():
+    def __init__(self, decision_cache=None, intent_classifier=None, confidence_threshold=0.8):
+        self.model_name = os.getenv("GEMINI_MODEL_NAME") 
+        self.client = get_client_registry().get_model(self.model_name)
+
+        # Local classifier that answers confident turns without calling the LLM
+        self.intent_classifier = intent_classifier
+        self.confidence_threshold = confidence_threshold
+        self.fast_path_hits = 0
+        self.llm_fallbacks = 0
+
+        # Cached decisions are keyed on the prompt version so prompt edits invalidate them
+        self.decision_cache = decision_cache
+        self.prompt_version = DecisionCache.prompt_version(PROMPT.version, str(self.model_name))
+        if self.decision_cache is not None:
+            self.decision_cache.invalidate_stale("classification_agent", self.prompt_version)
+    
+    def get_response(self, messages):
+        try:
+            messages = ConversationView.of(messages)
+
             # Get the last user message
-            user_message = ""
-            for msg in reversed(messages):
-                if msg.get('role') == 'user':
-                    user_message = msg.get('content', '')
-                    break
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                return self._get_empty_message_response()
+
+            # Reuse the decision for a message we have already evaluated
+            cache_key = self._get_cache_key(user_message)
+            if cache_key is not None:
+                cached_response = self.decision_cache.get(cache_key)
+                if cached_response is not None:
+                    return cached_response
+
+            # Answer locally when the intent classifier is confident enough
+            local_response = self._classify_locally(user_message)
+            if local_response is not None:
+                return local_response
+
+            # Get response
+            output = get_structured_response(self.client, self._build_prompt(user_message), ClassificationOutput)
+            return self.postprocess(output, cache_key)
+
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in classification agent, using the local fallback: {str(e)}")
+            return self._get_fallback_response(user_message)
+        except Exception as e:
+            logger.error(f"Error in classification agent: {str(e)}")
+            return self._get_error_response()
+
+    async def aget_response(self, messages):
+        try:
+            messages = ConversationView.of(messages)
 
+            # Get the last user message
+            user_message = get_last_user_message(messages)
             if not user_message:
-                return {
-                    "role": "assistant",
-                    "content": "I couldn't understand your request. Could you please try again?",
-                    "memory": {
-                        "agent": "classification_agent",
-                        "classification_decision": "details_agent"
-                    }
-                }
-
-            # Create the prompt
-            full_prompt = f"{system_prompt}\n\nUser message to classify: {user_message}"
-            
+                return self._get_empty_message_response()
+
+            # Reuse the decision for a message we have already evaluated
+            cache_key = self._get_cache_key(user_message)
+            if cache_key is not None:
+                cached_response = self.decision_cache.get(cache_key)
+                if cached_response is not None:
+                    return cached_response
+
+            # Answer locally when the intent classifier is confident enough
+            local_response = self._classify_locally(user_message)
+            if local_response is not None:
+                return local_response
+
             # Get response
-            response_text = get_chatbot_response(self.client, [{"role": "user", "content": full_prompt}])
-            
-            try:
-                # Try to parse the response as JSON
-                output = json.loads(response_text)
-                
-                # Validate required fields and decision value
-                if not all(key in output for key in ["chain of thought", "decision", "message"]):
-                    raise ValueError("Missing required fields in response")
-                
-                if output["decision"] not in ["details_agent", "order_taking_agent", "recommendation_agent"]:
-                    raise ValueError(f"Invalid decision value: {output['decision']}")
-                
-                return {
-                    "role": "assistant",
-                    "content": "",
-                    "memory": {
-                        "agent": "classification_agent",
-                        "classification_decision": output["decision"]
-                    }
-                }
-                
-            except json.JSONDecodeError:
-                logger.error(f"Invalid JSON response from model: {response_text}")
-                return {
-                    "role": "assistant",
-                    "content": "I apologize, but I encountered an error. Could you please try again?",
-                    "memory": {
-                        "agent": "classification_agent",
-                        "classification_decision": "details_agent"
-                    }
-                }
-                
+            output = await aget_structured_response(self.client, self._build_prompt(user_message), ClassificationOutput)
+            return self.postprocess(output, cache_key)
+
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in classification agent, using the local fallback: {str(e)}")
+            return self._get_fallback_response(user_message)
         except Exception as e:
             logger.error(f"Error in classification agent: {str(e)}")
-            return {
-                "role": "assistant",
-                "content": "I apologize, but I encountered an error. Could you please try again?",
-                "memory": {
-                    "agent": "classification_agent",
-                    "classification_decision": "details_agent"
-                }
+            return self._get_error_response()
+
+    def _build_prompt(self, user_message):
+        """The static system instruction plus the user message to classify."""
+        return PROMPT.render(user_message=user_message)
+
+    def postprocess(self, output, cache_key=None):
+        """Build the routing response from the validated ClassificationOutput."""
+        response = {
+            "role": "assistant",
+            "content": "",
+            "memory": {
+                "agent": "classification_agent",
+                "classification_decision": output.decision
             }
+        }
+        # Failed calls raise before this point, so only real decisions are cached
+        if cache_key is not None:
+            self.decision_cache.set(cache_key, response)
+        return response
+
+    def _classify_locally(self, user_message):
+        """Return the routing response from the local classifier, or None to fall back to the LLM."""
+        if self.intent_classifier is None:
+            return None
+        try:
+            decision, confidence = self.intent_classifier.predict(user_message)
+        except Exception as e:
+            logger.error(f"Error in local intent classifier: {str(e)}")
+            decision, confidence = None, 0.0
 
-    def postprocess(self,output):
-        output = json.loads(output)
+        if confidence < self.confidence_threshold:
+            self.llm_fallbacks += 1
+            return None
 
-        dict_output = {
+        self.fast_path_hits += 1
+        return {
             "role": "assistant",
-            "content": output['message'],
-            "memory": {"agent":"classification_agent",
-                       "classification_decision": output['decision']
-                      }
+            "content": "",
+            "memory": {
+                "agent": "classification_agent",
+                "classification_decision": decision
+            }
         }
-        return dict_output
 
-    
+    def stats(self):
+        """Fast-path counters of the local intent classifier."""
+        decisions = self.fast_path_hits + self.llm_fallbacks
+        return {
+            "fast_path_hits": self.fast_path_hits,
+            "llm_fallbacks": self.llm_fallbacks,
+            "fast_path_rate": round(self.fast_path_hits / decisions, 4) if decisions else 0.0
+        }
+
+    def _get_cache_key(self, user_message):
+        if self.decision_cache is None:
+            return None
+        return self.decision_cache.make_key("classification_agent", self.prompt_version, user_message)
+
+    def _get_empty_message_response(self):
+        return {
+            "role": "assistant",
+            "content": "I couldn't understand your request. Could you please try again?",
+            "memory": {
+                "agent": "classification_agent",
+                "classification_decision": "details_agent"
+            }
+        }
+
+    def _get_fallback_response(self, user_message):
+        """Route with the local classifier, whatever its confidence, while Gemini is unavailable."""
+        get_fallback_stats().record("classification_agent")
+        return {
+            "role": "assistant",
+            "content": "",
+            "memory": {
+                "agent": "classification_agent",
+                "classification_decision": predict_locally(self.intent_classifier, user_message)
+            }
+        }
+
+    def _get_error_response(self):
+        """Generate a standard error response."""
+        return {
+            "role": "assistant",
+            "content": "I apologize, but I encountered an error. Could you please try again?",
+            "memory": {
+                "agent": "classification_agent",
+                "classification_decision": "details_agent"
+            }
+        }
+
+def predict_locally(intent_classifier, user_message, default="details_agent"):
+    """Best guess of the local classifier, default when there is none or it fails."""
+    if intent_classifier is None:
+        return default
+    try:
+        decision, _ = intent_classifier.predict(user_message)
+        return decision
+    except Exception as e:
+        logger.error(f"Error in local intent classifier: {str(e)}")
+        return default
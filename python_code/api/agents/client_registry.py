@@ -0,0 +1,168 @@
+import os
+import time
+import logging
+import threading
+from .resilience import build_resilient_caller
+
+logger = logging.getLogger(__name__)
+
+class ModelClient():
+    """GenerativeModel front that takes the system instruction per call.
+
+    google-generativeai fixes system_instruction when a GenerativeModel is
+    built, so one model is kept per distinct instruction and every call is
+    routed to the right one. Agent prompts have static instructions, so this is
+    a handful of models per process. Every call goes through the model's
+    ResilientCaller, which adds the timeout, retries, hedging and the circuit
+    breaker.
+    """
+    def __init__(self, genai, model_name, caller=None):
+        self._genai = genai
+        self.model_name = model_name
+        self.caller = caller or build_resilient_caller(model_name)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get_model(self, system_instruction=None):
+        model = self._models.get(system_instruction)
+        if model is None:
+            with self._lock:
+                model = self._models.get(system_instruction)
+                if model is None:
+                    model = self._genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+                    self._models[system_instruction] = model
+        return model
+
+    def generate_content(self, contents, system_instruction=None, **kwargs):
+        model = self.get_model(system_instruction)
+        # A stream can't be replayed once chunks are out, so it is retried but never hedged
+        return self.caller.call(lambda timeout: model.generate_content(contents, request_options=get_request_options(timeout), **kwargs),
+                                hedge=not kwargs.get("stream"))
+
+    async def generate_content_async(self, contents, system_instruction=None, **kwargs):
+        model = self.get_model(system_instruction)
+        return await self.caller.acall(lambda timeout: model.generate_content_async(contents, request_options=get_request_options(timeout), **kwargs),
+                                       hedge=not kwargs.get("stream"))
+
+    def count_tokens(self, contents, system_instruction=None):
+        return self.get_model(system_instruction).count_tokens(contents)
+
+    @property
+    def system_instructions(self):
+        return len(self._models)
+
+    def stats(self):
+        return self.caller.stats()
+
+def get_request_options(timeout):
+    return {"timeout": timeout} if timeout is not None else None
+
+class ClientRegistry():
+    """Process-wide Gemini, embedding and Pinecone clients shared by every agent.
+
+    genai.configure is called once, and again only when an embedding client is
+    built (the langchain wrapper reconfigures genai in its constructor), so all
+    models and embeddings go through the same gRPC channel. Pinecone gets one
+    control-plane client with a thread pool and one cached handle per index, so
+    queries reuse its keep-alive HTTP connections instead of building a new
+    handle every time.
+    """
+    def __init__(self, api_key=None, pinecone_pool_threads=4, genai=None):
+        self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        self.pinecone_pool_threads = pinecone_pool_threads
+        self._lock = threading.Lock()
+
+        self._models = {}
+        self._embedding_clients = {}
+        self._pinecone = None
+        self._indexes = {}
+        self.warm_up_ms = None
+
+        # Imported here so that importing the agents package stays cheap, a stand-in
+        # with configure and GenerativeModel can be passed instead for offline runs
+        if genai is None:
+            import google.generativeai as genai
+        self._genai = genai
+        genai.configure(api_key=self.api_key)
+
+    def get_model(self, model_name):
+        """Shared ModelClient for model_name."""
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is None:
+                model = ModelClient(self._genai, model_name)
+                self._models[model_name] = model
+            return model
+
+    def get_embedding_client(self, model_name):
+        """Shared langchain embedding client for model_name."""
+        with self._lock:
+            embedding_client = self._embedding_clients.get(model_name)
+            if embedding_client is None:
+                from langchain_google_genai import GoogleGenerativeAIEmbeddings
+                embedding_client = GoogleGenerativeAIEmbeddings(model=model_name, google_api_key=self.api_key)
+                self._embedding_clients[model_name] = embedding_client
+            return embedding_client
+
+    def get_pinecone_index(self, index_name):
+        """Shared Pinecone index handle, its connection pool is reused across queries."""
+        with self._lock:
+            index = self._indexes.get(index_name)
+            if index is None:
+                if self._pinecone is None:
+                    from pinecone import Pinecone
+                    pinecone_api_key = os.getenv("PINECONE_API_KEY")
+                    if not pinecone_api_key:
+                        raise ValueError("PINECONE_API_KEY not found in environment variables")
+                    self._pinecone = Pinecone(api_key=pinecone_api_key, pool_threads=self.pinecone_pool_threads)
+                index = self._pinecone.Index(index_name)
+                self._indexes[index_name] = index
+            return index
+
+    def warm_up(self, model_names=(), index_names=()):
+        """Open the Gemini channel and the Pinecone connections before the first request.
+
+        count_tokens is a free call on the same channel that generate_content and
+        the embeddings use, describe_index_stats opens the index data-plane connection.
+        """
+        start = time.perf_counter()
+        for model_name in model_names:
+            try:
+                self.get_model(model_name).count_tokens("warm up")
+            except Exception as e:
+                logger.error(f"Error warming up model {model_name}: {str(e)}")
+        for index_name in index_names:
+            try:
+                self.get_pinecone_index(index_name).describe_index_stats()
+            except Exception as e:
+                logger.error(f"Error warming up Pinecone index {index_name}: {str(e)}")
+        self.warm_up_ms = round((time.perf_counter() - start) * 1000, 2)
+        logger.info(f"Client warm-up took {self.warm_up_ms} ms")
+
+    def stats(self):
+        return {
+            "models": len(self._models),
+            "system_instructions": sum(model.system_instructions for model in self._models.values()),
+            "embedding_clients": len(self._embedding_clients),
+            "pinecone_indexes": len(self._indexes),
+            "warm_up_ms": self.warm_up_ms,
+            "resilience": {model_name: model.stats() for model_name, model in self._models.items()}
+        }
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+def get_client_registry():
+    """Process-wide client registry configured from the environment."""
+    global _default_registry
+    if _default_registry is None:
+        with _default_registry_lock:
+            if _default_registry is None:
+                _default_registry = ClientRegistry(pinecone_pool_threads=int(os.getenv("PINECONE_POOL_THREADS", "4")))
+    return _default_registry
+
+def set_client_registry(registry):
+    """Replace the process-wide registry, e.g. with one built on local stand-ins, before the agents are built."""
+    global _default_registry
+    with _default_registry_lock:
+        _default_registry = registry
@@ -0,0 +1,58 @@
+from collections.abc import Sequence
+from types import MappingProxyType
+
+EMPTY_MEMORY = MappingProxyType({})
+
+class ConversationView(Sequence):
+    """Read-only view of a request's messages, shared by every agent in a turn.
+
+    Nothing is copied: indexing and iteration return read-only proxies of the
+    original message dicts. One reverse scan on construction finds the last
+    user message and the latest memory of each agent, so agents read them in
+    O(1) instead of deep-copying and searching the whole history.
+    """
+    def __init__(self, messages):
+        self._messages = messages
+        self.last_user_message = ""
+        self._latest_memory = {}
+
+        found_user_message = False
+        for message in reversed(messages):
+            role = message.get('role')
+            if role == 'user' and not found_user_message:
+                self.last_user_message = message.get('content', '')
+                found_user_message = True
+            elif role == 'assistant':
+                memory = message.get('memory') or {}
+                agent = memory.get('agent')
+                if agent and agent not in self._latest_memory:
+                    self._latest_memory[agent] = memory
+
+    @classmethod
+    def of(cls, messages):
+        """Wrap messages unless they already are a view."""
+        return messages if isinstance(messages, cls) else cls(messages)
+
+    @classmethod
+    def from_session(cls, memories, user_message):
+        """View of a session turn: the stored memory of each agent followed by the new user message."""
+        messages = [{"role": "assistant", "content": "", "memory": memory} for memory in memories.values()]
+        messages.append({"role": "user", "content": user_message})
+        return cls(messages)
+
+    def memories(self):
+        """Latest memory of every agent that has answered, the compact state a session keeps."""
+        return dict(self._latest_memory)
+
+    def latest_memory(self, agent):
+        """Read-only memory of the agent's most recent reply, empty if it hasn't answered yet."""
+        memory = self._latest_memory.get(agent)
+        return EMPTY_MEMORY if memory is None else MappingProxyType(memory)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [MappingProxyType(message) for message in self._messages[index]]
+        return MappingProxyType(self._messages[index])
+
+    def __len__(self):
+        return len(self._messages)
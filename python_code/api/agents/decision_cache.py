@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class DecisionCache():
+    """Bounded LRU cache with a TTL for guard and routing decisions.
+
+    Keys combine a namespace (the agent), the prompt version and the normalized
+    user message, so a changed system prompt never reuses old decisions. When
+    db_path is set, entries are also written to a sqlite file that several
+    workers can share and that survives restarts.
+    """
+    def __init__(self, max_size=1024, ttl_seconds=3600, db_path=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute("""CREATE TABLE IF NOT EXISTS decisions (
+                                        key TEXT PRIMARY KEY,
+                                        namespace TEXT NOT NULL,
+                                        version TEXT NOT NULL,
+                                        value TEXT NOT NULL,
+                                        expires_at REAL NOT NULL)""")
+                self._db.execute("DELETE FROM decisions WHERE expires_at < ?", (time.time(),))
+                self._db.commit()
+            except Exception as e:
+                logger.error(f"Error opening decision cache database: {str(e)}")
+                self._db = None
+
+    @staticmethod
+    def normalize(text):
+        """Lowercase, unify quotes, drop trailing punctuation and collapse whitespace."""
+        text = text.lower().replace("’", "'").replace("‘", "'")
+        text = re.sub(r"[\s]+", " ", text).strip()
+        return text.rstrip(" .!?,;")
+
+    @staticmethod
+    def prompt_version(*parts):
+        """Short hash of the prompt (and anything else the decision depends on)."""
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def make_key(self, namespace, version, message):
+        digest = hashlib.sha256(self.normalize(message).encode("utf-8")).hexdigest()
+        return f"{namespace}:{version}:{digest}"
+
+    def invalidate_stale(self, namespace, version):
+        """Drop every entry of the namespace that was stored under another prompt version."""
+        prefix = f"{namespace}:"
+        current = f"{namespace}:{version}:"
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix) and not key.startswith(current)]:
+                del self._entries[key]
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM decisions WHERE namespace = ? AND version != ?", (namespace, version))
+                    self._db.commit()
+                except Exception as e:
+                    logger.error(f"Error invalidating decision cache: {str(e)}")
+
+    def get(self, key):
+        """Return a fresh copy of the cached decision, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(value)
+                del self._entries[key]
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute("SELECT value, expires_at FROM decisions WHERE key = ?", (key,)).fetchone()
+                except Exception as e:
+                    logger.error(f"Error reading decision cache: {str(e)}")
+                    row = None
+                if row is not None and row[1] >= now:
+                    self._store(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return json.loads(row[0])
+
+            self.misses += 1
+            return None
+
+    def set(self, key, decision):
+        namespace, version, _ = key.split(":", 2)
+        value = json.dumps(decision)
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store(key, value, expires_at)
+            if self._db is not None:
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO decisions VALUES (?, ?, ?, ?, ?)",
+                                     (key, namespace, version, value, expires_at))
+                    self._db.commit()
+                except Exception as e:
+                    logger.error(f"Error writing decision cache: {str(e)}")
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+        }
@@ -1,117 +1,163 @@
-from dotenv import load_dotenv
 import os
-from .utils import get_chatbot_response, get_embedding
-import google.generativeai as genai
+import asyncio
+from .utils import (get_chatbot_response,
+                    aget_chatbot_response,
+                    get_embedding,
+                    aget_embedding,
+                    get_last_user_message,
+                    is_error_response_text,
+                    stream_chatbot_response,
+                    build_stream_chunk,
+                    process_response_text
+                    )
+from .conversation_view import ConversationView
+from .client_registry import get_client_registry
+from .prompts import PromptTemplate
+from .resilience import ModelUnavailableError, UNAVAILABLE_MESSAGE, get_fallback_stats
+from .tracing import traced
 import logging
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from copy import deepcopy
-from pinecone import Pinecone
+from .vector_index import PineconeVectorIndex, LocalVectorIndex
 
 logger = logging.getLogger(__name__)
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-load_dotenv()
+SYSTEM_PROMPT = """You are a customer support agent for a coffee shop called Merry's way. 
+            You should answer every question as if you are a waiter and provide the necessary information 
+            to the user regarding their questions. Be friendly and professional."""
+
+USER_PROMPT = """Using the context below, answer the user's question:
+
+            Context:
+            {source_knowledge}
+
+            User Question: {user_message}
+
+            Remember to be friendly and professional in your response, like a helpful waiter."""
+
+PROMPT = PromptTemplate("details_agent", SYSTEM_PROMPT, USER_PROMPT)
 
 class DetailsAgent():
-    def __init__(self):
+    def __init__(self, answer_cache=None):
         try:
             self.model_name = os.getenv("GEMINI_MODEL_NAME") 
-            self.client = genai.GenerativeModel(self.model_name)
+            self.client = get_client_registry().get_model(self.model_name)
             
             self.embedding_model_name = os.getenv("EMBEDDING_MODEL_NAME")
-            self.embedding_client = GoogleGenerativeAIEmbeddings(model=self.embedding_model_name) 
+            self.embedding_client = get_client_registry().get_embedding_client(self.embedding_model_name) 
             
-            pinecone_api_key = os.getenv("PINECONE_API_KEY")
-            if not pinecone_api_key:
-                raise ValueError("PINECONE_API_KEY not found in environment variables")
-                
-            self.pc = Pinecone(api_key=pinecone_api_key)
-            self.index_name = os.getenv("PINECONE_INDEX_NAME")
-            if not self.index_name:
-                raise ValueError("PINECONE_INDEX_NAME not found in environment variables")
-                
+            # Vector store backend: the hosted Pinecone index or a local precomputed matrix
+            self.vector_backend = os.getenv("VECTOR_BACKEND", "pinecone")
+            if self.vector_backend == "local":
+                current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                index_path = os.getenv("LOCAL_VECTOR_INDEX_PATH", os.path.join(current_dir, 'vector_objects'))
+                self.vector_index = LocalVectorIndex(index_path)
+            elif self.vector_backend == "pinecone":
+                self.index_name = os.getenv("PINECONE_INDEX_NAME")
+                if not self.index_name:
+                    raise ValueError("PINECONE_INDEX_NAME not found in environment variables")
+                self.vector_index = PineconeVectorIndex(self.index_name)
+            else:
+                raise ValueError(f"Unknown vector backend: {self.vector_backend}")
+
+            # Semantic cache of answers to questions over the same retrieved context
+            self.answer_cache = answer_cache
+
         except Exception as e:
             logger.error(f"Error initializing DetailsAgent: {str(e)}")
             raise
     
-    def get_closest_results(self, index_name, input_embeddings, top_k=2):
-        """Get closest results from Pinecone with error handling."""
+    @traced("vector_query")
+    def get_closest_results(self, input_embeddings, top_k=2):
+        """Get closest results from the vector store with error handling."""
         try:
-            index = self.pc.Index(index_name)
-            
-            results = index.query(
-                namespace="ns1",
-                vector=input_embeddings,
-                top_k=top_k,
-                include_values=False,
-                include_metadata=True
-            )
-
-            return results
+            return self.vector_index.query(input_embeddings, top_k=top_k)
         except Exception as e:
             logger.error(f"Error getting closest results: {str(e)}")
             return {"matches": []}
 
     def get_response(self, messages):
         try:
-            messages = deepcopy(messages)
+            messages = ConversationView.of(messages)
 
             # Get the last user message
-            user_message = ""
-            for msg in reversed(messages):
-                if msg.get('role') == 'user':
-                    user_message = msg.get('content', '')
-                    break
-
+            user_message = get_last_user_message(messages)
             if not user_message:
-                return {
-                    "role": "assistant",
-                    "content": "I couldn't understand your request. Could you please try again?",
-                    "memory": {"agent": "details_agent"}
-                }
+                return self._get_error_response("I couldn't understand your request. Could you please try again?")
 
             # Get embeddings
             embedding = get_embedding(self.embedding_client, user_message)
             if not embedding:
-                return {
-                    "role": "assistant",
-                    "content": "I apologize, but I'm having trouble processing your request. Could you please try again?",
-                    "memory": {"agent": "details_agent"}
-                }
+                return self._get_error_response("I apologize, but I'm having trouble processing your request. Could you please try again?")
 
             # Get relevant context
-            result = self.get_closest_results(self.index_name, embedding[0])
-            source_knowledge = "\n".join([x['metadata']['text'].strip()+'\n' for x in result['matches']])
-
+            result = self.get_closest_results(embedding)
+            source_knowledge = self._get_source_knowledge(result)
             if not source_knowledge:
+                return self._get_error_response("I apologize, but I couldn't find the information you're looking for. Could you please try asking in a different way?")
+
+            # Reuse the answer to a near-identical question over the same context
+            context_ids = [match['id'] for match in result['matches']]
+            cached_answer = self._get_cached_answer(user_message, embedding, context_ids)
+            if cached_answer is not None:
                 return {
                     "role": "assistant",
-                    "content": "I apologize, but I couldn't find the information you're looking for. Could you please try asking in a different way?",
+                    "content": cached_answer,
                     "memory": {"agent": "details_agent"}
                 }
 
-            # Create the prompt
-            system_prompt = """You are a customer support agent for a coffee shop called Merry's way. 
-            You should answer every question as if you are a waiter and provide the necessary information 
-            to the user regarding their questions. Be friendly and professional."""
+            # Get response
+            response_text = get_chatbot_response(self.client, self._build_prompt(user_message, source_knowledge))
+            self._store_answer(user_message, embedding, context_ids, response_text)
 
-            prompt = f"""Using the context below, answer the user's question:
+            return {
+                "role": "assistant",
+                "content": response_text,
+                "memory": {"agent": "details_agent"}
+            }
 
-            Context:
-            {source_knowledge}
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in details agent, sending the canned reply: {str(e)}")
+            get_fallback_stats().record("details_agent")
+            return self._get_error_response(UNAVAILABLE_MESSAGE)
+        except Exception as e:
+            logger.error(f"Error in details agent: {str(e)}")
+            return self._get_error_response("I apologize, but I encountered an error. Could you please try again?")
 
-            User Question: {user_message}
+    async def aget_response(self, messages):
+        try:
+            messages = ConversationView.of(messages)
 
-            Remember to be friendly and professional in your response, like a helpful waiter."""
+            # Get the last user message
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                return self._get_error_response("I couldn't understand your request. Could you please try again?")
+
+            # Get embeddings
+            embedding = await aget_embedding(self.embedding_client, user_message)
+            if not embedding:
+                return self._get_error_response("I apologize, but I'm having trouble processing your request. Could you please try again?")
+
+            # Get relevant context, the Pinecone client is blocking so it runs in a worker thread
+            if self.vector_backend == "local":
+                result = self.get_closest_results(embedding)
+            else:
+                result = await asyncio.to_thread(self.get_closest_results, embedding)
+            source_knowledge = self._get_source_knowledge(result)
+            if not source_knowledge:
+                return self._get_error_response("I apologize, but I couldn't find the information you're looking for. Could you please try asking in a different way?")
+
+            # Reuse the answer to a near-identical question over the same context
+            context_ids = [match['id'] for match in result['matches']]
+            cached_answer = self._get_cached_answer(user_message, embedding, context_ids)
+            if cached_answer is not None:
+                return {
+                    "role": "assistant",
+                    "content": cached_answer,
+                    "memory": {"agent": "details_agent"}
+                }
 
             # Get response
-            response_text = get_chatbot_response(
-                self.client, 
-                [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ]
-            )
+            response_text = await aget_chatbot_response(self.client, self._build_prompt(user_message, source_knowledge))
+            self._store_answer(user_message, embedding, context_ids, response_text)
 
             return {
                 "role": "assistant",
@@ -119,12 +165,101 @@ class DetailsAgent():
                 "memory": {"agent": "details_agent"}
             }
 
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in details agent, sending the canned reply: {str(e)}")
+            get_fallback_stats().record("details_agent")
+            return self._get_error_response(UNAVAILABLE_MESSAGE)
         except Exception as e:
             logger.error(f"Error in details agent: {str(e)}")
-            return {
+            return self._get_error_response("I apologize, but I encountered an error. Could you please try again?")
+
+    def stream_response(self, messages):
+        """Streaming variant of get_response, yields partial chunks and then the full response."""
+        try:
+            messages = ConversationView.of(messages)
+
+            # Get the last user message
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                yield self._get_error_response("I couldn't understand your request. Could you please try again?")
+                return
+
+            # Get embeddings
+            embedding = get_embedding(self.embedding_client, user_message)
+            if not embedding:
+                yield self._get_error_response("I apologize, but I'm having trouble processing your request. Could you please try again?")
+                return
+
+            # Get relevant context
+            result = self.get_closest_results(embedding)
+            source_knowledge = self._get_source_knowledge(result)
+            if not source_knowledge:
+                yield self._get_error_response("I apologize, but I couldn't find the information you're looking for. Could you please try asking in a different way?")
+                return
+
+            # A cached answer is sent as a single final chunk
+            context_ids = [match['id'] for match in result['matches']]
+            cached_answer = self._get_cached_answer(user_message, embedding, context_ids)
+            if cached_answer is not None:
+                yield {
+                    "role": "assistant",
+                    "content": cached_answer,
+                    "memory": {"agent": "details_agent"}
+                }
+                return
+
+            # Stream the response
+            chunks = []
+            for chunk in stream_chatbot_response(self.client, self._build_prompt(user_message, source_knowledge)):
+                chunks.append(chunk)
+                yield build_stream_chunk(chunk)
+
+            response_text = process_response_text("".join(chunks))
+            self._store_answer(user_message, embedding, context_ids, response_text)
+
+            yield {
                 "role": "assistant",
-                "content": "I apologize, but I encountered an error. Could you please try again?",
+                "content": response_text,
                 "memory": {"agent": "details_agent"}
             }
 
-    
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in details agent stream, sending the canned reply: {str(e)}")
+            get_fallback_stats().record("details_agent")
+            yield self._get_error_response(UNAVAILABLE_MESSAGE)
+        except Exception as e:
+            logger.error(f"Error in details agent stream: {str(e)}")
+            yield self._get_error_response("I apologize, but I encountered an error. Could you please try again?")
+
+    def _get_cached_answer(self, user_message, embedding, context_ids):
+        if self.answer_cache is None:
+            return None
+        try:
+            return self.answer_cache.lookup(user_message, embedding, context_ids, self.vector_index.version)
+        except Exception as e:
+            logger.error(f"Error reading semantic answer cache: {str(e)}")
+            return None
+
+    def _store_answer(self, user_message, embedding, context_ids, response_text):
+        if self.answer_cache is None or is_error_response_text(response_text):
+            return
+        try:
+            self.answer_cache.store(user_message, embedding, context_ids, response_text, self.vector_index.version)
+        except Exception as e:
+            logger.error(f"Error writing semantic answer cache: {str(e)}")
+
+    def _get_source_knowledge(self, result):
+        """Join the retrieved documents into the context for the prompt."""
+        return "\n".join([x['metadata']['text'].strip()+'\n' for x in result['matches']])
+
+    def _build_prompt(self, user_message, source_knowledge):
+        """Fill the retrieved context and the question into the answer prompt."""
+        return PROMPT.render(source_knowledge=source_knowledge, user_message=user_message)
+
+    def _get_error_response(self, message):
+        """Generate a standard error response."""
+        return {
+            "role": "assistant",
+            "content": message,
+            "memory": {"agent": "details_agent"}
+        }
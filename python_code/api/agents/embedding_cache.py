@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache():
+    """Two-level cache for embeddings: an in-memory LRU plus an optional sqlite tier.
+
+    Keys combine the embedding model, the task ("query" or "document", the
+    model embeds them differently) and the normalized text. Vectors are kept
+    as float32 and written to sqlite as raw float32 blobs.
+    """
+    def __init__(self, max_size=2048, db_path=None):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_bytes = 0
+
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                                        key TEXT PRIMARY KEY,
+                                        model TEXT NOT NULL,
+                                        dimension INTEGER NOT NULL,
+                                        vector BLOB NOT NULL)""")
+                self._db.commit()
+            except Exception as e:
+                logger.error(f"Error opening embedding cache database: {str(e)}")
+                self._db = None
+
+    @staticmethod
+    def normalize(text):
+        return re.sub(r"\s+", " ", text.lower()).strip()
+
+    def make_key(self, model, task, text):
+        digest = hashlib.sha256(self.normalize(text).encode("utf-8")).hexdigest()
+        return f"{model}:{task}:{digest}"
+
+    def get(self, key):
+        """Return the cached vector as a list of floats, or None."""
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector.tolist()
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                except Exception as e:
+                    logger.error(f"Error reading embedding cache: {str(e)}")
+                    row = None
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._store(key, vector)
+                    self.disk_hits += 1
+                    return vector.tolist()
+
+            self.misses += 1
+            return None
+
+    def set(self, key, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._store(key, vector)
+            if self._db is not None:
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                                     (key, key.split(":", 1)[0], int(vector.shape[0]), vector.tobytes()))
+                    self._db.commit()
+                except Exception as e:
+                    logger.error(f"Error writing embedding cache: {str(e)}")
+
+    def _store(self, key, vector):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.memory_bytes -= previous.nbytes
+        self._entries[key] = vector
+        self.memory_bytes += vector.nbytes
+        while len(self._entries) > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        disk_bytes = 0
+        if self._db is not None:
+            with self._lock:
+                disk_bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_bytes": self.memory_bytes,
+            "disk_bytes": disk_bytes
+        }
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    """Process-wide embedding cache configured from the environment, None when disabled."""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                max_size = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+                if max_size <= 0:
+                    return None
+                _default_cache = EmbeddingCache(max_size=max_size, db_path=os.getenv("EMBEDDING_CACHE_PATH"))
+    return _default_cache
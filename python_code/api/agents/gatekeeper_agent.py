@@ -0,0 +1,166 @@
+import os
+from .utils import get_structured_response, aget_structured_response, get_last_user_message
+from .conversation_view import ConversationView
+from .decision_cache import DecisionCache
+from .client_registry import get_client_registry
+from .prompts import PromptTemplate
+from .response_schemas import GatekeeperOutput, AGENT_NAMES
+from .resilience import ModelUnavailableError, UNAVAILABLE_MESSAGE, get_fallback_stats
+import logging
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = """You are the gatekeeper of a coffee shop application which serves drinks and pastries.
+            For the user message you make two decisions.
+
+            1. guard_decision: "allowed" if the message is relevant to the coffee shop, otherwise "not allowed".
+            Allowed: questions about the shop (location, working hours, delivery), questions about menu items and their
+            ingredients, making, modifying or finishing an order (including "that's all", "I'm done", "that's it"),
+            asking for recommendations, and answering questions about their order.
+            Not allowed: anything unrelated to our coffee shop, questions about the staff or how to make a menu item.
+
+            2. classification_decision: the agent that should answer an allowed message.
+            details_agent: questions about the shop or menu items, or listing what we have.
+            order_taking_agent: taking, changing or completing an order.
+            recommendation_agent: the user asks what to buy.
+
+            IMPORTANT RESPONSE FORMAT:
+            Your output MUST be a raw JSON string with NO markdown formatting or code blocks.
+            Just return the raw JSON with this exact format:
+            {
+                "guard_decision": "allowed OR not allowed",
+                "classification_decision": "details_agent OR order_taking_agent OR recommendation_agent",
+                "message": "error message if not allowed, empty if allowed"
+            }
+            """
+
+PROMPT = PromptTemplate("gatekeeper_agent", SYSTEM_PROMPT, "User message to evaluate: {user_message}")
+
+class GatekeeperAgent():
+    """Makes the guard and the routing decision for a turn in a single generation."""
+    def __init__(self, decision_cache=None):
+        try:
+            self.model_name = os.getenv("GEMINI_MODEL_NAME")
+            if not self.model_name:
+                raise ValueError("GEMINI_MODEL_NAME not found in environment variables")
+
+            self.client = get_client_registry().get_model(self.model_name)
+
+            # Cached decisions are keyed on the prompt version so prompt edits invalidate them
+            self.decision_cache = decision_cache
+            self.prompt_version = DecisionCache.prompt_version(PROMPT.version, self.model_name)
+            if self.decision_cache is not None:
+                self.decision_cache.invalidate_stale("gatekeeper_agent", self.prompt_version)
+
+        except Exception as e:
+            logger.error(f"Error initializing GatekeeperAgent: {str(e)}")
+            raise
+
+    def get_response(self, messages):
+        try:
+            messages = ConversationView.of(messages)
+
+            # Get the last user message
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                return self._get_error_response("I couldn't understand your request. Could you please try again?")
+
+            # Reuse the decision for a message we have already evaluated
+            cache_key = self._get_cache_key(user_message)
+            if cache_key is not None:
+                cached_response = self.decision_cache.get(cache_key)
+                if cached_response is not None:
+                    return cached_response
+
+            # Get response
+            output = get_structured_response(self.client, self._build_prompt(user_message), GatekeeperOutput)
+            return self.postprocess(output, cache_key)
+
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in gatekeeper agent, using the local fallback: {str(e)}")
+            return self._get_fallback_response()
+        except Exception as e:
+            logger.error(f"Error in gatekeeper agent: {str(e)}")
+            return self._get_error_response("I apologize, but I encountered an error. Could you please try again?")
+
+    async def aget_response(self, messages):
+        try:
+            messages = ConversationView.of(messages)
+
+            # Get the last user message
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                return self._get_error_response("I couldn't understand your request. Could you please try again?")
+
+            # Reuse the decision for a message we have already evaluated
+            cache_key = self._get_cache_key(user_message)
+            if cache_key is not None:
+                cached_response = self.decision_cache.get(cache_key)
+                if cached_response is not None:
+                    return cached_response
+
+            # Get response
+            output = await aget_structured_response(self.client, self._build_prompt(user_message), GatekeeperOutput)
+            return self.postprocess(output, cache_key)
+
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in gatekeeper agent, using the local fallback: {str(e)}")
+            return self._get_fallback_response()
+        except Exception as e:
+            logger.error(f"Error in gatekeeper agent: {str(e)}")
+            return self._get_error_response("I apologize, but I encountered an error. Could you please try again?")
+
+    def _build_prompt(self, user_message):
+        """The static system instruction plus the user message to evaluate."""
+        return PROMPT.render(user_message=user_message)
+
+    def postprocess(self, output, cache_key=None):
+        """Build the combined guard and routing response from the validated GatekeeperOutput."""
+        classification_decision = output.classification_decision
+        if classification_decision not in AGENT_NAMES:
+            logger.error(f"Invalid classification decision: {classification_decision}")
+            classification_decision = "details_agent"
+
+        response = {
+            "role": "assistant",
+            "content": output.message if output.guard_decision == "not allowed" else "",
+            "memory": {
+                "agent": "gatekeeper_agent",
+                "guard_decision": output.guard_decision,
+                "classification_decision": classification_decision
+            }
+        }
+        # Failed calls raise before this point, so only real decisions are cached
+        if cache_key is not None:
+            self.decision_cache.set(cache_key, response)
+        return response
+
+    def _get_cache_key(self, user_message):
+        if self.decision_cache is None:
+            return None
+        return self.decision_cache.make_key("gatekeeper_agent", self.prompt_version, user_message)
+
+    def _get_fallback_response(self):
+        """Hold the turn while Gemini is unavailable, an unchecked turn must not reach the other agents."""
+        get_fallback_stats().record("gatekeeper_agent")
+        return {
+            "role": "assistant",
+            "content": UNAVAILABLE_MESSAGE,
+            "memory": {
+                "agent": "gatekeeper_agent",
+                "guard_decision": "not allowed",
+                "classification_decision": "details_agent"
+            }
+        }
+
+    def _get_error_response(self, message):
+        """Generate a standard error response."""
+        return {
+            "role": "assistant",
+            "content": message,
+            "memory": {
+                "agent": "gatekeeper_agent",
+                "guard_decision": "not allowed",
+                "classification_decision": "details_agent"
+            }
+        }
@@ -1,34 +1,16 @@
-from dotenv import load_dotenv
 import os
-import json
-from copy import deepcopy
-from .utils import get_chatbot_response
-import google.generativeai as genai
+from .utils import get_structured_response, aget_structured_response, get_last_user_message
+from .conversation_view import ConversationView
+from .decision_cache import DecisionCache
+from .client_registry import get_client_registry
+from .prompts import PromptTemplate
+from .response_schemas import GuardOutput
+from .resilience import ModelUnavailableError, UNAVAILABLE_MESSAGE, get_fallback_stats
 import logging
 
 logger = logging.getLogger(__name__)
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-load_dotenv()
-
-class GuardAgent():
-    def __init__(self):
-        try:
-            self.model_name = os.getenv("GEMINI_MODEL_NAME") 
-            if not self.model_name:
-                raise ValueError("GEMINI_MODEL_NAME not found in environment variables")
-                
-            self.client = genai.GenerativeModel(self.model_name)
-            
-        except Exception as e:
-            logger.error(f"Error initializing GuardAgent: {str(e)}")
-            raise
-    
-    def get_response(self, messages):
-        try:
-            messages = deepcopy(messages)
-
-            system_prompt = """You are a helpful AI assistant for a coffee shop application which serves drinks and pastries.
+SYSTEM_PROMPT = """You are a helpful AI assistant for a coffee shop application which serves drinks and pastries.
             Your task is to determine whether the user is asking something relevant to the coffee shop or not.
             
             The user is allowed to:
@@ -47,86 +29,139 @@ class GuardAgent():
             Do NOT wrap the JSON in ```json or ``` markers.
             Just return the raw JSON with this exact format:
             {
-                "chain of thought": "your analysis of the user's request",
                 "decision": "allowed OR not allowed",
                 "message": "error message if not allowed, empty if allowed"
             }
             """
 
+PROMPT = PromptTemplate("guard_agent", SYSTEM_PROMPT, "User message to evaluate: {user_message}")
+
+class GuardAgent():
+    def __init__(self, decision_cache=None):
+        try:
+            self.model_name = os.getenv("GEMINI_MODEL_NAME") 
+            if not self.model_name:
+                raise ValueError("GEMINI_MODEL_NAME not found in environment variables")
+                
+            self.client = get_client_registry().get_model(self.model_name)
+
+            # Cached decisions are keyed on the prompt version so prompt edits invalidate them
+            self.decision_cache = decision_cache
+            self.prompt_version = DecisionCache.prompt_version(PROMPT.version, self.model_name)
+            if self.decision_cache is not None:
+                self.decision_cache.invalidate_stale("guard_agent", self.prompt_version)
+            
+        except Exception as e:
+            logger.error(f"Error initializing GuardAgent: {str(e)}")
+            raise
+    
+    def get_response(self, messages):
+        try:
+            messages = ConversationView.of(messages)
+
             # Get the last user message
-            user_message = ""
-            for msg in reversed(messages):
-                if msg.get('role') == 'user':
-                    user_message = msg.get('content', '')
-                    break
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                return self._get_empty_message_response()
 
+            # Reuse the decision for a message we have already evaluated
+            cache_key = self._get_cache_key(user_message)
+            if cache_key is not None:
+                cached_response = self.decision_cache.get(cache_key)
+                if cached_response is not None:
+                    return cached_response
+
+            # Get response
+            output = get_structured_response(self.client, self._build_prompt(user_message), GuardOutput)
+            return self.postprocess(output, cache_key)
+
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in guard agent, using the local fallback: {str(e)}")
+            return self._get_fallback_response()
+        except Exception as e:
+            logger.error(f"Error in guard agent: {str(e)}")
+            return self._get_error_response()
+
+    async def aget_response(self, messages):
+        try:
+            messages = ConversationView.of(messages)
+
+            # Get the last user message
+            user_message = get_last_user_message(messages)
             if not user_message:
-                return {
-                    "role": "assistant",
-                    "content": "I couldn't understand your request. Could you please try again?",
-                    "memory": {
-                        "agent": "guard_agent",
-                        "guard_decision": "not allowed"
-                    }
-                }
-
-            # Create the prompt
-            full_prompt = f"{system_prompt}\n\nUser message to evaluate: {user_message}"
-            
+                return self._get_empty_message_response()
+
+            # Reuse the decision for a message we have already evaluated
+            cache_key = self._get_cache_key(user_message)
+            if cache_key is not None:
+                cached_response = self.decision_cache.get(cache_key)
+                if cached_response is not None:
+                    return cached_response
+
             # Get response
-            response_text = get_chatbot_response(self.client, [{"role": "user", "content": full_prompt}])
-            
-            try:
-                # Try to parse the response as JSON
-                output = json.loads(response_text)
-                
-                # Validate required fields
-                if not all(key in output for key in ["chain of thought", "decision", "message"]):
-                    raise ValueError("Missing required fields in response")
-                
-                return {
-                    "role": "assistant",
-                    "content": output["message"] if output["decision"] == "not allowed" else "",
-                    "memory": {
-                        "agent": "guard_agent",
-                        "guard_decision": output["decision"]
-                    }
-                }
-                
-            except json.JSONDecodeError:
-                logger.error(f"Invalid JSON response from model: {response_text}")
-                return {
-                    "role": "assistant",
-                    "content": "I apologize, but I encountered an error. Could you please try again?",
-                    "memory": {
-                        "agent": "guard_agent",
-                        "guard_decision": "not allowed"
-                    }
-                }
-                
+            output = await aget_structured_response(self.client, self._build_prompt(user_message), GuardOutput)
+            return self.postprocess(output, cache_key)
+
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in guard agent, using the local fallback: {str(e)}")
+            return self._get_fallback_response()
         except Exception as e:
             logger.error(f"Error in guard agent: {str(e)}")
-            return {
-                "role": "assistant",
-                "content": "I apologize, but I encountered an error. Could you please try again?",
-                "memory": {
-                    "agent": "guard_agent",
-                    "guard_decision": "not allowed"
-                }
-            }
+            return self._get_error_response()
 
-    def postprocess(self,output):
-        output = json.loads(output)
+    def _build_prompt(self, user_message):
+        """The static system instruction plus the user message to evaluate."""
+        return PROMPT.render(user_message=user_message)
 
-        dict_output = {
+    def postprocess(self, output, cache_key=None):
+        """Build the guard response from the validated GuardOutput."""
+        response = {
             "role": "assistant",
-            "content": output['message'],
-            "memory": {"agent":"guard_agent",
-                       "guard_decision": output['decision']
-                      }
+            "content": output.message if output.decision == "not allowed" else "",
+            "memory": {
+                "agent": "guard_agent",
+                "guard_decision": output.decision
+            }
         }
-        return dict_output
+        # Failed calls raise before this point, so only real decisions are cached
+        if cache_key is not None:
+            self.decision_cache.set(cache_key, response)
+        return response
 
+    def _get_cache_key(self, user_message):
+        if self.decision_cache is None:
+            return None
+        return self.decision_cache.make_key("guard_agent", self.prompt_version, user_message)
 
+    def _get_empty_message_response(self):
+        return {
+            "role": "assistant",
+            "content": "I couldn't understand your request. Could you please try again?",
+            "memory": {
+                "agent": "guard_agent",
+                "guard_decision": "not allowed"
+            }
+        }
 
-    
+    def _get_fallback_response(self):
+        """Hold the turn while Gemini is unavailable, an unchecked turn must not reach the other agents."""
+        get_fallback_stats().record("guard_agent")
+        return {
+            "role": "assistant",
+            "content": UNAVAILABLE_MESSAGE,
+            "memory": {
+                "agent": "guard_agent",
+                "guard_decision": "not allowed"
+            }
+        }
+
+    def _get_error_response(self):
+        """Generate a standard error response."""
+        return {
+            "role": "assistant",
+            "content": "I apologize, but I encountered an error. Could you please try again?",
+            "memory": {
+                "agent": "guard_agent",
+                "guard_decision": "not allowed"
+            }
+        }
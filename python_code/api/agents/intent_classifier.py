@@ -0,0 +1,96 @@
+import re
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+def extract_terms(text):
+    """Word unigrams, word bigrams and character trigrams of the lowercased text."""
+    tokens = [token.strip("'") for token in TOKEN_PATTERN.findall(text.lower())]
+    tokens = [token for token in tokens if token]
+    terms = list(tokens)
+    terms.extend(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    for token in tokens:
+        padded = f"<{token}>"
+        terms.extend(f"#{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return terms
+
+class IntentClassifier():
+    """Nearest-centroid TF-IDF classifier over the routing labels.
+
+    The artifact is a .npz file holding the vocabulary, the idf weights, one
+    L2-normalized centroid per label and the softmax temperature that turns
+    cosine similarities into a confidence.
+    """
+    def __init__(self, vocabulary, idf, centroids, labels, temperature=0.05):
+        self.vocabulary = {term: i for i, term in enumerate(vocabulary)}
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.labels = [str(label) for label in labels]
+        self.temperature = float(temperature)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as artifact:
+            return cls(artifact["vocabulary"].tolist(),
+                       artifact["idf"],
+                       artifact["centroids"],
+                       artifact["labels"].tolist(),
+                       float(artifact["temperature"]))
+
+    def save(self, path):
+        vocabulary = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez_compressed(path,
+                            vocabulary=np.array(vocabulary),
+                            idf=self.idf,
+                            centroids=self.centroids,
+                            labels=np.array(self.labels),
+                            temperature=np.float32(self.temperature))
+
+    @classmethod
+    def train(cls, texts, labels, temperature=0.05, min_df=1):
+        """Fit idf weights and label centroids from labeled utterances."""
+        documents = [extract_terms(text) for text in texts]
+
+        document_frequency = {}
+        for terms in documents:
+            for term in set(terms):
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+        vocabulary = sorted(term for term, count in document_frequency.items() if count >= min_df)
+        counts = np.array([document_frequency[term] for term in vocabulary], dtype=np.float32)
+        idf = np.log((1 + len(documents)) / (1 + counts)) + 1
+
+        classifier = cls(vocabulary, idf, np.zeros((0, len(vocabulary))), [], temperature)
+        matrix = np.stack([classifier._vectorize_terms(terms) for terms in documents])
+
+        label_names = sorted(set(labels))
+        label_array = np.array(labels)
+        centroids = np.stack([matrix[label_array == label].mean(axis=0) for label in label_names])
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+
+        classifier.centroids = centroids.astype(np.float32)
+        classifier.labels = label_names
+        return classifier
+
+    def _vectorize_terms(self, terms):
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        indices = [self.vocabulary[term] for term in terms if term in self.vocabulary]
+        if indices:
+            np.add.at(vector, indices, 1.0)
+            vector *= self.idf
+            vector /= np.linalg.norm(vector)
+        return vector
+
+    def predict(self, text):
+        """Return (label, confidence) for the text, confidence is 0 when no known term is present."""
+        vector = self._vectorize_terms(extract_terms(text))
+        if not vector.any():
+            return self.labels[0], 0.0
+
+        similarities = self.centroids @ vector
+        scores = np.exp((similarities - similarities.max()) / self.temperature)
+        probabilities = scores / scores.sum()
+        best = int(probabilities.argmax())
+        return self.labels[best], float(probabilities[best])
@@ -0,0 +1,223 @@
+import re
+import threading
+import orjson
+from .tracing import span
+
+FENCE_PATTERN = re.compile(r'^\s*```\w*\s*\n?|\n?\s*```\s*$')
+VALID_ESCAPES = set('"\\/bfnrtu')
+LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+NUMBER_PATTERN = re.compile(r'-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?$')
+WORD_CHARS = re.compile(r'[A-Za-z0-9_.+\-]+')
+CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+VALUE_END = ("string", "literal", "}", "]")
+
+class JsonRepairError(ValueError):
+    pass
+
+class JsonRepairStats():
+    """How model JSON was recovered: as is, by the local repair, by the LLM, or not at all."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clean = 0
+        self.repaired = 0
+        self.llm_repairs = 0
+        self.failed = 0
+
+    def count(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def stats(self):
+        total = self.clean + self.repaired + self.llm_repairs + self.failed
+        broken = self.repaired + self.llm_repairs + self.failed
+        return {
+            "clean": self.clean,
+            "repaired": self.repaired,
+            "llm_repairs": self.llm_repairs,
+            "failed": self.failed,
+            "local_repair_rate": round(self.repaired / broken, 4) if broken else 1.0,
+            "parse_rate": round((total - self.failed) / total, 4) if total else 1.0
+        }
+
+_stats = JsonRepairStats()
+
+def get_json_repair_stats():
+    return _stats
+
+def parse_json_output(text):
+    """Parse a model reply into Python objects, repairing it locally if needed.
+
+    Returns (value, repaired). Raises JsonRepairError when there is no JSON
+    object or array to recover.
+    """
+    try:
+        return orjson.loads(text), False
+    except (orjson.JSONDecodeError, TypeError):
+        pass
+    if not isinstance(text, str):
+        raise JsonRepairError(f"Expected a string, got {type(text).__name__}")
+
+    with span("json_repair"):
+        try:
+            return orjson.loads(repair_json(text)), True
+        except orjson.JSONDecodeError as e:
+            raise JsonRepairError(f"Could not repair JSON: {str(e)}")
+
+def repair_json(text):
+    """Rewrite a near-JSON model reply as strict JSON.
+
+    Handles code fences and text around the object, single-quoted strings,
+    raw newlines and stray quotes inside strings, invalid escapes, comments,
+    Python literals, unquoted keys, missing and trailing commas, and output cut
+    off at max_output_tokens (the open string is closed, a dangling key is
+    dropped and the open brackets are closed).
+    """
+    text = FENCE_PATTERN.sub('', text)
+    starts = [index for index in (text.find('{'), text.find('[')) if index >= 0]
+    if not starts:
+        raise JsonRepairError("No JSON object or array found")
+
+    tokens = []
+    kinds = []
+    stack = []
+    i = min(starts)
+    n = len(text)
+
+    def emit(token, kind):
+        # Insert the comma the model forgot between two values
+        if kind in ("string", "literal", "{", "[") and kinds and kinds[-1] in VALUE_END:
+            tokens.append(",")
+            kinds.append(",")
+        tokens.append(token)
+        kinds.append(kind)
+
+    while i < n:
+        char = text[i]
+        if char in '"\'':
+            value, i, closed = _read_string(text, i, char)
+            emit('"' + value + '"', "string")
+            if not closed:
+                break
+        elif char in '{[':
+            emit(char, char)
+            stack.append('}' if char == '{' else ']')
+            i += 1
+        elif char in '}]':
+            while kinds and kinds[-1] in (",", ":"):
+                _pop_dangling(tokens, kinds)
+            if stack and stack[-1] == char:
+                stack.pop()
+                tokens.append(char)
+                kinds.append(char)
+            i += 1
+            if not stack:
+                break
+        elif char in ',:':
+            if kinds and kinds[-1] not in (",", ":", "{", "["):
+                tokens.append(char)
+                kinds.append(char)
+            i += 1
+        elif char == '/' and text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end < 0 else end + 1
+        elif char == '/' and text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+        elif char.isspace():
+            i += 1
+        else:
+            match = WORD_CHARS.match(text, i)
+            if match is None:
+                i += 1
+                continue
+            word = match.group(0)
+            i = match.end()
+            if word in LITERALS:
+                emit(LITERALS[word], "literal")
+            elif NUMBER_PATTERN.match(word):
+                emit(word, "literal")
+            elif i >= n:
+                # A literal or number cut off by the token limit
+                break
+            else:
+                # Unquoted key or bare word value
+                emit('"' + word + '"', "string")
+
+    # Drop a trailing comma, a key without a value and a truncated pair
+    while kinds and kinds[-1] in (",", ":"):
+        _pop_dangling(tokens, kinds)
+    if stack and stack[-1] == '}' and kinds and kinds[-1] == "string" and len(kinds) > 1 and kinds[-2] in ("{", ","):
+        tokens.pop()
+        kinds.pop()
+        while kinds and kinds[-1] == ",":
+            tokens.pop()
+            kinds.pop()
+
+    return "".join(tokens) + "".join(reversed(stack))
+
+def _pop_dangling(tokens, kinds):
+    """Remove a trailing comma, or a trailing colon together with its key."""
+    kind = kinds.pop()
+    tokens.pop()
+    if kind == ":" and kinds and kinds[-1] == "string":
+        tokens.pop()
+        kinds.pop()
+
+def _read_string(text, start, quote):
+    """JSON-escaped contents of the string at start, the index after it and whether it was closed."""
+    parts = []
+    i = start + 1
+    n = len(text)
+    while i < n:
+        char = text[i]
+        if char == '\\':
+            if i + 1 >= n:
+                return "".join(parts), n, False
+            escaped = text[i + 1]
+            if escaped == "'":
+                parts.append("'")
+            elif escaped == 'u' and not re.match(r'[0-9a-fA-F]{4}', text[i + 2:i + 6]):
+                parts.append('\\\\u')
+            elif escaped in VALID_ESCAPES:
+                parts.append('\\' + escaped)
+            else:
+                parts.append('\\\\' + escaped)
+            i += 2
+            continue
+        if char == quote:
+            if _closes_string(text, i + 1):
+                return "".join(parts), i + 1, True
+            # A quote that isn't followed by a delimiter is part of the text
+            parts.append('\\"' if quote == '"' else "'")
+        elif char == '"':
+            parts.append('\\"')
+        elif char in CONTROL_ESCAPES:
+            parts.append(CONTROL_ESCAPES[char])
+        elif char < ' ':
+            parts.append(f"\\u{ord(char):04x}")
+        else:
+            parts.append(char)
+        i += 1
+    return "".join(parts), n, False
+
+def _closes_string(text, index):
+    """True if the quote before index ends the string rather than being part of its text."""
+    following = text[index:index + 64]
+    rest = following.lstrip()
+    if not rest or rest[0] in ':}]' or rest.startswith(('```', '//', '/*')):
+        return True
+    if rest[0] == ',':
+        # After a comma comes a key or a value, not more prose
+        rest = rest[1:].lstrip()
+        if not rest or rest[0] in '"\'{[]}-' or rest[0].isdigit() or rest.startswith(('//', '/*')):
+            return True
+    elif '\n' in following[:len(following) - len(rest)]:
+        # The next key or value on a new line, the comma is missing
+        if rest[0] in '"\'{[':
+            return True
+    else:
+        return False
+    word = WORD_CHARS.match(rest)
+    if word is None:
+        return False
+    return word.group(0) in LITERALS or rest[word.end():].lstrip().startswith(':')
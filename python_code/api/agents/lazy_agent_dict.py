@@ -0,0 +1,42 @@
+import time
+import threading
+from collections.abc import Mapping
+
+class LazyAgentDict(Mapping):
+    """Read-only mapping of agent names to agents that builds each agent on first access.
+
+    Every agent has its own lock, so a request that needs one agent only waits
+    for that agent even while a background thread is constructing the others.
+    """
+    def __init__(self, factories):
+        self._factories = dict(factories)
+        self._agents = {}
+        self._locks = {name: threading.Lock() for name in self._factories}
+        self.build_ms = {}
+
+    def __getitem__(self, name):
+        agent = self._agents.get(name)
+        if agent is None:
+            factory = self._factories[name]
+            with self._locks[name]:
+                agent = self._agents.get(name)
+                if agent is None:
+                    start = time.perf_counter()
+                    agent = factory()
+                    self.build_ms[name] = round((time.perf_counter() - start) * 1000, 2)
+                    self._agents[name] = agent
+        return agent
+
+    def __iter__(self):
+        return iter(self._factories)
+
+    def __len__(self):
+        return len(self._factories)
+
+    def is_built(self, name):
+        return name in self._agents
+
+    def build_all(self):
+        """Build every agent now, errors are raised to the caller."""
+        for name in self._factories:
+            self[name]
@@ -0,0 +1,218 @@
+import json
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Extra names customers use for menu items, keyed on the product name in products.jsonl
+# Flavours need the word "syrup", a "vanilla latte" is one drink and goes to the LLM
+ALIASES = {
+    "Espresso shot": ["espresso", "shot of espresso", "espresso shot"],
+    "Dark chocolate": ["hot chocolate", "drinking chocolate", "dark hot chocolate", "dark chocolate drink"],
+    "Chocolate Chip Biscotti": ["chocolate biscotti", "choc chip biscotti", "chocolate chip biscotti"],
+    "Jumbo Savory Scone": ["savory scone", "savoury scone", "jumbo scone", "jumbo savoury scone"],
+    "Carmel syrup": ["caramel syrup"],
+    "Sugar Free Vanilla syrup": ["vanilla syrup", "sugar free vanilla syrup"],
+    "Oatmeal Scone": ["oat scone", "oatmeal scone"],
+    "Chocolate syrup": ["chocolate syrup", "choc syrup"],
+    "Hazelnut syrup": ["hazelnut syrup"],
+}
+
+# Names that match more than one menu entry, e.g. drinking and packaged dark chocolate
+AMBIGUOUS_NAMES = ["dark chocolate"]
+AMBIGUOUS = object()
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "another": 1, "single": 1,
+    "two": 2, "couple": 2, "pair": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "dozen": 12,
+}
+
+# Larger or zero quantities are more likely a slip than an order, the LLM confirms them
+MAX_QUANTITY = 12
+
+SIZES = {"small", "medium", "large", "regular", "tall", "grande", "venti", "sm", "lg", "rg", "big", "extra"}
+
+FILLER_WORDS = {
+    "i", "i'd", "id", "i'll", "ill", "i'm", "we", "we'd", "we'll", "would", "like", "love", "want", "to",
+    "have", "get", "can", "could", "may", "please", "pls", "and", "also", "plus", "with", "some", "me", "us",
+    "order", "for", "the", "of", "just", "give", "let", "let's", "lets", "take", "add", "thanks", "thank",
+    "you", "too", "as", "well", "hi", "hello", "hey", "ok", "okay", "yes", "yeah", "sure", "then", "go",
+    "grab", "need", "will", "be", "great", "cool", "&", ",", "?", "x", "cup", "cups", "shot", "shots", "more",
+}
+
+# Words that change or question the order rather than add to it, these turns go to the LLM
+UNSUPPORTED_WORDS = {
+    "no", "not", "don't", "dont", "remove", "cancel", "instead", "change", "without", "actually", "replace",
+    "minus", "delete", "what", "how", "which", "is", "are", "does", "do", "why", "when", "where", "recommend",
+    "same", "again", "half", "but", "except", "only", "total", "price", "cost",
+}
+
+COMPLETION_PHRASES = {
+    "that's all", "that's it", "that is all", "that is it", "i'm done", "im done", "i am done", "done",
+    "nothing else", "that will be all", "that'll be all", "that's everything", "that is everything",
+    "all good", "that's all for now", "that's it for now", "finish my order", "complete my order",
+}
+
+COMPLETION_FILLERS = {"no", "thanks", "thank", "you", "ok", "okay", "please", "yes", "i", "think", "nope", "that's", "great"}
+
+TOKEN_PATTERN = re.compile(r"\d+x|x\d+|\d+|[a-z][a-z'\-]*|[,&?]")
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance between a and b, stops early once it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+class MenuOrderParser():
+    """Deterministic parser for simple order turns such as "two lattes and a croissant".
+
+    Menu names and aliases are compiled into a token trie once. A message is
+    accepted only when every token is a quantity, a size, a filler word or part
+    of a menu item, otherwise parse returns None and the LLM handles the turn.
+    """
+    END = "$item"
+
+    def __init__(self, products_path):
+        self.prices = {}
+        with open(products_path, 'r') as file:
+            for line in file:
+                if line.strip():
+                    product = json.loads(line)
+                    self.prices[product["name"]] = float(product["price"])
+
+        self.trie = {}
+        for name in self.prices:
+            self._add(name.lower(), name)
+            for alias in ALIASES.get(name, []):
+                self._add(alias, name)
+        for name in AMBIGUOUS_NAMES:
+            self._add(name, AMBIGUOUS)
+
+        self.vocabulary = set()
+        self._collect_vocabulary(self.trie)
+
+    def _add(self, phrase, name):
+        node = self.trie
+        for token in self._tokenize(phrase):
+            node = node.setdefault(token, {})
+        node[self.END] = name
+
+    def _collect_vocabulary(self, node):
+        for token, child in node.items():
+            if token != self.END:
+                self.vocabulary.add(token)
+                self._collect_vocabulary(child)
+
+    @staticmethod
+    def _tokenize(text):
+        text = text.lower().replace("’", "'").replace("-", " ")
+        return TOKEN_PATTERN.findall(text)
+
+    def _normalize_token(self, token):
+        """Map plurals and small typos onto a token of the menu vocabulary."""
+        if token in self.vocabulary:
+            return token
+        for suffix in ("es", "s"):
+            if token.endswith(suffix) and token[:-len(suffix)] in self.vocabulary:
+                return token[:-len(suffix)]
+        if len(token) < 5:
+            return token
+        limit = 2 if len(token) >= 8 else 1
+        candidates = [token] + [token[:-len(suffix)] for suffix in ("es", "s") if token.endswith(suffix)]
+        best, best_distance = token, limit + 1
+        for word in self.vocabulary:
+            for candidate in candidates:
+                distance = edit_distance(candidate, word, limit)
+                if distance < best_distance:
+                    best, best_distance = word, distance
+        return best
+
+    def _match_item(self, tokens, start):
+        """Longest menu item starting at tokens[start], as (name, end) or None."""
+        node, best, i = self.trie, None, start
+        while i < len(tokens):
+            node = node.get(tokens[i])
+            if node is None:
+                break
+            i += 1
+            if self.END in node:
+                best = (node[self.END], i)
+            # Sizes may follow a name, e.g. "latte lg"
+            while i < len(tokens) and tokens[i] in SIZES and self.END in node:
+                i += 1
+                best = (node[self.END], i)
+        return best
+
+    @staticmethod
+    def _parse_quantity(token):
+        if token in NUMBER_WORDS:
+            return NUMBER_WORDS[token]
+        match = re.fullmatch(r"(\d+)x|x(\d+)|(\d+)", token)
+        if match:
+            return int(next(group for group in match.groups() if group))
+        return None
+
+    def is_completion(self, text):
+        """True when the message only says that the order is complete."""
+        tokens = [token for token in self._tokenize(text) if token not in {",", "?", "&"}]
+        phrase = " ".join(tokens)
+        if phrase in COMPLETION_PHRASES:
+            return True
+        stripped = " ".join(token for token in tokens if token not in COMPLETION_FILLERS)
+        return bool(stripped) and (stripped in COMPLETION_PHRASES or f"that's {stripped}" in COMPLETION_PHRASES)
+
+    def parse(self, text):
+        """Return the ordered items as [{"item", "quantity", "price"}], or None when the turn isn't a simple order."""
+        raw_tokens = self._tokenize(text)
+        if not raw_tokens or any(token in UNSUPPORTED_WORDS for token in raw_tokens):
+            return None
+        # Only polite requests ("can I get ...?") may end with a question mark
+        if "?" in raw_tokens and raw_tokens[0] not in ("can", "could", "may"):
+            return None
+
+        tokens = [self._normalize_token(token) for token in raw_tokens]
+        quantities = {}
+        quantity = None
+        i = 0
+        while i < len(tokens):
+            match = self._match_item(tokens, i)
+            if match is not None:
+                name, i = match
+                if name is AMBIGUOUS:
+                    return None
+                if quantity is None:
+                    quantity = 1
+                elif quantity == 0 or quantity > MAX_QUANTITY:
+                    return None
+                quantities[name] = quantities.get(name, 0) + quantity
+                quantity = None
+                continue
+
+            token_quantity = self._parse_quantity(raw_tokens[i])
+            if token_quantity is not None:
+                if raw_tokens[i] in ("couple", "dozen", "pair"):
+                    # "a couple of" / "a dozen" keep the larger number
+                    quantity = max(quantity or 0, token_quantity)
+                elif quantity is not None:
+                    # "2 2 lattes" or "latte 2 3", no reading of two numbers in a row is safe
+                    return None
+                else:
+                    quantity = token_quantity
+            elif raw_tokens[i] not in FILLER_WORDS and raw_tokens[i] not in SIZES:
+                return None
+            i += 1
+
+        # A number after the last item ("latte x2", "3 lattes and 2") has no item to count
+        if not quantities or quantity is not None:
+            return None
+
+        return [{"item": name, "quantity": count, "price": self.prices[name]} for name, count in quantities.items()]
@@ -1,68 +1,22 @@
 import os
 import json
-from .utils import get_chatbot_response, double_check_json_output
-import google.generativeai as genai
+from .utils import (get_structured_response,
+                    aget_structured_response,
+                    double_check_json_output,
+                    get_last_user_message,
+                    stream_chatbot_response,
+                    build_stream_chunk,
+                    JsonStringFieldStreamer
+                    )
+from .conversation_view import ConversationView
+from .client_registry import get_client_registry
+from .prompts import PromptTemplate
+from .response_schemas import OrderOutput, StructuredOutputError, validate_output
 import logging
-from copy import deepcopy
-from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-load_dotenv()
-
-class OrderTakingAgent():
-    def __init__(self, recommendation_agent):
-        try:
-            self.model_name = os.getenv("GEMINI_MODEL_NAME") 
-            if not self.model_name:
-                raise ValueError("GEMINI_MODEL_NAME not found in environment variables")
-                
-            self.client = genai.GenerativeModel(self.model_name)
-            self.recommendation_agent = recommendation_agent
-            
-        except Exception as e:
-            logger.error(f"Error initializing OrderTakingAgent: {str(e)}")
-            raise
-    
-    def get_response(self, messages):
-        try:
-            messages = deepcopy(messages)
-            
-            # Get the last user message
-            user_message = ""
-            for msg in reversed(messages):
-                if msg.get('role') == 'user':
-                    user_message = msg.get('content', '')
-                    break
-
-            if not user_message:
-                return {
-                    "role": "assistant",
-                    "content": "I couldn't understand your request. Could you please try again?",
-                    "memory": {
-                        "agent": "order_taking_agent",
-                        "step number": "1",
-                        "order": [],
-                        "asked_recommendation_before": False
-                    }
-                }
-
-            # Get current order status from previous messages
-            current_order = []
-            asked_recommendation_before = False
-            current_step = "1"
-            
-            for message in reversed(messages):
-                if (message.get('role') == 'assistant' and 
-                    message.get('memory', {}).get('agent') == 'order_taking_agent'):
-                    current_order = message['memory'].get('order', [])
-                    asked_recommendation_before = message['memory'].get('asked_recommendation_before', False)
-                    current_step = message['memory'].get('step number', '1')
-                    break
-
-            # Create the prompt with current order status
-            system_prompt = f"""You are a customer support Bot for a coffee shop called "Merry's way"
+SYSTEM_PROMPT = """You are a customer support Bot for a coffee shop called "Merry's way"
 
             Here is the menu for this coffee shop:
             Cappuccino - $4.50
@@ -85,10 +39,6 @@ class OrderTakingAgent():
             Sugar Free Vanilla syrup - $1.50
             Dark chocolate (Packaged Chocolate) - $3.00
 
-            Current order status:
-            Step number: {current_step}
-            Current order: {json.dumps(current_order, indent=2)}
-
             Things to NOT DO:
             * DON'T ask how to pay by cash or Card.
             * Don't tell the user to go to the counter
@@ -110,42 +60,73 @@ class OrderTakingAgent():
             Your output MUST be a raw JSON string with NO markdown formatting or code blocks.
             Do NOT wrap the JSON in ```json or ``` markers.
             Just return the raw JSON with this exact format:
-            {{
-                "chain of thought": "your analysis of the order status and next steps",
+            {
                 "step number": "current step number (1-6)",
                 "order": [
-                    {{"item": "item name", "quantity": number, "price": price}}
+                    {"item": "item name", "quantity": number, "price": price}
                 ],
                 "response": "your response to the user"
-            }}
+            }
 
             Note: The order list in your response should ONLY include NEW items being ordered, not items from the current order.
             The current order will be combined with your new items automatically.
             DO NOT include the order summary in your response - it will be added automatically."""
 
-            # Create the prompt
-            full_prompt = f"{system_prompt}\n\nUser message: {user_message}"
-            
-            # Get response
-            response_text = get_chatbot_response(self.client, [{"role": "user", "content": full_prompt}])
+USER_PROMPT = """Current order status:
+            Step number: {current_step}
+            Current order: {current_order}
+
+            User message: {user_message}"""
+
+PROMPT = PromptTemplate("order_taking_agent", SYSTEM_PROMPT, USER_PROMPT)
+
+class OrderTakingAgent():
+    def __init__(self, recommendation_agent, order_parser=None):
+        try:
+            self.model_name = os.getenv("GEMINI_MODEL_NAME") 
+            if not self.model_name:
+                raise ValueError("GEMINI_MODEL_NAME not found in environment variables")
+                
+            self.client = get_client_registry().get_model(self.model_name)
+            self.recommendation_agent = recommendation_agent
+
+            # Local parser for simple order turns, the LLM only sees what it can't parse
+            self.order_parser = order_parser
+            self.parser_hits = 0
+            self.llm_fallbacks = 0
             
+        except Exception as e:
+            logger.error(f"Error initializing OrderTakingAgent: {str(e)}")
+            raise
+    
+    def get_response(self, messages):
+        try:
+            messages = ConversationView.of(messages)
+
+            # Get the last user message
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                return self._get_empty_message_response()
+
+            # Get current order status from previous messages
+            current_order, asked_recommendation_before, current_step = self._get_current_order_status(messages)
+
+            # Parse simple turns locally and only call the LLM for the ones the parser can't handle
+            local_output = self._parse_locally(user_message, current_order)
+
             try:
-                # Parse and validate response
-                output = json.loads(response_text)
-                
-                if not all(key in output for key in ["chain of thought", "step number", "order", "response"]):
-                    raise ValueError("Missing required fields in response")
-                
-                # Process order if needed
-                if isinstance(output["order"], str):
-                    output["order"] = json.loads(output["order"])
-                
-                # Combine with current order
-                combined_order = self._combine_orders(current_order, output["order"])
-                
+                if local_output is not None:
+                    output, combined_order = local_output
+                else:
+                    # Get response
+                    output = get_structured_response(self.client, self._build_prompt(user_message, current_step, current_order), OrderOutput)
+
+                    # Combine the validated response with the current order
+                    output, combined_order = self._parse_output(output, current_order)
+
                 # Get recommendations if appropriate
                 response = output['response']
-                
+
                 if not asked_recommendation_before and combined_order:
                     try:
                         recommendation_output = self.recommendation_agent.get_recommendations_from_order(messages, combined_order)
@@ -153,41 +134,225 @@ class OrderTakingAgent():
                         asked_recommendation_before = True
                     except Exception as e:
                         logger.error(f"Error getting recommendations: {str(e)}")
-                
-                return {
-                    "role": "assistant",
-                    "content": response,
-                    "memory": {
-                        "agent": "order_taking_agent",
-                        "step number": output["step number"],
-                        "order": combined_order,
-                        "asked_recommendation_before": asked_recommendation_before
-                    }
-                }
-                
-            except json.JSONDecodeError as e:
+
+                return self._build_order_response(response, output["step number"], combined_order, asked_recommendation_before)
+
+            except StructuredOutputError as e:
                 logger.error(f"Invalid JSON response from model: {str(e)}")
                 return self._get_error_response()
-                
+
         except Exception as e:
             logger.error(f"Error in order taking agent: {str(e)}")
             return self._get_error_response()
 
+    async def aget_response(self, messages):
+        try:
+            messages = ConversationView.of(messages)
+
+            # Get the last user message
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                return self._get_empty_message_response()
+
+            # Get current order status from previous messages
+            current_order, asked_recommendation_before, current_step = self._get_current_order_status(messages)
+
+            # Parse simple turns locally and only call the LLM for the ones the parser can't handle
+            local_output = self._parse_locally(user_message, current_order)
+
+            try:
+                if local_output is not None:
+                    output, combined_order = local_output
+                else:
+                    # Get response
+                    output = await aget_structured_response(self.client, self._build_prompt(user_message, current_step, current_order), OrderOutput)
+
+                    # Combine the validated response with the current order
+                    output, combined_order = self._parse_output(output, current_order)
+
+                # Get recommendations if appropriate
+                response = output['response']
+
+                if not asked_recommendation_before and combined_order:
+                    try:
+                        recommendation_output = await self.recommendation_agent.aget_recommendations_from_order(messages, combined_order)
+                        response = f"{response}\n\n{recommendation_output['content']}"
+                        asked_recommendation_before = True
+                    except Exception as e:
+                        logger.error(f"Error getting recommendations: {str(e)}")
+
+                return self._build_order_response(response, output["step number"], combined_order, asked_recommendation_before)
+
+            except StructuredOutputError as e:
+                logger.error(f"Invalid JSON response from model: {str(e)}")
+                return self._get_error_response()
+
+        except Exception as e:
+            logger.error(f"Error in order taking agent: {str(e)}")
+            return self._get_error_response()
+
+    def stream_response(self, messages):
+        """Streaming variant of get_response, streams the "response" field and then the upsell."""
+        try:
+            messages = ConversationView.of(messages)
+
+            # Get the last user message
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                yield self._get_empty_message_response()
+                return
+
+            # Get current order status from previous messages
+            current_order, asked_recommendation_before, current_step = self._get_current_order_status(messages)
+
+            # Parse simple turns locally and only call the LLM for the ones the parser can't handle
+            local_output = self._parse_locally(user_message, current_order)
+
+            try:
+                if local_output is not None:
+                    output, combined_order = local_output
+                    yield build_stream_chunk(output['response'])
+                else:
+                    # Stream the "response" field out of the JSON while the model writes it
+                    streamer = JsonStringFieldStreamer("response")
+                    chunks = []
+                    for chunk in stream_chatbot_response(self.client, self._build_prompt(user_message, current_step, current_order), schema=OrderOutput):
+                        chunks.append(chunk)
+                        text = streamer.feed(chunk)
+                        if text:
+                            yield build_stream_chunk(text)
+
+                    # Parse and validate response, then combine with current order
+                    output = validate_output(OrderOutput, double_check_json_output(self.client, "".join(chunks)))
+                    output, combined_order = self._parse_output(output, current_order)
+                    if not streamer.text:
+                        yield build_stream_chunk(output['response'])
+
+                # Get recommendations if appropriate
+                response = output['response']
+
+                if not asked_recommendation_before and combined_order:
+                    try:
+                        yield build_stream_chunk("\n\n")
+                        for chunk in self.recommendation_agent.stream_recommendations_from_order(messages, combined_order):
+                            if "memory" in chunk:
+                                response = f"{response}\n\n{chunk['content']}"
+                                asked_recommendation_before = True
+                            else:
+                                yield chunk
+                    except Exception as e:
+                        logger.error(f"Error getting recommendations: {str(e)}")
+
+                yield self._build_order_response(response, output["step number"], combined_order, asked_recommendation_before)
+
+            except StructuredOutputError as e:
+                logger.error(f"Invalid JSON response from model: {str(e)}")
+                yield self._get_error_response()
+
+        except Exception as e:
+            logger.error(f"Error in order taking agent stream: {str(e)}")
+            yield self._get_error_response()
+
+    def _get_current_order_status(self, messages):
+        """Return the current order, recommendation flag and step number from the latest order memory."""
+        memory = ConversationView.of(messages).latest_memory('order_taking_agent')
+        return (memory.get('order', []),
+                memory.get('asked_recommendation_before', False),
+                memory.get('step number', '1'))
+
+    def _build_prompt(self, user_message, current_step, current_order):
+        """The static instructions with the menu, plus the current order status and the user message."""
+        return PROMPT.render(current_step=current_step,
+                             current_order=json.dumps(current_order, indent=2),
+                             user_message=user_message)
+
+    def _parse_output(self, output, current_order):
+        """Combine the validated OrderOutput with the current order."""
+        new_order = [item.model_dump() for item in output.order]
+        combined_order = self._combine_orders(current_order, new_order)
+        return {"step number": output.step_number, "response": output.response}, combined_order
+
+    def _parse_locally(self, user_message, current_order):
+        """Return (output, combined_order) for turns the menu parser understands, otherwise None."""
+        if self.order_parser is None:
+            return None
+        try:
+            if current_order and self.order_parser.is_completion(user_message):
+                self.parser_hits += 1
+                output = {"step number": "6", "response": self._format_order_summary(current_order)}
+                return output, current_order
+
+            new_order = self.order_parser.parse(user_message)
+        except Exception as e:
+            logger.error(f"Error in local order parser: {str(e)}")
+            new_order = None
+
+        if not new_order:
+            self.llm_fallbacks += 1
+            return None
+
+        self.parser_hits += 1
+        added = " and ".join(f"{item['quantity']} x {item['item']}" for item in new_order)
+        output = {
+            "step number": "4",
+            "response": f"Great choice! I've added {added} to your order. Would you like anything else?"
+        }
+        return output, self._combine_orders(current_order, new_order)
+
+    def _format_order_summary(self, order):
+        """List the items with their prices and the total, then close the order."""
+        lines = [f"- {item['quantity']} x {item['item']}: ${int(item['quantity']) * float(item['price']):.2f}" for item in order]
+        total = sum(int(item['quantity']) * float(item['price']) for item in order)
+        return ("Here is your order:\n" + "\n".join(lines) +
+                f"\n\nTotal: ${total:.2f}\n\nThank you for your order! We'll have it ready for you shortly.")
+
+    def stats(self):
+        """Fast-path counters of the local order parser."""
+        turns = self.parser_hits + self.llm_fallbacks
+        return {
+            "parser_hits": self.parser_hits,
+            "llm_fallbacks": self.llm_fallbacks,
+            "parser_rate": round(self.parser_hits / turns, 4) if turns else 0.0
+        }
+
+    def _build_order_response(self, response, step_number, combined_order, asked_recommendation_before):
+        return {
+            "role": "assistant",
+            "content": response,
+            "memory": {
+                "agent": "order_taking_agent",
+                "step number": step_number,
+                "order": combined_order,
+                "asked_recommendation_before": asked_recommendation_before
+            }
+        }
+
+    def _get_empty_message_response(self):
+        return {
+            "role": "assistant",
+            "content": "I couldn't understand your request. Could you please try again?",
+            "memory": {
+                "agent": "order_taking_agent",
+                "step number": "1",
+                "order": [],
+                "asked_recommendation_before": False
+            }
+        }
+
     def _get_last_order_status(self, messages):
         """Extract the last order status from message history."""
         try:
-            for message in reversed(messages):
-                if (message.get('role') == 'assistant' and 
-                    message.get('memory', {}).get('agent') == 'order_taking_agent'):
-                    
-                    step_number = message['memory'].get('step number', '1')
-                    order = message['memory'].get('order', [])
-                    
-                    return f"""
+            memory = ConversationView.of(messages).latest_memory('order_taking_agent')
+            if not memory:
+                return "step number: 1\norder: []"
+
+            step_number = memory.get('step number', '1')
+            order = memory.get('order', [])
+
+            return f"""
                     step number: {step_number}
                     order: {json.dumps(order, indent=2)}
                     """
-            return "step number: 1\norder: []"
             
         except Exception as e:
             logger.error(f"Error getting last order status: {str(e)}")
@@ -196,11 +361,7 @@ class OrderTakingAgent():
     def _was_recommendation_asked(self, messages):
         """Check if recommendations were already asked in this conversation."""
         try:
-            for message in reversed(messages):
-                if (message.get('role') == 'assistant' and 
-                    message.get('memory', {}).get('agent') == 'order_taking_agent'):
-                    return message['memory'].get('asked_recommendation_before', False)
-            return False
+            return ConversationView.of(messages).latest_memory('order_taking_agent').get('asked_recommendation_before', False)
         except Exception as e:
             logger.error(f"Error checking recommendation status: {str(e)}")
             return False
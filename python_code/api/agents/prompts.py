@@ -0,0 +1,91 @@
+import hashlib
+import inspect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class PromptTemplate():
+    """Agent prompt split into a static system instruction and a small per-call user part.
+
+    The system instruction is dedented and built once, when the agent module is
+    imported or its inputs (e.g. the product list) change. It is sent as
+    Gemini's system_instruction. render only formats the user part, so a turn
+    costs one short str.format instead of rebuilding kilobytes of f-string.
+    """
+    def __init__(self, name, system_instruction, user_template="{user_message}"):
+        self.name = name
+        self.system_instruction = inspect.cleandoc(system_instruction)
+        self.user_template = inspect.cleandoc(user_template)
+        self.version = hashlib.sha256(f"{self.system_instruction}\x00{self.user_template}".encode("utf-8")).hexdigest()[:16]
+        self.stats = get_prompt_stats(name)
+
+    def render(self, **values):
+        return Prompt(self, self.user_template.format(**values))
+
+class Prompt():
+    """One rendered prompt, what get_chatbot_response and its variants send to Gemini."""
+    def __init__(self, template, contents):
+        self.template = template
+        self.contents = contents
+
+    @property
+    def system_instruction(self):
+        return self.template.system_instruction
+
+    @property
+    def chars(self):
+        return len(self.template.system_instruction) + len(self.contents)
+
+class PromptStats():
+    """Input size counters of one prompt, prompt_tokens comes from Gemini's usage metadata."""
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_chars = 0
+        self.max_prompt_chars = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.output_tokens = 0
+
+    def record(self, prompt, response=None):
+        usage = getattr(response, "usage_metadata", None) if response is not None else None
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        with self._lock:
+            self.calls += 1
+            self.prompt_chars += prompt.chars
+            self.max_prompt_chars = max(self.max_prompt_chars, prompt.chars)
+            self.prompt_tokens += prompt_tokens
+            self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+            self.output_tokens += output_tokens
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "prompt_chars": self.prompt_chars,
+            "avg_prompt_chars": round(self.prompt_chars / self.calls, 1) if self.calls else 0.0,
+            "max_prompt_chars": self.max_prompt_chars,
+            "prompt_tokens": self.prompt_tokens,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.calls, 1) if self.calls else 0.0,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "output_tokens": self.output_tokens
+        }
+
+_prompt_stats = {}
+_prompt_stats_lock = threading.Lock()
+
+def get_prompt_stats(name):
+    """Process-wide counters for a prompt name, shared by every template with that name."""
+    with _prompt_stats_lock:
+        stats = _prompt_stats.get(name)
+        if stats is None:
+            stats = PromptStats(name)
+            _prompt_stats[name] = stats
+        return stats
+
+def prompt_stats():
+    """Counters of every prompt that was sent at least once."""
+    with _prompt_stats_lock:
+        return {name: stats.stats() for name, stats in _prompt_stats.items() if stats.calls}
@@ -1,59 +1,137 @@
+import csv
 import json
-import pandas as pd
 import os
-from .utils import get_chatbot_response
-import google.generativeai as genai
+from .utils import (get_chatbot_response,
+                    aget_chatbot_response,
+                    get_structured_response,
+                    aget_structured_response,
+                    get_last_user_message,
+                    stream_chatbot_response,
+                    build_stream_chunk,
+                    process_response_text
+                    )
+from .conversation_view import ConversationView
+from .client_registry import get_client_registry
+from .recommendation_tables import RecommendationTables
+from .prompts import PromptTemplate
+from .response_schemas import RecommendationClassificationOutput
+from .resilience import ModelUnavailableError, get_fallback_stats
+from .tracing import traced
 import logging
-from copy import deepcopy
-from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-load_dotenv()
+# Filled in with the items and categories of the active recommendation tables
+CLASSIFICATION_SYSTEM_PROMPT = """You are a helpful AI assistant for a coffee shop application which serves drinks and pastries. 
+            We have 3 types of recommendations:
+
+            1. Apriori Recommendations: Based on items frequently bought together
+            2. Popular Recommendations: Based on overall item popularity
+            3. Popular Recommendations by Category: Based on popularity within a specific category
+
+            Available items: {products}
+            Available categories: {categories}
+
+            Your output MUST be a valid JSON string with this exact format:
+            {{
+                "recommendation_type": "apriori OR popular OR popular by category",
+                "parameters": []  // List of items for apriori, categories for popular by category, empty for popular
+            }}
+            """
+
+RECOMMENDATION_PROMPT = PromptTemplate("recommendation_agent",
+    """You are a helpful AI assistant for a coffee shop application which serves drinks and pastries.
+            Your task is to recommend items to the user based on their input message. Be friendly and concise.
+            Present the recommendations in an unordered list with a very small description for each item.""",
+    """Based on the user's request: "{user_message}"
+
+            Please recommend these items: {recommendations}
+
+            Remember to be friendly and present the recommendations in a clear, appealing way.""")
+
+ORDER_RECOMMENDATION_PROMPT = PromptTemplate("recommendation_agent.order",
+    """You are a helpful AI assistant for a coffee shop application.
+            Your task is to recommend additional items that would go well with the customer's current order.
+            Be friendly, enthusiastic, and explain why these items would complement their order.
+            Focus on creating an appealing combination of items.
+            DO NOT list or summarize their current order - just focus on the recommendations.""",
+    """Based on their order of: {products}
+            
+            Please recommend these additional items: {recommendations}
+            
+            Make your response friendly and explain why these items would go well with their current order.
+            Keep it concise but enticing.
+            DO NOT repeat their current order or show prices - just focus on the recommendations.""")
 
 class RecommendationAgent():
-    def __init__(self, apriori_recommendation_path, popular_recommendation_path):
+    def __init__(self, apriori_recommendation_path, popular_recommendation_path, apriori_merge="sum", artifact_store=None):
         try:
             self.model_name = os.getenv("GEMINI_MODEL_NAME") 
             if not self.model_name:
                 raise ValueError("GEMINI_MODEL_NAME not found in environment variables")
                 
-            self.client = genai.GenerativeModel(self.model_name)
-
-            # Load recommendation data
-            try:
-                with open(apriori_recommendation_path, 'r') as file:
-                    self.apriori_recommendations = json.load(file)
-            except Exception as e:
-                logger.error(f"Error loading apriori recommendations: {str(e)}")
-                self.apriori_recommendations = {}
-
-            try:
-                self.popular_recommendations = pd.read_csv(popular_recommendation_path)
-                self.products = self.popular_recommendations['product'].tolist()
-                self.product_categories = self.popular_recommendations['product_category'].tolist()
-            except Exception as e:
-                logger.error(f"Error loading popularity recommendations: {str(e)}")
-                self.popular_recommendations = pd.DataFrame()
-                self.products = []
-                self.product_categories = []
-                
+            self.client = get_client_registry().get_model(self.model_name)
+            self.apriori_merge = apriori_merge
+            self.artifact_store = artifact_store
+            self._classification_template = None
+
+            # Ranked lookup tables, every recommendation query is a slice or a vectorized merge.
+            # The active store version wins over the artifacts shipped in the image.
+            self.recommendation_tables = None
+            if artifact_store is not None:
+                version = artifact_store.current_version()
+                if version is not None:
+                    try:
+                        self.recommendation_tables = artifact_store.load_tables(version, merge=apriori_merge)
+                    except Exception as e:
+                        logger.error(f"Error loading artifact version {version}, using the shipped artifacts: {str(e)}")
+            if self.recommendation_tables is None:
+                self.recommendation_tables = self._load_tables_from_files(apriori_recommendation_path,
+                                                                          popular_recommendation_path)
+
         except Exception as e:
             logger.error(f"Error initializing RecommendationAgent: {str(e)}")
             raise
 
+    def _load_tables_from_files(self, apriori_recommendation_path, popular_recommendation_path):
+        """Compile the tables from the apriori JSON and the popularity CSV."""
+        # Load recommendation data
+        try:
+            with open(apriori_recommendation_path, 'r') as file:
+                apriori_recommendations = json.load(file)
+        except Exception as e:
+            logger.error(f"Error loading apriori recommendations: {str(e)}")
+            apriori_recommendations = {}
+
+        # The popularity table is a few rows, read it with csv rather than importing pandas
+        try:
+            with open(popular_recommendation_path, 'r', newline='') as file:
+                popular_recommendations = list(csv.DictReader(file))
+        except Exception as e:
+            logger.error(f"Error loading popularity recommendations: {str(e)}")
+            popular_recommendations = []
+
+        return RecommendationTables(popular_recommendations, apriori_recommendations, merge=self.apriori_merge)
+
+    def reload_artifacts(self, version):
+        """Load a store version and swap it in, requests in flight keep the tables they started with."""
+        tables = self.artifact_store.load_tables(version, merge=self.apriori_merge)
+        self.recommendation_tables = tables
+
+    @property
+    def products(self):
+        return self.recommendation_tables.products
+
+    @property
+    def product_categories(self):
+        return self.recommendation_tables.product_categories
+
     def get_response(self, messages):
         try:
-            messages = deepcopy(messages)
-            
-            # Get the last user message
-            user_message = ""
-            for msg in reversed(messages):
-                if msg.get('role') == 'user':
-                    user_message = msg.get('content', '')
-                    break
+            messages = ConversationView.of(messages)
 
+            # Get the last user message
+            user_message = get_last_user_message(messages)
             if not user_message:
                 return self._get_error_response("I couldn't understand your request. Could you please try again?")
 
@@ -63,42 +141,47 @@ class RecommendationAgent():
                 return self._get_error_response("I'm having trouble understanding what kind of recommendation you need. Could you please try asking in a different way?")
 
             # Get recommendations based on type
-            recommendations = []
-            recommendation_type = recommendation_class.get('recommendation_type')
-            parameters = recommendation_class.get('parameters', [])
-
-            if recommendation_type == "apriori":
-                recommendations = self.get_apriori_recommendation(parameters)
-            elif recommendation_type == "popular":
-                recommendations = self.get_popular_recommendation()
-            elif recommendation_type == "popular by category":
-                recommendations = self.get_popular_by_category_recommendation(parameters)
-            
+            recommendations = self._get_recommendations(recommendation_class)
             if not recommendations:
                 return self._get_error_response("I couldn't find any recommendations based on your request. Could you please try asking in a different way?")
-            
-            # Format recommendations for response
-            recommendations_str = ", ".join(recommendations)
-            
-            # Create the prompt
-            system_prompt = """You are a helpful AI assistant for a coffee shop application which serves drinks and pastries.
-            Your task is to recommend items to the user based on their input message. Be friendly and concise.
-            Present the recommendations in an unordered list with a very small description for each item."""
 
-            prompt = f"""Based on the user's request: "{user_message}"
+            # Get response
+            response_text = get_chatbot_response(self.client, self._build_recommendation_prompt(user_message, recommendations))
 
-            Please recommend these items: {recommendations_str}
+            return {
+                "role": "assistant",
+                "content": response_text,
+                "memory": {"agent": "recommendation_agent"}
+            }
 
-            Remember to be friendly and present the recommendations in a clear, appealing way."""
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in recommendation agent, listing the recommendations: {str(e)}")
+            return self._get_fallback_response(recommendations)
+        except Exception as e:
+            logger.error(f"Error in recommendation agent: {str(e)}")
+            return self._get_error_response("I apologize, but I encountered an error. Could you please try again?")
+
+    async def aget_response(self, messages):
+        try:
+            messages = ConversationView.of(messages)
+
+            # Get the last user message
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                return self._get_error_response("I couldn't understand your request. Could you please try again?")
+
+            # Classify the recommendation type
+            recommendation_class = await self.arecommendation_classification(messages)
+            if not recommendation_class:
+                return self._get_error_response("I'm having trouble understanding what kind of recommendation you need. Could you please try asking in a different way?")
+
+            # Get recommendations based on type
+            recommendations = self._get_recommendations(recommendation_class)
+            if not recommendations:
+                return self._get_error_response("I couldn't find any recommendations based on your request. Could you please try asking in a different way?")
 
             # Get response
-            response_text = get_chatbot_response(
-                self.client,
-                [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ]
-            )
+            response_text = await aget_chatbot_response(self.client, self._build_recommendation_prompt(user_message, recommendations))
 
             return {
                 "role": "assistant",
@@ -106,79 +189,132 @@ class RecommendationAgent():
                 "memory": {"agent": "recommendation_agent"}
             }
 
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in recommendation agent, listing the recommendations: {str(e)}")
+            return self._get_fallback_response(recommendations)
         except Exception as e:
             logger.error(f"Error in recommendation agent: {str(e)}")
             return self._get_error_response("I apologize, but I encountered an error. Could you please try again?")
 
+    def stream_response(self, messages):
+        """Streaming variant of get_response, the classification call runs first and the reply is streamed."""
+        try:
+            messages = ConversationView.of(messages)
+
+            # Get the last user message
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                yield self._get_error_response("I couldn't understand your request. Could you please try again?")
+                return
+
+            # Classify the recommendation type
+            recommendation_class = self.recommendation_classification(messages)
+            if not recommendation_class:
+                yield self._get_error_response("I'm having trouble understanding what kind of recommendation you need. Could you please try asking in a different way?")
+                return
+
+            # Get recommendations based on type
+            recommendations = self._get_recommendations(recommendation_class)
+            if not recommendations:
+                yield self._get_error_response("I couldn't find any recommendations based on your request. Could you please try asking in a different way?")
+                return
+
+            # Stream the response
+            chunks = []
+            for chunk in stream_chatbot_response(self.client, self._build_recommendation_prompt(user_message, recommendations)):
+                chunks.append(chunk)
+                yield build_stream_chunk(chunk)
+
+            yield {
+                "role": "assistant",
+                "content": process_response_text("".join(chunks)),
+                "memory": {"agent": "recommendation_agent"}
+            }
+
+        except ModelUnavailableError as e:
+            logger.error(f"Gemini unavailable in recommendation agent stream, listing the recommendations: {str(e)}")
+            yield self._get_fallback_response(recommendations)
+        except Exception as e:
+            logger.error(f"Error in recommendation agent stream: {str(e)}")
+            yield self._get_error_response("I apologize, but I encountered an error. Could you please try again?")
+
     def recommendation_classification(self, messages):
         """Classify the type of recommendation needed."""
         try:
             # Get the last user message
-            user_message = ""
-            for msg in reversed(messages):
-                if msg.get('role') == 'user':
-                    user_message = msg.get('content', '')
-                    break
-
+            user_message = get_last_user_message(messages)
             if not user_message:
                 return None
 
-            system_prompt = f"""You are a helpful AI assistant for a coffee shop application which serves drinks and pastries. 
-            We have 3 types of recommendations:
-
-            1. Apriori Recommendations: Based on items frequently bought together
-            2. Popular Recommendations: Based on overall item popularity
-            3. Popular Recommendations by Category: Based on popularity within a specific category
+            # Get response
+            return get_structured_response(self.client, self._build_classification_prompt(user_message),
+                                           RecommendationClassificationOutput)
 
-            Available items: {", ".join(self.products)}
-            Available categories: {", ".join(self.product_categories)}
+        except ModelUnavailableError as e:
+            # Popular items need no parameters, so they can be recommended without the model
+            logger.error(f"Gemini unavailable in recommendation classification, recommending popular items: {str(e)}")
+            return RecommendationClassificationOutput(recommendation_type="popular")
+        except Exception as e:
+            logger.error(f"Error in recommendation classification: {str(e)}")
+            return None
 
-            Your output MUST be a valid JSON string with this exact format:
-            {{
-                "chain of thought": "your analysis of the recommendation type needed",
-                "recommendation_type": "apriori OR popular OR popular by category",
-                "parameters": []  // List of items for apriori, categories for popular by category, empty for popular
-            }}
-            """
+    async def arecommendation_classification(self, messages):
+        """Async variant of recommendation_classification."""
+        try:
+            # Get the last user message
+            user_message = get_last_user_message(messages)
+            if not user_message:
+                return None
 
-            prompt = f"Classify this recommendation request: {user_message}"
-            
             # Get response
-            response_text = get_chatbot_response(
-                self.client,
-                [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            try:
-                output = json.loads(response_text)
-                if not all(key in output for key in ["chain of thought", "recommendation_type", "parameters"]):
-                    raise ValueError("Missing required fields in response")
-                return output
-            except json.JSONDecodeError:
-                logger.error(f"Invalid JSON response from model: {response_text}")
-                return None
-                
+            return await aget_structured_response(self.client, self._build_classification_prompt(user_message),
+                                                  RecommendationClassificationOutput)
+
+        except ModelUnavailableError as e:
+            # Popular items need no parameters, so they can be recommended without the model
+            logger.error(f"Gemini unavailable in recommendation classification, recommending popular items: {str(e)}")
+            return RecommendationClassificationOutput(recommendation_type="popular")
         except Exception as e:
             logger.error(f"Error in recommendation classification: {str(e)}")
             return None
 
+    def _build_classification_prompt(self, user_message):
+        """Create the prompt that picks the recommendation type."""
+        return self._get_classification_template().render(user_message=user_message)
+
+    def _get_classification_template(self):
+        """Template listing the items of the active tables, rebuilt only after new artifacts are swapped in."""
+        tables = self.recommendation_tables
+        cached = self._classification_template
+        if cached is None or cached[0] is not tables:
+            system_prompt = CLASSIFICATION_SYSTEM_PROMPT.format(products=", ".join(tables.products),
+                                                                categories=", ".join(dict.fromkeys(tables.product_categories)))
+            cached = (tables, PromptTemplate("recommendation_agent.classification", system_prompt,
+                                             "Classify this recommendation request: {user_message}"))
+            self._classification_template = cached
+        return cached[1]
+
+    def _get_recommendations(self, recommendation_class):
+        """Get the recommended products for a classified request."""
+        recommendation_type = recommendation_class.recommendation_type
+        parameters = recommendation_class.parameters
+
+        if recommendation_type == "apriori":
+            return self.get_apriori_recommendation(parameters)
+        elif recommendation_type == "popular":
+            return self.get_popular_recommendation()
+        elif recommendation_type == "popular by category":
+            return self.get_popular_by_category_recommendation(parameters)
+        return []
+
+    def _build_recommendation_prompt(self, user_message, recommendations):
+        """Create the prompt that presents the recommendations to the user."""
+        return RECOMMENDATION_PROMPT.render(user_message=user_message, recommendations=", ".join(recommendations))
+
     def get_apriori_recommendation(self, items, max_recommendations=3):
-        """Get recommendations based on items frequently bought together."""
+        """Get recommendations based on items frequently bought together, ranked by confidence."""
         try:
-            recommendations = set()
-            for item in items:
-                if item in self.apriori_recommendations:
-                    # Extract just the product names from the recommendations
-                    item_recommendations = [rec['product'] for rec in self.apriori_recommendations[item]]
-                    recommendations.update(item_recommendations)
-            
-            # Remove items already in the input list
-            recommendations = recommendations - set(items)
-            
-            return list(recommendations)[:max_recommendations]
+            return self.recommendation_tables.get_apriori(items, max_recommendations)
         except Exception as e:
             logger.error(f"Error getting apriori recommendations: {str(e)}")
             return []
@@ -186,9 +322,7 @@ class RecommendationAgent():
     def get_popular_recommendation(self, max_recommendations=3):
         """Get overall popular recommendations."""
         try:
-            if not self.popular_recommendations.empty:
-                return self.popular_recommendations['product'].head(max_recommendations).tolist()
-            return []
+            return self.recommendation_tables.get_popular(max_recommendations)
         except Exception as e:
             logger.error(f"Error getting popular recommendations: {str(e)}")
             return []
@@ -196,59 +330,20 @@ class RecommendationAgent():
     def get_popular_by_category_recommendation(self, categories, max_recommendations=3):
         """Get popular recommendations within specified categories."""
         try:
-            if not self.popular_recommendations.empty:
-                recommendations = []
-                for category in categories:
-                    category_items = self.popular_recommendations[
-                        self.popular_recommendations['product_category'] == category
-                    ]['product'].head(max_recommendations).tolist()
-                    recommendations.extend(category_items)
-                return recommendations[:max_recommendations]
-            return []
+            return self.recommendation_tables.get_popular_by_category(categories, max_recommendations)
         except Exception as e:
             logger.error(f"Error getting category recommendations: {str(e)}")
             return []
 
+    @traced("upsell")
     def get_recommendations_from_order(self, messages, order):
         """Get recommendations based on current order."""
         try:
-            products = [item['item'] for item in order]
-            recommendations = self.get_apriori_recommendation(products)
-            
+            products, recommendations = self._get_order_recommendations(order)
             if not recommendations:
-                # Get popular recommendations instead
-                recommendations = self.get_popular_recommendation(max_recommendations=2)
-                
-                if not recommendations:
-                    return {
-                        "role": "assistant",
-                        "content": "Would you like anything else with your order? We have a variety of pastries and drinks that might interest you!",
-                        "memory": {"agent": "recommendation_agent"}
-                    }
-            
-            recommendations_str = ", ".join(recommendations)
-            
-            system_prompt = """You are a helpful AI assistant for a coffee shop application.
-            Your task is to recommend additional items that would go well with the customer's current order.
-            Be friendly, enthusiastic, and explain why these items would complement their order.
-            Focus on creating an appealing combination of items.
-            DO NOT list or summarize their current order - just focus on the recommendations."""
+                return self._get_order_fallback_response()
 
-            prompt = f"""Based on their order of: {', '.join(products)}
-            
-            Please recommend these additional items: {recommendations_str}
-            
-            Make your response friendly and explain why these items would go well with their current order.
-            Keep it concise but enticing.
-            DO NOT repeat their current order or show prices - just focus on the recommendations."""
-
-            response_text = get_chatbot_response(
-                self.client,
-                [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ]
-            )
+            response_text = get_chatbot_response(self.client, self._build_order_recommendation_prompt(products, recommendations))
 
             return {
                 "role": "assistant",
@@ -258,12 +353,91 @@ class RecommendationAgent():
 
         except Exception as e:
             logger.error(f"Error getting order recommendations: {str(e)}")
+            return self._get_order_error_response()
+
+    @traced("upsell")
+    async def aget_recommendations_from_order(self, messages, order):
+        """Async variant of get_recommendations_from_order."""
+        try:
+            products, recommendations = self._get_order_recommendations(order)
+            if not recommendations:
+                return self._get_order_fallback_response()
+
+            response_text = await aget_chatbot_response(self.client, self._build_order_recommendation_prompt(products, recommendations))
+
             return {
                 "role": "assistant",
-                "content": "Would you like to try one of our fresh pastries with your order? They go perfectly with our drinks!",
+                "content": response_text,
                 "memory": {"agent": "recommendation_agent"}
             }
 
+        except Exception as e:
+            logger.error(f"Error getting order recommendations: {str(e)}")
+            return self._get_order_error_response()
+
+    def stream_recommendations_from_order(self, messages, order):
+        """Streaming variant of get_recommendations_from_order."""
+        try:
+            products, recommendations = self._get_order_recommendations(order)
+            if not recommendations:
+                yield self._get_order_fallback_response()
+                return
+
+            chunks = []
+            for chunk in stream_chatbot_response(self.client, self._build_order_recommendation_prompt(products, recommendations)):
+                chunks.append(chunk)
+                yield build_stream_chunk(chunk)
+
+            yield {
+                "role": "assistant",
+                "content": process_response_text("".join(chunks)),
+                "memory": {"agent": "recommendation_agent"}
+            }
+
+        except Exception as e:
+            logger.error(f"Error streaming order recommendations: {str(e)}")
+            yield self._get_order_error_response()
+
+    def _get_order_recommendations(self, order):
+        """Get the ordered products and the items to recommend with them."""
+        products = [item['item'] for item in order]
+        recommendations = self.get_apriori_recommendation(products)
+
+        if not recommendations:
+            # Get popular recommendations instead
+            recommendations = self.get_popular_recommendation(max_recommendations=2)
+
+        return products, recommendations
+
+    def _build_order_recommendation_prompt(self, products, recommendations):
+        """Create the upsell prompt for the current order."""
+        return ORDER_RECOMMENDATION_PROMPT.render(products=", ".join(products), recommendations=", ".join(recommendations))
+
+    def _get_order_fallback_response(self):
+        """Response used when there is nothing to recommend with the order."""
+        return {
+            "role": "assistant",
+            "content": "Would you like anything else with your order? We have a variety of pastries and drinks that might interest you!",
+            "memory": {"agent": "recommendation_agent"}
+        }
+
+    def _get_order_error_response(self):
+        """Response used when the order recommendations fail."""
+        return {
+            "role": "assistant",
+            "content": "Would you like to try one of our fresh pastries with your order? They go perfectly with our drinks!",
+            "memory": {"agent": "recommendation_agent"}
+        }
+
+    def _get_fallback_response(self, recommendations):
+        """Plain list of the recommendations for when Gemini can't write the reply."""
+        get_fallback_stats().record("recommendation_agent")
+        return {
+            "role": "assistant",
+            "content": f"You might enjoy our {', '.join(recommendations)}. Would you like to add any of them to your order?",
+            "memory": {"agent": "recommendation_agent"}
+        }
+
     def _get_error_response(self, message):
         """Generate a standard error response."""
         return {
@@ -0,0 +1,148 @@
+import json
+import os
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MERGE_MODES = ("sum", "max")
+
+class RecommendationTables():
+    """Immutable lookup tables compiled once from the recommendation artifacts.
+
+    Popular items are ranked by number of transactions, globally and per
+    category. Apriori rules become a dense confidence matrix over integer item
+    IDs plus, for every item, its recommendations already sorted by confidence.
+    Single-item and popularity queries are slices of precomputed tuples, and
+    multi-item queries merge the matching rows with one vectorized sum or max.
+
+    save writes the compiled tables as confidence.npy plus a small tables.json,
+    load maps the matrix back read-only without re-parsing the artifacts.
+    """
+    def __init__(self, popularity_rows, apriori_recommendations, merge="sum"):
+        if merge not in MERGE_MODES:
+            raise ValueError(f"Unknown apriori merge mode: {merge}")
+        self.merge = merge
+        self.version = None
+
+        # File order, used to list the menu in the classification prompt
+        self.products = tuple(row['product'] for row in popularity_rows)
+        self.product_categories = tuple(row['product_category'] for row in popularity_rows)
+
+        # Rank by transactions, ties keep the file order
+        ranked = sorted(popularity_rows, key=lambda row: -float(row['number_of_transactions']))
+        self.popular = tuple(row['product'] for row in ranked)
+        by_category = {}
+        for row in ranked:
+            by_category.setdefault(row['product_category'], []).append(row['product'])
+        self.popular_by_category = {category: tuple(items) for category, items in by_category.items()}
+
+        # Integer IDs for every item seen in either artifact
+        names = list(self.popular)
+        for item, recommendations in apriori_recommendations.items():
+            names.append(item)
+            names.extend(rec['product'] for rec in recommendations)
+        self.item_names = tuple(dict.fromkeys(names))
+        self.item_ids = {name: i for i, name in enumerate(self.item_names)}
+
+        self.confidence = np.zeros((len(self.item_names), len(self.item_names)), dtype=np.float32)
+        self.apriori = {}
+        for item, recommendations in apriori_recommendations.items():
+            row = self.confidence[self.item_ids[item]]
+            for rec in recommendations:
+                column = self.item_ids[rec['product']]
+                row[column] = max(row[column], float(rec['confidence']))
+            self.apriori[item] = self._rank(row, exclude=(self.item_ids[item],))
+        self.confidence.flags.writeable = False
+
+    @classmethod
+    def load(cls, directory, merge="sum", version=None):
+        """Tables written by save, the confidence matrix is memory-mapped."""
+        if merge not in MERGE_MODES:
+            raise ValueError(f"Unknown apriori merge mode: {merge}")
+        with open(os.path.join(directory, "tables.json"), "r") as file:
+            metadata = json.load(file)
+
+        tables = cls.__new__(cls)
+        tables.merge = merge
+        tables.version = version
+        tables.products = tuple(metadata["products"])
+        tables.product_categories = tuple(metadata["product_categories"])
+        tables.item_names = tuple(metadata["item_names"])
+        tables.item_ids = {name: i for i, name in enumerate(tables.item_names)}
+        tables.popular = tuple(tables.item_names[i] for i in metadata["popular"])
+        tables.popular_by_category = {category: tuple(tables.item_names[i] for i in ids)
+                                      for category, ids in metadata["popular_by_category"].items()}
+        tables.confidence = np.load(os.path.join(directory, "confidence.npy"), mmap_mode="r")
+        tables.apriori = {tables.item_names[i]: tables._rank(tables.confidence[i], exclude=(i,))
+                          for i in metadata["apriori_items"]}
+        return tables
+
+    def save(self, directory):
+        """Write confidence.npy and tables.json, the files load and the artifact store expect."""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "confidence.npy"), np.asarray(self.confidence, dtype=np.float32))
+        with open(os.path.join(directory, "tables.json"), "w") as file:
+            json.dump({
+                "products": list(self.products),
+                "product_categories": list(self.product_categories),
+                "item_names": list(self.item_names),
+                "popular": [self.item_ids[item] for item in self.popular],
+                "popular_by_category": {category: [self.item_ids[item] for item in items]
+                                        for category, items in self.popular_by_category.items()},
+                "apriori_items": [self.item_ids[item] for item in self.apriori]
+            }, file)
+
+    def validate(self):
+        """Raise ValueError if the tables are inconsistent, run before a new version is swapped in."""
+        size = len(self.item_names)
+        if self.confidence.shape != (size, size):
+            raise ValueError(f"Confidence matrix has shape {self.confidence.shape}, expected {(size, size)}")
+        if not np.all(np.isfinite(self.confidence)) or self.confidence.min(initial=0) < 0 or self.confidence.max(initial=0) > 1:
+            raise ValueError("Confidence values must be finite and between 0 and 1")
+        if not self.popular:
+            raise ValueError("No popular items")
+        unknown = set(self.products) - set(self.item_ids)
+        if unknown:
+            raise ValueError(f"Products missing from the item table: {sorted(unknown)}")
+
+    def _rank(self, scores, exclude=()):
+        """Item names with a positive score, best first, ties in ID order."""
+        scores = scores.copy()
+        scores[list(exclude)] = 0
+        order = np.argsort(-scores, kind="stable")
+        order = order[:np.count_nonzero(scores > 0)]
+        return tuple(self.item_names[i] for i in order)
+
+    def get_popular(self, max_recommendations=3):
+        return list(self.popular[:max_recommendations])
+
+    def get_popular_by_category(self, categories, max_recommendations=3):
+        recommendations = []
+        for category in categories:
+            recommendations.extend(self.popular_by_category.get(category, ())[:max_recommendations])
+        return recommendations[:max_recommendations]
+
+    def get_apriori(self, items, max_recommendations=3):
+        """Items bought together with the given ones, ranked by merged confidence."""
+        ids = [self.item_ids[item] for item in dict.fromkeys(items) if item in self.apriori]
+        if not ids:
+            return []
+        if len(ids) == 1:
+            ranked = self.apriori[self.item_names[ids[0]]]
+            exclude = set(items)
+            return [item for item in ranked if item not in exclude][:max_recommendations]
+
+        rows = self.confidence[ids]
+        scores = rows.sum(axis=0) if self.merge == "sum" else rows.max(axis=0)
+        exclude = [self.item_ids[item] for item in items if item in self.item_ids]
+        return list(self._rank(scores, exclude=exclude)[:max_recommendations])
+
+    def stats(self):
+        return {
+            "items": len(self.item_names),
+            "categories": len(self.popular_by_category),
+            "apriori_items": len(self.apriori),
+            "merge": self.merge,
+            "version": self.version
+        }
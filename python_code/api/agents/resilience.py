@@ -0,0 +1,354 @@
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Transport and server errors worth another attempt, matched by class name so the
+# google.api_core exceptions, their grpc counterparts and test fakes all qualify
+RETRYABLE_ERRORS = {"ServiceUnavailable", "TooManyRequests", "ResourceExhausted", "InternalServerError",
+                    "GatewayTimeout", "DeadlineExceeded", "Aborted", "TimeoutError", "ConnectionError"}
+
+# Canned reply for turns that need Gemini to write the answer while it is unavailable
+UNAVAILABLE_MESSAGE = ("I'm sorry, I can't look that up right now. Please try again in a moment, "
+                       "or ask our staff at the counter.")
+
+_request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+class ModelUnavailableError(Exception):
+    """Gemini did not answer: the retries ran out, the deadline passed or the circuit is open."""
+
+class DeadlineExceededError(ModelUnavailableError):
+    pass
+
+class CircuitOpenError(ModelUnavailableError):
+    pass
+
+@contextmanager
+def request_deadline(seconds):
+    """Give every model call made in this context, and in tasks started from it, a shared deadline."""
+    token = _request_deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+def remaining_seconds():
+    """Seconds left before the request deadline, None when there is no deadline."""
+    deadline = _request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def is_retryable(error):
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+class CircuitBreaker():
+    """Stops calling a model after failure_threshold consecutive failures.
+
+    While open, calls fail at once with CircuitOpenError so the agents can use
+    their local fallbacks. After recovery_seconds one probe call is let
+    through, its result closes the circuit again or keeps it open.
+    """
+    def __init__(self, failure_threshold=5, recovery_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.recovery_seconds:
+                self.state = "half_open"
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    logger.error(f"Circuit opened after {self.consecutive_failures} consecutive failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected
+        }
+
+class LatencyTracker():
+    """Recent successful call latencies, used to decide when a call is slow enough to hedge."""
+    def __init__(self, window=200):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, percentile, min_samples):
+        with self._lock:
+            if len(self._latencies) < min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+class ResilientCaller():
+    """Deadline-aware retries, optional hedging and a circuit breaker around one model's calls.
+
+    Each attempt gets the smaller of call_timeout and the time left before the
+    request deadline. Retryable errors are retried up to max_attempts times
+    with full-jitter exponential backoff that never sleeps past the deadline.
+    With hedge_percentile set, a call still running after that percentile of
+    recent latencies gets a duplicate request and the first answer wins.
+    """
+    def __init__(self, name, max_attempts=3, base_delay=0.2, max_delay=2.0, call_timeout=20.0,
+                 hedge_percentile=None, hedge_min_samples=20, breaker=None, hedge_workers=8):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.call_timeout = call_timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = LatencyTracker()
+        self.hedge_workers = hedge_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+        self.deadline_exceeded = 0
+
+    def call(self, func, hedge=True):
+        """Run func(timeout) with retries, func makes one request that gives up after timeout seconds."""
+        self.calls += 1
+        last_error = None
+        for attempt in range(self.max_attempts):
+            timeout = self._attempt_timeout(last_error)
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Circuit for {self.name} is open")
+            start = time.monotonic()
+            try:
+                result = self._hedged_call(func, timeout) if hedge else func(timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The model answered, the request itself is wrong
+                    self.breaker.record_success()
+                    raise
+                last_error = e
+                self.breaker.record_failure()
+                delay = self._delay(attempt)
+                if not self._can_retry(attempt, delay):
+                    break
+                self.retries += 1
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self.latencies.add(time.monotonic() - start)
+            return result
+        self.failures += 1
+        raise ModelUnavailableError(f"{self.name} failed after {attempt + 1} attempts: {str(last_error)}") from last_error
+
+    async def acall(self, afunc, hedge=True):
+        """Async variant of call, afunc(timeout) returns the awaitable of one request."""
+        self.calls += 1
+        last_error = None
+        for attempt in range(self.max_attempts):
+            timeout = self._attempt_timeout(last_error)
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Circuit for {self.name} is open")
+            start = time.monotonic()
+            try:
+                if hedge:
+                    result = await self._ahedged_call(afunc, timeout)
+                else:
+                    result = await asyncio.wait_for(afunc(timeout), timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The model answered, the request itself is wrong
+                    self.breaker.record_success()
+                    raise
+                last_error = e
+                self.breaker.record_failure()
+                delay = self._delay(attempt)
+                if not self._can_retry(attempt, delay):
+                    break
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self.latencies.add(time.monotonic() - start)
+            return result
+        self.failures += 1
+        raise ModelUnavailableError(f"{self.name} failed after {attempt + 1} attempts: {str(last_error)}") from last_error
+
+    def _attempt_timeout(self, last_error):
+        remaining = remaining_seconds()
+        if remaining is None:
+            return self.call_timeout
+        if remaining <= 0:
+            self.deadline_exceeded += 1
+            raise DeadlineExceededError(f"Request deadline passed before calling {self.name}") from last_error
+        return remaining if self.call_timeout is None else min(self.call_timeout, remaining)
+
+    def _delay(self, attempt):
+        # Full jitter, so retries from many workers don't arrive together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _can_retry(self, attempt, delay):
+        """True if there is another attempt and time left to wait for it."""
+        if attempt + 1 >= self.max_attempts:
+            return False
+        remaining = remaining_seconds()
+        return remaining is None or remaining > delay
+
+    def _hedge_after(self, timeout):
+        """Seconds to wait before hedging, None when this call shouldn't be hedged."""
+        if self.hedge_percentile is None:
+            return None
+        threshold = self.latencies.percentile(self.hedge_percentile, self.hedge_min_samples)
+        if threshold is None or (timeout is not None and threshold >= timeout):
+            return None
+        return threshold
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.hedge_workers, thread_name_prefix="model-hedge")
+        return self._executor
+
+    def _hedged_call(self, func, timeout):
+        hedge_after = self._hedge_after(timeout)
+        if hedge_after is None:
+            return func(timeout)
+
+        executor = self._get_executor()
+        start = time.monotonic()
+        primary = executor.submit(contextvars.copy_context().run, func, timeout)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        # The primary is slow, race a duplicate request against it
+        self.hedges += 1
+        hedge_timeout = None if timeout is None else max(timeout - (time.monotonic() - start), 0.001)
+        hedge = executor.submit(contextvars.copy_context().run, func, hedge_timeout)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=hedge_timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"{self.name} did not answer within {timeout} seconds")
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _ahedged_call(self, afunc, timeout):
+        hedge_after = self._hedge_after(timeout)
+        if hedge_after is None:
+            return await asyncio.wait_for(afunc(timeout), timeout)
+
+        start = time.monotonic()
+        primary = asyncio.ensure_future(afunc(timeout))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        # The primary is slow, race a duplicate request against it and cancel the loser
+        self.hedges += 1
+        hedge_timeout = None if timeout is None else max(timeout - (time.monotonic() - start), 0.001)
+        hedge = asyncio.ensure_future(afunc(hedge_timeout))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=hedge_timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError(f"{self.name} did not answer within {timeout} seconds")
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        hedge_after = self._hedge_after(None)
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures,
+            "deadline_exceeded": self.deadline_exceeded,
+            "hedge_after_ms": None if hedge_after is None else round(hedge_after * 1000, 2),
+            "circuit": self.breaker.stats()
+        }
+
+def build_resilient_caller(name):
+    """ResilientCaller for a model configured from the environment."""
+    hedge_percentile = os.getenv("GEMINI_HEDGE_PERCENTILE")
+    call_timeout = float(os.getenv("GEMINI_CALL_TIMEOUT_SECONDS", "20"))
+    return ResilientCaller(name,
+                           max_attempts=int(os.getenv("GEMINI_MAX_ATTEMPTS", "3")),
+                           base_delay=float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.2")),
+                           max_delay=float(os.getenv("GEMINI_RETRY_MAX_DELAY", "2.0")),
+                           call_timeout=call_timeout if call_timeout > 0 else None,
+                           hedge_percentile=float(hedge_percentile) if hedge_percentile else None,
+                           hedge_min_samples=int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20")),
+                           breaker=CircuitBreaker(failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+                                                  recovery_seconds=float(os.getenv("CIRCUIT_RECOVERY_SECONDS", "30"))))
+
+class FallbackStats():
+    """Turns answered by a local fallback because Gemini was unavailable, per agent."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fallbacks = {}
+
+    def record(self, agent):
+        with self._lock:
+            self.fallbacks[agent] = self.fallbacks.get(agent, 0) + 1
+
+    def stats(self):
+        return dict(self.fallbacks)
+
+_fallback_stats = FallbackStats()
+
+def get_fallback_stats():
+    return _fallback_stats
@@ -0,0 +1,154 @@
+import os
+import threading
+from functools import lru_cache
+from typing import List, Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+from .json_repair import parse_json_output
+
+AGENT_NAMES = ["details_agent", "order_taking_agent", "recommendation_agent"]
+GEMINI_SCHEMA_KEYS = ("type", "format", "description", "nullable", "enum", "properties", "required", "items")
+
+class StructuredOutputError(ValueError):
+    pass
+
+class AgentOutput(BaseModel):
+    """Base of the JSON replies the agents ask Gemini for.
+
+    "chain of thought" is never used by the agents, it is only part of the
+    response schema when AGENT_DEBUG_REASONING is on, so normal turns don't
+    pay the output tokens for it.
+    """
+    model_config = ConfigDict(populate_by_name=True, extra="ignore")
+
+    chain_of_thought: Optional[str] = Field(default=None, alias="chain of thought",
+                                            description="Short analysis of the user's request")
+
+class GuardOutput(AgentOutput):
+    decision: Literal["allowed", "not allowed"]
+    message: str = Field(default="", description="Error message if not allowed, empty if allowed")
+
+class ClassificationOutput(AgentOutput):
+    decision: Literal["details_agent", "order_taking_agent", "recommendation_agent"]
+    message: str = ""
+
+class GatekeeperOutput(AgentOutput):
+    guard_decision: Literal["allowed", "not allowed"]
+    # Validated as a plain string so an unknown agent falls back to details_agent
+    classification_decision: str = Field(json_schema_extra={"enum": AGENT_NAMES})
+    message: str = Field(default="", description="Polite refusal if not allowed, empty if allowed")
+
+class OrderItem(BaseModel):
+    item: str
+    quantity: int
+    price: float
+
+class OrderOutput(AgentOutput):
+    step_number: str = Field(alias="step number")
+    order: List[OrderItem]
+    response: str = Field(description="Your response to the user")
+
+    @field_validator("step_number", mode="before")
+    @classmethod
+    def _step_number_as_string(cls, value):
+        return str(value) if isinstance(value, (int, float)) else value
+
+    @field_validator("order", mode="before")
+    @classmethod
+    def _order_from_string(cls, value):
+        # Without a response schema the model sometimes writes the order as a JSON string
+        if isinstance(value, str):
+            value, _ = parse_json_output(value)
+        return value
+
+class RecommendationClassificationOutput(AgentOutput):
+    recommendation_type: Literal["apriori", "popular", "popular by category"]
+    parameters: List[str] = Field(default_factory=list,
+                                  description="Items for apriori, categories for popular by category, empty for popular")
+
+def is_response_schema_enabled():
+    return os.getenv("RESPONSE_SCHEMA_ENABLED", "true").lower() in ("1", "true", "yes")
+
+def is_debug_reasoning_enabled():
+    return os.getenv("AGENT_DEBUG_REASONING", "false").lower() in ("1", "true", "yes")
+
+def gemini_schema(schema):
+    """The response_schema sent to Gemini for a pydantic output model."""
+    return _gemini_schema(schema, is_debug_reasoning_enabled())
+
+@lru_cache(maxsize=None)
+def _gemini_schema(schema, include_reasoning):
+    json_schema = schema.model_json_schema(by_alias=True)
+    converted = _convert_schema(json_schema, json_schema.get("$defs", {}))
+    if not include_reasoning:
+        converted["properties"].pop("chain of thought", None)
+    return converted
+
+def _convert_schema(node, defs):
+    """Reduce a pydantic JSON schema to the OpenAPI subset Gemini accepts.
+
+    References are inlined, titles and defaults dropped, Optional[X] becomes
+    a nullable X and enums get the "enum" format.
+    """
+    if "$ref" in node:
+        node = defs[node["$ref"].split("/")[-1]]
+    if "anyOf" in node:
+        options = [option for option in node["anyOf"] if option.get("type") != "null"]
+        converted = _convert_schema(options[0], defs)
+        if len(options) < len(node["anyOf"]):
+            converted["nullable"] = True
+        if "description" in node:
+            converted["description"] = node["description"]
+        return converted
+
+    converted = {key: value for key, value in node.items() if key in GEMINI_SCHEMA_KEYS}
+    if "enum" in converted:
+        converted.setdefault("type", "string")
+        converted["format"] = "enum"
+    if "properties" in converted:
+        converted["properties"] = {name: _convert_schema(value, defs) for name, value in converted["properties"].items()}
+    if "items" in converted:
+        converted["items"] = _convert_schema(converted["items"], defs)
+    return converted
+
+class SchemaStats():
+    """Replies that parsed as JSON but did not match their response schema, per schema."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.validated = 0
+        self.invalid = {}
+
+    def record(self, schema, valid):
+        with self._lock:
+            if valid:
+                self.validated += 1
+            else:
+                self.invalid[schema.__name__] = self.invalid.get(schema.__name__, 0) + 1
+
+    def stats(self):
+        return {
+            "enabled": is_response_schema_enabled(),
+            "debug_reasoning": is_debug_reasoning_enabled(),
+            "validated": self.validated,
+            "invalid": dict(self.invalid)
+        }
+
+_stats = SchemaStats()
+
+def get_schema_stats():
+    return _stats
+
+def validate_output(schema, output):
+    """Turn parsed model output into a schema instance, the one validation path of every JSON agent.
+
+    Raises StructuredOutputError for error payloads and for output that does
+    not match the schema.
+    """
+    if isinstance(output, dict) and output.get("error"):
+        raise StructuredOutputError(output.get("message", "Error: Invalid JSON format"))
+    try:
+        result = schema.model_validate(output)
+    except ValidationError as e:
+        _stats.record(schema, False)
+        raise StructuredOutputError(f"Output does not match {schema.__name__}: {str(e)}")
+    _stats.record(schema, True)
+    return result
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class SemanticAnswerCache():
+    """Reuses DetailsAgent answers for questions that are close to one already answered.
+
+    A stored answer is returned when the new question's embedding is within
+    max_distance (cosine distance) of a cached question that retrieved the same
+    context IDs and names the same key terms (menu items), so "what's in a
+    latte" never gets the cappuccino answer however close the embeddings are.
+    Entries live in a preallocated float32 matrix so a lookup is one
+    matrix-vector product, the least recently used entry is replaced when full,
+    entries older than ttl_seconds are not served, and everything is dropped
+    when the knowledge base version changes.
+    """
+    def __init__(self, max_size=512, max_distance=0.02, ttl_seconds=None, key_terms=None):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        # Longest first, so "almond croissant" is found before "croissant"
+        self.key_terms = sorted({term.lower() for term in key_terms or []}, key=len, reverse=True)
+        self.knowledge_base_version = None
+        self._lock = threading.Lock()
+
+        self._matrix = None
+        self._questions = []
+        self._contexts = []
+        self._answers = []
+        self._terms = []
+        self._stored_at = np.zeros(max_size)
+        self._last_used = np.zeros(max_size, dtype=np.int64)
+        self._clock = 0
+
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _question_key(question):
+        normalized = re.sub(r"\s+", " ", question.lower()).strip().rstrip(" .!?")
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def _question_terms(self, question):
+        """The key terms the question names, a found term is blanked out so it isn't matched twice."""
+        text = re.sub(r"\s+", " ", question.lower())
+        terms = []
+        for term in self.key_terms:
+            if term in text:
+                terms.append(term)
+                text = text.replace(term, " ")
+        return frozenset(terms)
+
+    def _check_version(self, knowledge_base_version):
+        if knowledge_base_version != self.knowledge_base_version:
+            if self._answers:
+                self.invalidations += 1
+            self._matrix = None
+            self._questions, self._contexts, self._answers, self._terms = [], [], [], []
+            self.knowledge_base_version = knowledge_base_version
+
+    def lookup(self, question, embedding, context_ids, knowledge_base_version=None):
+        """Return the cached answer for the question, or None."""
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        context_ids = tuple(context_ids)
+        with self._lock:
+            self._check_version(knowledge_base_version)
+            if not self._answers or norm == 0:
+                self.misses += 1
+                return None
+
+            count = len(self._answers)
+            similarities = self._matrix[:count] @ (query / norm)
+            terms = self._question_terms(question)
+            same_context = np.fromiter((context == context_ids and entry_terms == terms
+                                        for context, entry_terms in zip(self._contexts, self._terms)),
+                                       dtype=bool, count=count)
+            similarities[~same_context] = -np.inf
+            if self.ttl_seconds:
+                # Expired entries are never used again, so the LRU replaces them first
+                similarities[time.monotonic() - self._stored_at[:count] > self.ttl_seconds] = -np.inf
+
+            best = int(similarities.argmax())
+            if 1.0 - similarities[best] > self.max_distance:
+                self.misses += 1
+                return None
+
+            self._clock += 1
+            self._last_used[best] = self._clock
+            if self._questions[best] == self._question_key(question):
+                self.exact_hits += 1
+            else:
+                self.near_hits += 1
+            return self._answers[best]
+
+    def store(self, question, embedding, context_ids, answer, knowledge_base_version=None):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return
+        with self._lock:
+            self._check_version(knowledge_base_version)
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+
+            if len(self._answers) < self.max_size:
+                slot = len(self._answers)
+                self._questions.append(None)
+                self._contexts.append(None)
+                self._answers.append(None)
+                self._terms.append(None)
+            else:
+                slot = int(self._last_used.argmin())
+                self.evictions += 1
+
+            self._matrix[slot] = vector / norm
+            self._questions[slot] = self._question_key(question)
+            self._contexts[slot] = tuple(context_ids)
+            self._answers[slot] = answer
+            self._terms[slot] = self._question_terms(question)
+            self._stored_at[slot] = time.monotonic()
+            self._clock += 1
+            self._last_used[slot] = self._clock
+
+    def stats(self):
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            "size": len(self._answers),
+            "max_size": self.max_size,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": round((self.exact_hits + self.near_hits) / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,158 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Protocol, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+class SessionStore(Protocol):
+    """Where AgentController keeps the compact state of a conversation between turns."""
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    def save(self, session_id: str, session: Dict[str, Any]) -> None:
+        ...
+
+    def delete(self, session_id: str) -> None:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        ...
+
+class InMemorySessionStore():
+    """Bounded LRU of sessions with a TTL that is renewed on every save.
+
+    Sessions are kept as JSON strings, so callers always get a fresh copy.
+    Only the worker that saved a session can read it back, use the sqlite
+    store on a shared volume when turns can land on different workers.
+    """
+    def __init__(self, max_size=10000, ttl_seconds=3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._sessions[session_id]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            return json.loads(value)
+
+    def save(self, session_id, session):
+        value = json.dumps(session)
+        with self._lock:
+            self._sessions[session_id] = (time.time() + self.ttl_seconds, value)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "size": len(self._sessions),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+class SqliteSessionStore():
+    """Sessions in a sqlite file, for local testing and for workers that share a volume.
+
+    Expired rows are skipped on read and deleted when the store is opened and
+    every cleanup_every saves.
+    """
+    def __init__(self, db_path, ttl_seconds=3600, cleanup_every=1000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.cleanup_every = cleanup_every
+        self._lock = threading.Lock()
+        self._saves = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                                session_id TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                expires_at REAL NOT NULL)""")
+        self._delete_expired()
+
+    def get(self, session_id):
+        with self._lock:
+            try:
+                row = self._db.execute("SELECT value FROM sessions WHERE session_id = ? AND expires_at >= ?",
+                                       (session_id, time.time())).fetchone()
+            except Exception as e:
+                logger.error(f"Error reading session {session_id}: {str(e)}")
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def save(self, session_id, session):
+        value = json.dumps(session)
+        with self._lock:
+            try:
+                self._db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                                 (session_id, value, time.time() + self.ttl_seconds))
+                self._db.commit()
+            except Exception as e:
+                logger.error(f"Error saving session {session_id}: {str(e)}")
+            self._saves += 1
+        if self._saves % self.cleanup_every == 0:
+            self._delete_expired()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+    def _delete_expired(self):
+        with self._lock:
+            try:
+                self._db.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+                self._db.commit()
+            except Exception as e:
+                logger.error(f"Error deleting expired sessions: {str(e)}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self._lock:
+            size = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,320 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets in seconds, from a cache hit to a slow generation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+def is_tracing_enabled():
+    return os.getenv("TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+
+class Span():
+    """One timed stage of a request, its children are the stages it called."""
+    __slots__ = ("name", "attributes", "start", "end", "children", "_lock")
+
+    def __init__(self, name, attributes=None, start=None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = time.perf_counter() if start is None else start
+        self.end = None
+        self.children = []
+        self._lock = threading.Lock()
+
+    def add_child(self, span):
+        # Speculative stages add their spans from executor threads
+        with self._lock:
+            self.children.append(span)
+
+    def finish(self, end=None):
+        self.end = time.perf_counter() if end is None else end
+
+    @property
+    def duration_ms(self):
+        end = time.perf_counter() if self.end is None else self.end
+        return round((end - self.start) * 1000, 3)
+
+    def to_dict(self, origin):
+        """Nested breakdown with offsets relative to origin, a perf_counter value."""
+        output = {"name": self.name, "offset_ms": round((self.start - origin) * 1000, 3), "duration_ms": self.duration_ms}
+        if self.attributes:
+            output["attributes"] = self.attributes
+        if self.children:
+            output["children"] = [child.to_dict(origin) for child in sorted(self.children, key=lambda child: child.start)]
+        return output
+
+class Trace():
+    """Span tree of one request, exported when the request finishes."""
+    def __init__(self, name, attributes=None):
+        self.trace_id = uuid.uuid4().hex
+        self.start_time = time.time()
+        self.root = Span(name, attributes)
+
+    def finish(self):
+        self.root.finish()
+        get_span_histograms().record(self.root.name, self.root.end - self.root.start)
+        for exporter in get_trace_exporters():
+            try:
+                exporter.export(self)
+            except Exception as e:
+                logger.error(f"Error exporting trace with {type(exporter).__name__}: {str(e)}")
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "start_time": self.start_time,
+            **self.root.to_dict(self.root.start)
+        }
+
+    def walk(self):
+        """(span, parent) for every span of the trace, parents first."""
+        pending = [(self.root, None)]
+        while pending:
+            span, parent = pending.pop()
+            yield span, parent
+            pending.extend((child, span) for child in span.children)
+
+@contextmanager
+def start_trace(name, **attributes):
+    """Root span of a request, every span opened in this context becomes part of it.
+
+    Yields None when tracing is turned off.
+    """
+    if not is_tracing_enabled():
+        yield None
+        return
+    trace = Trace(name, attributes)
+    token = _current_span.set(trace.root)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(token)
+        trace.finish()
+
+@contextmanager
+def span(name, **attributes):
+    """Time the block as a child of the current span and record it in the stage histograms."""
+    if not is_tracing_enabled():
+        yield None
+        return
+    current = Span(name, attributes)
+    parent = _current_span.get()
+    if parent is not None:
+        parent.add_child(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        _current_span.reset(token)
+        current.finish()
+        get_span_histograms().record(name, current.end - current.start)
+
+def record_span(name, start, **attributes):
+    """Add a span that started at start (a perf_counter value) and ends now.
+
+    For stages that can't hold the current span open, like a stream that
+    yields in between.
+    """
+    if not is_tracing_enabled():
+        return
+    current = Span(name, attributes, start)
+    current.finish()
+    parent = _current_span.get()
+    if parent is not None:
+        parent.add_child(current)
+    get_span_histograms().record(name, current.end - current.start)
+
+def traced(name):
+    """Decorator that runs a function, sync or async, inside span(name)."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def run_in_context(context, iterator):
+    """Iterate in context, so the contextvars of a streamed request stay with it between yields."""
+    try:
+        while True:
+            try:
+                item = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            context.run(close)
+
+class SpanHistograms():
+    """Prometheus-style latency histograms per span name."""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._sums = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            counts = self._counts.get(name)
+            if counts is None:
+                counts = self._counts[name] = [0] * (len(self.buckets) + 1)
+                self._sums[name] = 0.0
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._sums[name] += seconds
+
+    def stats(self):
+        """Count, mean and bucket estimates of the p50 and p95 per span name, in milliseconds."""
+        with self._lock:
+            snapshot = {name: (list(counts), self._sums[name]) for name, counts in self._counts.items()}
+        output = {}
+        for name, (counts, total) in sorted(snapshot.items()):
+            count = sum(counts)
+            output[name] = {
+                "count": count,
+                "mean_ms": round(total / count * 1000, 3) if count else 0.0,
+                "p50_ms": self._bucket_percentile(counts, 50),
+                "p95_ms": self._bucket_percentile(counts, 95)
+            }
+        return output
+
+    def _bucket_percentile(self, counts, percentile):
+        """Upper bound of the bucket holding the percentile, None if it is past the last bucket."""
+        target = sum(counts) * percentile / 100
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= target and count:
+                return round(self.buckets[index] * 1000, 3) if index < len(self.buckets) else None
+        return None
+
+    def render_prometheus(self, metric="agent_span_duration_seconds"):
+        """Histograms in the Prometheus text exposition format."""
+        with self._lock:
+            snapshot = {name: (list(counts), self._sums[name]) for name, counts in self._counts.items()}
+        lines = [f"# HELP {metric} Duration of the agent pipeline stages.", f"# TYPE {metric} histogram"]
+        for name, (counts, total) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{metric}_bucket{{span="{name}",le="+Inf"}} {cumulative}')
+            lines.append(f'{metric}_sum{{span="{name}"}} {total}')
+            lines.append(f'{metric}_count{{span="{name}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+class JsonLinesExporter():
+    """Appends every finished trace to a JSON-lines file."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace):
+        line = orjson.dumps(trace.to_dict()) + b"\n"
+        with self._lock:
+            with open(self.path, "ab") as file:
+                file.write(line)
+
+class PrometheusFileExporter():
+    """Rewrites the histograms as a Prometheus textfile, at most once per interval_seconds.
+
+    RunPod workers don't serve HTTP, so the file is meant for a textfile
+    collector or a sidecar that scrapes it.
+    """
+    def __init__(self, path, interval_seconds=15):
+        self.path = path
+        self.interval_seconds = interval_seconds
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+
+    def export(self, trace):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_write < self.interval_seconds:
+                return
+            self._last_write = now
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as file:
+            file.write(get_span_histograms().render_prometheus())
+        os.replace(temporary_path, self.path)
+
+class OpenTelemetryExporter():
+    """Replays finished traces as OpenTelemetry spans.
+
+    Needs opentelemetry-api, the deployment configures the SDK and where the
+    spans are sent.
+    """
+    def __init__(self, tracer_name="coffee-shop-agents"):
+        # Imported here so the dependency is only needed when this exporter is on
+        from opentelemetry import trace as otel_trace
+        self._otel_trace = otel_trace
+        self.tracer = otel_trace.get_tracer(tracer_name)
+
+    def export(self, trace):
+        origin_ns = int(trace.start_time * 1e9)
+        origin = trace.root.start
+        otel_spans = {}
+        for current, parent in trace.walk():
+            context = None
+            if parent is not None:
+                context = self._otel_trace.set_span_in_context(otel_spans[id(parent)])
+            otel_span = self.tracer.start_span(current.name, context=context,
+                                               attributes={key: str(value) for key, value in current.attributes.items()},
+                                               start_time=origin_ns + int((current.start - origin) * 1e9))
+            otel_spans[id(current)] = otel_span
+            # A speculative stage the request stopped waiting for may still be running
+            end = current.end if current.end is not None else trace.root.end
+            otel_span.end(end_time=origin_ns + int((end - origin) * 1e9))
+
+_histograms = SpanHistograms()
+_exporters = None
+_exporters_lock = threading.Lock()
+
+def get_span_histograms():
+    return _histograms
+
+def get_trace_exporters():
+    """Exporters configured from the environment, built on first use."""
+    global _exporters
+    if _exporters is None:
+        with _exporters_lock:
+            if _exporters is None:
+                _exporters = _build_exporters()
+    return _exporters
+
+def _build_exporters():
+    exporters = []
+    jsonl_path = os.getenv("TRACE_JSONL_PATH")
+    if jsonl_path:
+        exporters.append(JsonLinesExporter(jsonl_path))
+    prometheus_path = os.getenv("TRACE_PROMETHEUS_PATH")
+    if prometheus_path:
+        exporters.append(PrometheusFileExporter(prometheus_path,
+                                                float(os.getenv("TRACE_PROMETHEUS_INTERVAL_SECONDS", "15"))))
+    if os.getenv("TRACE_OTEL_ENABLED", "false").lower() in ("1", "true", "yes"):
+        try:
+            exporters.append(OpenTelemetryExporter())
+        except ImportError as e:
+            logger.error(f"TRACE_OTEL_ENABLED is set but opentelemetry is not installed: {str(e)}")
+    return exporters
@@ -1,40 +1,31 @@
-import google.generativeai as genai
 import os
-import dotenv
+import time
 import logging
 import json
-import re
-
-dotenv.load_dotenv()
-
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+import orjson
+from .embedding_cache import get_embedding_cache
+from .conversation_view import ConversationView
+from .prompts import Prompt
+from .json_repair import parse_json_output, get_json_repair_stats, JsonRepairError
+from .response_schemas import gemini_schema, is_response_schema_enabled, validate_output
+from .resilience import ModelUnavailableError
+from .tracing import span, record_span, traced
 
 logger = logging.getLogger(__name__)
 
 def clean_json_response(response_text):
-    """Clean JSON response by removing markdown code blocks and extra whitespace."""
+    """Clean JSON response by removing markdown code blocks and repairing common mistakes locally."""
     try:
-        # Remove markdown code block markers if present
-        cleaned = re.sub(r'^```\w*\n|```$', '', response_text, flags=re.MULTILINE).strip()
-        
-        # Try to parse it as JSON
-        try:
-            return json.dumps(json.loads(cleaned))
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON after cleaning: {cleaned}")
-            return json.dumps({
-                "chain of thought": "Error occurred during JSON processing",
-                "decision": "not allowed",
-                "message": "Error: Invalid JSON format"
-            })
+        output, repaired = parse_json_output(response_text)
+        get_json_repair_stats().count("repaired" if repaired else "clean")
+        return orjson.dumps(output).decode("utf-8")
+    except JsonRepairError:
+        logger.error(f"Invalid JSON after cleaning: {response_text}")
+        get_json_repair_stats().count("failed")
+        return json.dumps(get_error_response_output("Invalid JSON format"))
     except Exception as e:
         logger.error(f"Error cleaning JSON response: {str(e)}")
-        return json.dumps({
-            "chain of thought": "Error occurred during JSON processing",
-            "decision": "not allowed",
-            "message": f"Error: {str(e)}"
-        })
+        return json.dumps(get_error_response_output(e))
 
 def format_message_for_gemini(message):
     """Format a message for Gemini API."""
@@ -50,86 +41,356 @@ def format_message_for_gemini(message):
         logger.error(f"Error formatting message: {str(e)}")
         return ''
 
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    }
+]
+
+def get_last_user_message(messages):
+    """Return the content of the most recent user message, or an empty string."""
+    if isinstance(messages, ConversationView):
+        return messages.last_user_message
+    for msg in reversed(messages):
+        if msg.get('role') == 'user':
+            return msg.get('content', '')
+    return ""
+
+def build_prompt(messages):
+    """Combine the formatted messages into the single prompt string sent to Gemini."""
+    formatted_messages = []
+    for message in messages:
+        content = format_message_for_gemini(message)
+        if content:
+            formatted_messages.append(content)
+    return "\n".join(formatted_messages)
+
+def build_request(messages):
+    """Contents and keyword arguments of a Gemini call.
+
+    A Prompt sends its user part as contents and its static text as the
+    system_instruction. Plain role-tagged messages are still flattened into
+    one prompt string.
+    """
+    if isinstance(messages, Prompt):
+        return messages.contents, {"system_instruction": messages.system_instruction}
+    return build_prompt(messages), {}
+
+def record_prompt(messages, response=None):
+    """Add a Prompt's size (and the token usage Gemini reported) to its template's counters."""
+    if isinstance(messages, Prompt):
+        try:
+            messages.template.stats.record(messages, response)
+        except Exception as e:
+            logger.error(f"Error recording prompt stats: {str(e)}")
+
+def get_span_name(messages):
+    """Trace span of a model call, named after the prompt so every agent's generation gets its own histogram."""
+    if isinstance(messages, Prompt):
+        return f"generation.{messages.template.name}"
+    return "generation"
+
+def get_generation_config(temperature=0, schema=None):
+    """Generation settings shared by every chatbot call, with the JSON response schema if one is given."""
+    generation_config = {
+        "temperature": temperature,
+        "top_p": 0.8,
+        "top_k": 40,
+        "max_output_tokens": 2000,
+    }
+    if schema is not None and is_response_schema_enabled():
+        generation_config["response_mime_type"] = "application/json"
+        generation_config["response_schema"] = gemini_schema(schema)
+    return generation_config
+
+def process_response_text(response_text):
+    """Clean the response if it looks like JSON, otherwise return it untouched."""
+    if response_text.strip().startswith('{') or response_text.strip().startswith('```'):
+        return clean_json_response(response_text)
+    return response_text
+
+def get_error_response_output(e):
+    """Error payload returned when the chatbot call fails or its JSON can't be recovered."""
+    return {
+        "chain of thought": "Error occurred during processing",
+        "decision": "not allowed",
+        "error": True,
+        "message": f"Error: {str(e)}"
+    }
+
+def get_error_response_text(e):
+    """JSON error payload returned when the chatbot call fails."""
+    return json.dumps(get_error_response_output(e))
+
+def is_error_response_text(response_text):
+    """True for the error payloads returned when a chatbot call fails."""
+    try:
+        output = json.loads(response_text)
+    except (json.JSONDecodeError, TypeError):
+        return False
+    return isinstance(output, dict) and bool(output.get("error"))
+
 def get_chatbot_response(client, messages, temperature=0):
     """Get response from the chatbot with proper error handling and message formatting."""
     try:
-        # Format messages for Gemini
-        formatted_messages = []
-        for message in messages:
-            content = format_message_for_gemini(message)
-            if content:
-                formatted_messages.append(content)
-        
-        if not formatted_messages:
+        # Split the prompt into contents and the system instruction
+        contents, prompt_kwargs = build_request(messages)
+        if not contents:
             logger.error("No valid messages to process")
             return "Error: No valid messages to process"
-        
-        # Combine all messages into a single prompt
-        combined_prompt = "\n".join(formatted_messages)
-        
+
         # Generate response
-        response = client.generate_content(
-            contents=combined_prompt,
-            generation_config=genai.GenerationConfig(
-                temperature=temperature,
-                top_p=0.8,
-                top_k=40,
-                max_output_tokens=2000,
-            ),
-            safety_settings=[
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                }
-            ]
-        )
-        
-        # Clean the response if it looks like JSON
-        if response.text.strip().startswith('{') or response.text.strip().startswith('```'):
-            return clean_json_response(response.text)
-        return response.text
-        
+        with span(get_span_name(messages)):
+            response = client.generate_content(
+                contents=contents,
+                generation_config=get_generation_config(temperature),
+                safety_settings=SAFETY_SETTINGS,
+                **prompt_kwargs
+            )
+        record_prompt(messages, response)
+
+        return process_response_text(response.text)
+
+    except ModelUnavailableError:
+        # Left to the agent, it answers with its fallback instead of an error payload
+        raise
     except Exception as e:
         logger.error(f"Error in get_chatbot_response: {str(e)}")
-        return json.dumps({
-            "chain of thought": "Error occurred during processing",
-            "decision": "not allowed",
-            "message": f"Error: {str(e)}"
-        })
+        return get_error_response_text(e)
+
+async def aget_chatbot_response(client, messages, temperature=0):
+    """Async variant of get_chatbot_response built on generate_content_async."""
+    try:
+        # Split the prompt into contents and the system instruction
+        contents, prompt_kwargs = build_request(messages)
+        if not contents:
+            logger.error("No valid messages to process")
+            return "Error: No valid messages to process"
+
+        # Generate response without blocking the event loop
+        with span(get_span_name(messages)):
+            response = await client.generate_content_async(
+                contents=contents,
+                generation_config=get_generation_config(temperature),
+                safety_settings=SAFETY_SETTINGS,
+                **prompt_kwargs
+            )
+        record_prompt(messages, response)
+
+        return process_response_text(response.text)
+
+    except ModelUnavailableError:
+        # Left to the agent, it answers with its fallback instead of an error payload
+        raise
+    except Exception as e:
+        logger.error(f"Error in aget_chatbot_response: {str(e)}")
+        return get_error_response_text(e)
+
+def get_structured_response(client, messages, schema, temperature=0):
+    """Get a reply constrained to a pydantic response schema and validated into an instance of it.
+
+    Errors, including output that doesn't match the schema, are raised to the caller.
+    """
+    # Split the prompt into contents and the system instruction
+    contents, prompt_kwargs = build_request(messages)
+    if not contents:
+        raise ValueError("No valid messages to process")
+
+    with span(get_span_name(messages)):
+        response = client.generate_content(
+            contents=contents,
+            generation_config=get_generation_config(temperature, schema),
+            safety_settings=SAFETY_SETTINGS,
+            **prompt_kwargs
+        )
+    record_prompt(messages, response)
+
+    return validate_output(schema, double_check_json_output(client, response.text))
+
+async def aget_structured_response(client, messages, schema, temperature=0):
+    """Async variant of get_structured_response built on generate_content_async."""
+    # Split the prompt into contents and the system instruction
+    contents, prompt_kwargs = build_request(messages)
+    if not contents:
+        raise ValueError("No valid messages to process")
+
+    with span(get_span_name(messages)):
+        response = await client.generate_content_async(
+            contents=contents,
+            generation_config=get_generation_config(temperature, schema),
+            safety_settings=SAFETY_SETTINGS,
+            **prompt_kwargs
+        )
+    record_prompt(messages, response)
+
+    return validate_output(schema, await adouble_check_json_output(client, response.text))
+
+def stream_chatbot_response(client, messages, temperature=0, schema=None):
+    """Yield the response text chunk by chunk as Gemini generates it, errors are raised to the caller."""
+    # Split the prompt into contents and the system instruction
+    contents, prompt_kwargs = build_request(messages)
+    if not contents:
+        raise ValueError("No valid messages to process")
 
+    # Recorded when the stream ends, the current span can't be held open across the yields
+    start = time.perf_counter()
+    response = client.generate_content(
+        contents=contents,
+        generation_config=get_generation_config(temperature, schema),
+        safety_settings=SAFETY_SETTINGS,
+        stream=True,
+        **prompt_kwargs
+    )
+
+    for chunk in response:
+        if chunk.text:
+            yield chunk.text
+
+    record_span(get_span_name(messages) + ".stream", start)
+    # The usage metadata is complete once the stream is consumed
+    record_prompt(messages, response)
+
+def build_stream_chunk(text):
+    """Partial chunk of a streamed reply, the final chunk is the usual response with its memory."""
+    return {"role": "assistant", "delta": text}
+
+class JsonStringFieldStreamer():
+    """Pulls one top-level string field out of a JSON object while it is being streamed.
+
+    feed takes the next piece of raw model output and returns the newly decoded
+    text of the field, so the field can be shown before the JSON is complete.
+    """
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, field):
+        self.field = field
+        self.depth = 0
+        self.in_string = False
+        self.escape = None
+        self.capturing = False
+        self.buffer = []
+        self.last_string = None
+        self.key = None
+        self.text = ""
+
+    def feed(self, chunk):
+        decoded = []
+        for char in chunk:
+            if self.in_string:
+                if self.escape is not None:
+                    self.escape += char
+                    if self.escape[0] == 'u':
+                        if len(self.escape) < 5:
+                            continue
+                        char = chr(int(self.escape[1:], 16))
+                    else:
+                        char = self.ESCAPES.get(self.escape, self.escape)
+                    self.escape = None
+                elif char == '\\':
+                    self.escape = ""
+                    continue
+                elif char == '"':
+                    self.in_string = False
+                    if not self.capturing:
+                        self.last_string = "".join(self.buffer)
+                    self.capturing = False
+                    self.key = None
+                    continue
+                (decoded if self.capturing else self.buffer).append(char)
+            elif char == '"':
+                self.in_string = True
+                self.capturing = self.depth == 1 and self.key == self.field
+                self.buffer = []
+            elif char in "{[":
+                self.depth += 1
+                self.key = None
+            elif char in "}]":
+                self.depth -= 1
+            elif char == ':' and self.depth == 1:
+                self.key = self.last_string
+            elif char == ',':
+                self.key = None
+
+        text = "".join(decoded)
+        self.text += text
+        return text
+
+def get_embedding_model_name(embedding_client):
+    """Name of the embedding model, part of every embedding cache key."""
+    return getattr(embedding_client, "model", None) or type(embedding_client).__name__
+
+@traced("embedding")
 def get_embedding(embedding_client, text_input):
     """Get embeddings with error handling."""
     try:
+        cache = get_embedding_cache()
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.make_key(get_embedding_model_name(embedding_client), "query", text_input)
+            output = cache.get(cache_key)
+            if output is not None:
+                return output
+
         output = embedding_client.embed_query(text_input)
+        if cache is not None and output:
+            cache.set(cache_key, output)
         return output
     except Exception as e:
         logger.error(f"Error in get_embedding: {str(e)}")
         return None
 
-def double_check_json_output(client, json_string):
-    """Validate and correct JSON output with error handling."""
+@traced("embedding")
+async def aget_embedding(embedding_client, text_input):
+    """Async variant of get_embedding."""
     try:
-        # First try to parse it as JSON
-        try:
-            json.loads(json_string)
-            return json_string
-        except json.JSONDecodeError:
-            pass
+        cache = get_embedding_cache()
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.make_key(get_embedding_model_name(embedding_client), "query", text_input)
+            output = cache.get(cache_key)
+            if output is not None:
+                return output
+
+        output = await embedding_client.aembed_query(text_input)
+        if cache is not None and output:
+            cache.set(cache_key, output)
+        return output
+    except Exception as e:
+        logger.error(f"Error in aget_embedding: {str(e)}")
+        return None
+
+def get_document_embeddings(embedding_client, texts):
+    """Embed documents for an index, only the texts missing from the cache are sent to the model."""
+    cache = get_embedding_cache()
+    if cache is None:
+        return embedding_client.embed_documents(texts)
+
+    model_name = get_embedding_model_name(embedding_client)
+    cache_keys = [cache.make_key(model_name, "document", text) for text in texts]
+    outputs = [cache.get(cache_key) for cache_key in cache_keys]
+
+    missing = [i for i, output in enumerate(outputs) if output is None]
+    if missing:
+        embeddings = embedding_client.embed_documents([texts[i] for i in missing])
+        for i, embedding in zip(missing, embeddings):
+            cache.set(cache_keys[i], embedding)
+            outputs[i] = embedding
+    return outputs
 
-        # If parsing failed, try to fix it
-        prompt = """You will check this json string and correct any mistakes that will make it invalid. 
+JSON_REPAIR_PROMPT = """You will check this json string and correct any mistakes that will make it invalid. 
         Then you will return ONLY the corrected JSON string with NO markdown formatting or code blocks.
         If the JSON is correct just return it as is.
         Do NOT add any explanation or text outside the JSON.
@@ -137,37 +398,78 @@ def double_check_json_output(client, json_string):
         Just return the raw JSON string.
 
         Input JSON:
-        """ + json_string
+        """
 
-        response = client.generate_content(
-            contents=prompt,
-            generation_config=genai.GenerationConfig(
-                temperature=0,
-                top_p=0.8,
-                top_k=40,
-                max_output_tokens=2000,
-            ),
-        )
+def is_llm_json_repair_enabled():
+    return os.getenv("JSON_LLM_REPAIR", "true").lower() in ("1", "true", "yes")
+
+def _parse_json_locally(json_string):
+    """Parsed output and whether it needed the local repair, None when it can't be recovered locally."""
+    try:
+        output, repaired = parse_json_output(json_string)
+    except JsonRepairError as e:
+        logger.error(f"Local JSON repair failed: {str(e)}")
+        return None
+    get_json_repair_stats().count("repaired" if repaired else "clean")
+    return output
+
+def _parse_llm_repair(json_string, response_text):
+    try:
+        output, _ = parse_json_output(response_text)
+    except JsonRepairError:
+        logger.error(f"Failed to fix JSON: {json_string}")
+        get_json_repair_stats().count("failed")
+        return get_error_response_output("Invalid JSON format")
+    get_json_repair_stats().count("llm_repairs")
+    return output
+
+def double_check_json_output(client, json_string):
+    """Parse the model's JSON output into Python objects.
+
+    Malformed output is repaired locally. Asking the model to fix it is the
+    last resort, counted as llm_repairs in the json_repair metrics, and can be
+    turned off with JSON_LLM_REPAIR=false.
+    """
+    try:
+        output = _parse_json_locally(json_string)
+        if output is not None:
+            return output
+
+        if not is_llm_json_repair_enabled():
+            get_json_repair_stats().count("failed")
+            return get_error_response_output("Invalid JSON format")
+
+        with span("json_llm_repair"):
+            response = client.generate_content(
+                contents=JSON_REPAIR_PROMPT + json_string,
+                generation_config=get_generation_config(0),
+            )
+        return _parse_llm_repair(json_string, response.text)
 
-        # Clean and validate the response
-        cleaned_response = clean_json_response(response.text)
-        
-        # Try to parse the cleaned response
-        try:
-            json.loads(cleaned_response)
-            return cleaned_response
-        except json.JSONDecodeError:
-            logger.error(f"Failed to fix JSON: {json_string}")
-            return json.dumps({
-                "chain of thought": "Error occurred during JSON processing",
-                "decision": "not allowed",
-                "message": "Error: Invalid JSON format"
-            })
-            
     except Exception as e:
         logger.error(f"Error in double_check_json_output: {str(e)}")
-        return json.dumps({
-            "chain of thought": "Error occurred during JSON processing",
-            "decision": "not allowed",
-            "message": f"Error: {str(e)}"
-        })
\ No newline at end of file
+        get_json_repair_stats().count("failed")
+        return get_error_response_output(e)
+
+async def adouble_check_json_output(client, json_string):
+    """Async variant of double_check_json_output."""
+    try:
+        output = _parse_json_locally(json_string)
+        if output is not None:
+            return output
+
+        if not is_llm_json_repair_enabled():
+            get_json_repair_stats().count("failed")
+            return get_error_response_output("Invalid JSON format")
+
+        with span("json_llm_repair"):
+            response = await client.generate_content_async(
+                contents=JSON_REPAIR_PROMPT + json_string,
+                generation_config=get_generation_config(0),
+            )
+        return _parse_llm_repair(json_string, response.text)
+
+    except Exception as e:
+        logger.error(f"Error in adouble_check_json_output: {str(e)}")
+        get_json_repair_stats().count("failed")
+        return get_error_response_output(e)
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import logging
+import threading
+import time
+import numpy as np
+from .client_registry import get_client_registry
+
+logger = logging.getLogger(__name__)
+
+class PineconeVectorIndex():
+    """Queries the hosted Pinecone index through the shared handle in the client registry.
+
+    The version that keys cached answers is KNOWLEDGE_BASE_VERSION plus the
+    namespace's vector count, re-read from describe_index_stats at most every
+    check_seconds, so rebuilding the index with other documents drops the
+    cached answers without a redeploy. A rebuild that keeps the count still
+    needs KNOWLEDGE_BASE_VERSION bumped, or the answer cache TTL to pass.
+    """
+    def __init__(self, index_name, namespace="ns1", check_seconds=None):
+        self.index_name = index_name
+        self.namespace = namespace
+        self.base_version = os.getenv("KNOWLEDGE_BASE_VERSION", index_name)
+        if check_seconds is None:
+            check_seconds = float(os.getenv("KNOWLEDGE_BASE_CHECK_SECONDS", "300"))
+        self.check_seconds = check_seconds
+        self._vector_count = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        if self.check_seconds > 0:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= self.check_seconds:
+                with self._lock:
+                    # Another request may have refreshed it while this one waited
+                    if self._checked_at is None or now - self._checked_at >= self.check_seconds:
+                        self._checked_at = now
+                        self._refresh_vector_count()
+        if self._vector_count is None:
+            return self.base_version
+        return f"{self.base_version}:{self._vector_count}"
+
+    def _refresh_vector_count(self):
+        """Keeps the last known count when the stats can't be read."""
+        try:
+            stats = get_client_registry().get_pinecone_index(self.index_name).describe_index_stats()
+            namespaces = _stats_field(stats, "namespaces") or {}
+            namespace = namespaces.get(self.namespace) if hasattr(namespaces, "get") else None
+            if namespace is not None:
+                self._vector_count = int(_stats_field(namespace, "vector_count"))
+            else:
+                self._vector_count = int(_stats_field(stats, "total_vector_count"))
+        except Exception as e:
+            logger.error(f"Error reading Pinecone index stats: {str(e)}")
+
+    def query(self, vector, top_k=2):
+        index = get_client_registry().get_pinecone_index(self.index_name)
+        return index.query(
+            namespace=self.namespace,
+            vector=vector,
+            top_k=top_k,
+            include_values=False,
+            include_metadata=True
+        )
+
+def _stats_field(stats, name):
+    """Field of a Pinecone stats response, which is a dict or an object depending on the client version."""
+    if isinstance(stats, dict):
+        return stats.get(name)
+    return getattr(stats, name, None)
+
+class LocalVectorIndex():
+    """Top-k cosine search over a precomputed, memory-mapped embedding matrix.
+
+    The directory holds metadata.json plus either embeddings.npy (float32) or
+    embeddings_int8.npy and scales.npy (one scale per row). Rows are normalized
+    when the index is built, so a query is a single matrix-vector product.
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, "metadata.json"), "r") as file:
+            metadata = json.load(file)
+        self.ids = metadata["ids"]
+        self.texts = metadata["texts"]
+        self.embedding_model = metadata.get("embedding_model")
+        self.version = metadata.get("version")
+
+        if metadata.get("dtype") == "int8":
+            self.matrix = np.load(os.path.join(directory, "embeddings_int8.npy"), mmap_mode="r")
+            self.scales = np.load(os.path.join(directory, "scales.npy"))
+        else:
+            self.matrix = np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r")
+            self.scales = None
+
+    @staticmethod
+    def build(directory, ids, texts, embeddings, embedding_model=None, quantize=False):
+        """Write an index directory from raw embeddings."""
+        os.makedirs(directory, exist_ok=True)
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+        if quantize:
+            scales = np.abs(matrix).max(axis=1) / 127.0
+            np.save(os.path.join(directory, "embeddings_int8.npy"), np.round(matrix / scales[:, None]).astype(np.int8))
+            np.save(os.path.join(directory, "scales.npy"), scales.astype(np.float32))
+        else:
+            np.save(os.path.join(directory, "embeddings.npy"), matrix)
+
+        version = hashlib.sha256("\x00".join([str(embedding_model)] + list(texts)).encode("utf-8")).hexdigest()[:16]
+        with open(os.path.join(directory, "metadata.json"), "w") as file:
+            json.dump({
+                "version": version,
+                "ids": list(ids),
+                "texts": list(texts),
+                "dimension": int(matrix.shape[1]),
+                "dtype": "int8" if quantize else "float32",
+                "embedding_model": embedding_model
+            }, file)
+
+    def query(self, vector, top_k=2):
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return {"matches": []}
+
+        scores = self.matrix @ (query / norm)
+        if self.scales is not None:
+            scores = scores * self.scales
+
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return {
+            "matches": [
+                {"id": self.ids[i], "score": float(scores[i]), "metadata": {"text": self.texts[i]}}
+                for i in top
+            ]
+        }
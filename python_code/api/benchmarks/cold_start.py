@@ -0,0 +1,102 @@
+"""Import-time and startup-time report for a fresh worker process.
+
+Every run starts a new interpreter with -X importtime, imports agent_controller,
+builds an AgentController in the requested startup mode and then waits until
+all agents are built. Run from the api folder with the usual environment
+variables set. No Gemini or Pinecone request is made unless CLIENT_WARMUP is on.
+
+    python -m benchmarks.cold_start --mode lazy --repeat 5 --budget-ms 1500
+
+cold_start_ms (import plus constructor, the time until the handler can be
+registered) is checked against --budget-ms and the script exits with status 1
+when the median run is over budget, so it can gate a CI job or a deploy.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import agent_controller
+import_ms = (time.perf_counter() - start) * 1000
+
+start = time.perf_counter()
+controller = agent_controller.AgentController(startup_mode={mode!r})
+init_ms = (time.perf_counter() - start) * 1000
+
+if controller.startup_thread is not None:
+    controller.startup_thread.join()
+controller.pipeline_agents.build_all()
+controller.agent_dict.build_all()
+ready_ms = (time.perf_counter() - start) * 1000
+
+print(json.dumps({{
+    "import_ms": import_ms,
+    "init_ms": init_ms,
+    "ready_ms": import_ms + ready_ms,
+    "build_ms": controller.get_metrics()["startup"]["build_ms"]
+}}))
+"""
+
+def parse_importtime(stderr, top):
+    """Slowest top-level packages by cumulative import time in ms."""
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if "." not in name:
+            packages[name] = max(packages.get(name, 0), int(cumulative) / 1000)
+    slowest = sorted(packages.items(), key=lambda item: -item[1])[:top]
+    return {name: round(ms, 1) for name, ms in slowest}
+
+def run_once(mode, top):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD_SCRIPT.format(mode=mode)],
+                            cwd=API_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup failed:\n{result.stderr[-2000:]}")
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["cold_start_ms"] = report["import_ms"] + report["init_ms"]
+    report["slowest_imports_ms"] = parse_importtime(result.stderr, top)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", default=os.getenv("AGENT_STARTUP", "eager"), choices=["eager", "lazy", "background"])
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh processes to start, the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Fail when the median cold start is over this")
+    parser.add_argument("--output", help="Optional path for the JSON report")
+    args = parser.parse_args()
+
+    runs = [run_once(args.mode, args.top) for _ in range(args.repeat)]
+    results = {
+        "mode": args.mode,
+        "runs": args.repeat,
+        "cold_start_ms": round(statistics.median(run["cold_start_ms"] for run in runs), 1),
+        "import_ms": round(statistics.median(run["import_ms"] for run in runs), 1),
+        "init_ms": round(statistics.median(run["init_ms"] for run in runs), 1),
+        "ready_ms": round(statistics.median(run["ready_ms"] for run in runs), 1),
+        "build_ms": runs[-1]["build_ms"],
+        "slowest_imports_ms": runs[-1]["slowest_imports_ms"],
+        "budget_ms": args.budget_ms
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.budget_ms is not None and results["cold_start_ms"] > args.budget_ms:
+        print(f"Cold start of {results['cold_start_ms']} ms is over the {args.budget_ms} ms budget", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Allocation benchmark and no-mutation check for the shared ConversationView.
+
+For ordering conversations of 5, 50 and 500 messages it compares what one
+turn used to cost (the guard, the classifier and the chosen agent each
+deep-copying the history) against building one ConversationView and reading
+the last user message and the latest order memory. Allocation is measured
+with tracemalloc. It then runs GuardAgent, ClassificationAgent,
+OrderTakingAgent and RecommendationAgent on every history with a scripted
+client in place of Gemini and checks that the input messages come back
+unchanged. No Gemini request is made. Run from the api folder:
+
+    python -m benchmarks.conversation_view --budget-bytes 4096
+
+The script exits with status 1 if an agent mutated its input, or if the view
+allocates more than --budget-bytes for a turn.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+import tracemalloc
+from agents import (GuardAgent,
+                    ClassificationAgent,
+                    OrderTakingAgent,
+                    RecommendationAgent,
+                    ConversationView
+                    )
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_SIZES = (5, 50, 500)
+
+class ScriptedResponse():
+    def __init__(self, text):
+        self.text = text
+
+class ScriptedClient():
+    """Stands in for a GenerativeModel, answers every prompt with a fixed valid reply."""
+    def generate_content(self, contents, **kwargs):
+        contents = (kwargs.get("system_instruction") or "") + contents
+        if "recommendation_type" in contents:
+            text = '{"chain of thought": "", "recommendation_type": "popular", "parameters": []}'
+        elif "step number" in contents:
+            text = ('{"chain of thought": "", "step number": "4", "response": "Added a Latte.",'
+                    ' "order": [{"item": "Latte", "quantity": 1, "price": 4.75}]}')
+        elif '"decision"' in contents and "order_taking_agent" in contents:
+            text = '{"chain of thought": "", "decision": "order_taking_agent", "message": ""}'
+        elif '"decision"' in contents:
+            text = '{"chain of thought": "", "decision": "allowed", "message": ""}'
+        else:
+            text = "Try a Chocolate Croissant with it."
+        return ScriptedResponse(text)
+
+def build_history(size):
+    """An ordering conversation of size messages that ends with a user turn."""
+    messages = []
+    order = []
+    for turn in range(size - 1):
+        if turn % 2 == 0:
+            messages.append({"role": "user", "content": f"I'd like one more Latte please ({turn})"})
+        else:
+            order = [{"item": "Latte", "quantity": turn // 2 + 1, "price": 4.75},
+                     {"item": "Almond Croissant", "quantity": 1, "price": 3.75}]
+            messages.append({
+                "role": "assistant",
+                "content": "Great choice! Would you like anything else?",
+                "memory": {"agent": "order_taking_agent", "step number": "4",
+                           "order": order, "asked_recommendation_before": True}
+            })
+    messages.append({"role": "user", "content": "And a Cappuccino"})
+    return messages
+
+def measure(func, repeat):
+    """Peak bytes allocated by one call and the mean time of repeat calls in microseconds."""
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return peak, round((time.perf_counter() - start) / repeat * 1e6, 2)
+
+def deepcopy_turn(messages):
+    # Guard, classification and the chosen agent each copied the history
+    for _ in range(3):
+        copied = copy.deepcopy(messages)
+    return copied
+
+def view_turn(messages):
+    view = ConversationView(messages)
+    return view.last_user_message, view.latest_memory("order_taking_agent").get("order", [])
+
+def build_agents():
+    recommendation_agent = RecommendationAgent(
+        os.path.join(API_DIR, 'recommendation_objects', 'apriori_recommendations.json'),
+        os.path.join(API_DIR, 'recommendation_objects', 'popularity_recommendation.csv'))
+    agents = {
+        "guard_agent": GuardAgent(),
+        "classification_agent": ClassificationAgent(),
+        "order_taking_agent": OrderTakingAgent(recommendation_agent),
+        "recommendation_agent": recommendation_agent
+    }
+    for agent in agents.values():
+        agent.client = ScriptedClient()
+    return agents
+
+def check_no_mutation(agents, messages):
+    """Names of the agents that changed the input messages."""
+    mutated = []
+    snapshot = json.dumps(messages, sort_keys=True)
+    view = ConversationView(messages)
+    for name, agent in agents.items():
+        agent.get_response(view)
+        agent.get_response(messages)
+        if json.dumps(messages, sort_keys=True) != snapshot:
+            mutated.append(name)
+            snapshot = json.dumps(messages, sort_keys=True)
+    return mutated
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="Calls per timing")
+    parser.add_argument("--budget-bytes", type=int, default=None, help="Fail when the view allocates more than this per turn")
+    parser.add_argument("--output", help="Optional path for the JSON report")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_MODEL_NAME", "scripted")
+    agents = build_agents()
+
+    results = {"histories": {}, "mutated": {}, "budget_bytes": args.budget_bytes}
+    for size in HISTORY_SIZES:
+        messages = build_history(size)
+        deepcopy_bytes, deepcopy_us = measure(lambda: deepcopy_turn(messages), args.repeat)
+        view_bytes, view_us = measure(lambda: view_turn(messages), args.repeat)
+        results["histories"][size] = {
+            "deepcopy_bytes": deepcopy_bytes,
+            "deepcopy_us": deepcopy_us,
+            "view_bytes": view_bytes,
+            "view_us": view_us
+        }
+        mutated = check_no_mutation(agents, messages)
+        if mutated:
+            results["mutated"][size] = mutated
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    failed = False
+    if results["mutated"]:
+        print(f"Agents mutated their input: {results['mutated']}", file=sys.stderr)
+        failed = True
+    if args.budget_bytes is not None:
+        over = {size: history["view_bytes"] for size, history in results["histories"].items()
+                if history["view_bytes"] > args.budget_bytes}
+        if over:
+            print(f"ConversationView allocations over the {args.budget_bytes} byte budget: {over}", file=sys.stderr)
+            failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
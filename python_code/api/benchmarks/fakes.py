@@ -0,0 +1,244 @@
+"""Local stand-ins for Gemini, the embedding model and Pinecone used by the benchmarks.
+
+FakeGenai has the two parts of google.generativeai the agents use,
+configure and GenerativeModel, so it can be passed to ModelClient or
+ClientRegistry in place of the real module. Every call sleeps for a sampled
+latency, honours the request_options timeout and fails with
+ServiceUnavailable at failure_rate. The latency and failure settings are
+plain attributes and can be changed while a benchmark runs, for example to
+start or end an outage. FakeEmbeddings and FakePineconeIndex do the same
+for the details path, and FakeClientRegistry serves all three to the agents.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import zlib
+import numpy as np
+from agents.client_registry import ClientRegistry
+
+class ServiceUnavailable(Exception):
+    """Stands in for google.api_core.exceptions.ServiceUnavailable, it is retried by name."""
+
+class FakeResponse():
+    def __init__(self, text):
+        self.text = text
+
+def schema_reply(schema, key=None):
+    """Smallest reply that matches a response_schema, enums take their first value."""
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: schema_reply(value, name) for name, value in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [schema_reply(schema["items"], key)]
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 4.75
+    if kind == "boolean":
+        return True
+    return "Latte" if key == "item" else ""
+
+class FakeGenai():
+    """Fake google.generativeai module that injects latency and failures.
+
+    Each call takes latency seconds plus up to jitter seconds, slow_rate of
+    the calls take slow_latency seconds instead, and failure_rate of them
+    raise ServiceUnavailable once the latency has passed. latency_per_1k_chars
+    adds time for the prompt length, so longer histories answer slower.
+    responder(system_instruction, contents, generation_config) can script the
+    replies, by default they are generated from the response schema.
+    """
+    def __init__(self, latency=0.01, jitter=0.0, slow_rate=0.0, slow_latency=1.0, failure_rate=0.0,
+                 text="Thanks for asking! We're open from 7am to 8pm.", seed=0, latency_per_1k_chars=0.0, responder=None):
+        self.latency = latency
+        self.latency_per_1k_chars = latency_per_1k_chars
+        self.responder = responder
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.failure_rate = failure_rate
+        self.text = text
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+
+    def configure(self, **kwargs):
+        pass
+
+    def GenerativeModel(self, model_name, system_instruction=None):
+        return FakeGenerativeModel(self, model_name, system_instruction)
+
+    def sample(self, prompt_chars=0):
+        """(delay, fails) for one call."""
+        with self._lock:
+            self.calls += 1
+            if self._rng.random() < self.slow_rate:
+                delay = self.slow_latency
+            else:
+                delay = self.latency + self._rng.uniform(0, self.jitter)
+            delay += self.latency_per_1k_chars * prompt_chars / 1000
+            fails = self._rng.random() < self.failure_rate
+            if fails:
+                self.failures += 1
+        return delay, fails
+
+    def count_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def reply(self, system_instruction, contents, generation_config):
+        if self.responder is not None:
+            return self.responder(system_instruction, contents, generation_config)
+        schema = (generation_config or {}).get("response_schema")
+        if schema:
+            return json.dumps(schema_reply(schema))
+        return self.text
+
+class FakeGenerativeModel():
+    def __init__(self, genai, model_name, system_instruction=None):
+        self._genai = genai
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def generate_content(self, contents, generation_config=None, request_options=None, stream=False, **kwargs):
+        delay, fails = self._genai.sample(self._prompt_chars(contents))
+        timeout = (request_options or {}).get("timeout")
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            self._genai.count_timeout()
+            raise TimeoutError(f"Fake model did not answer within {timeout} seconds")
+        time.sleep(delay)
+        return self._respond(fails, contents, generation_config, stream)
+
+    async def generate_content_async(self, contents, generation_config=None, request_options=None, stream=False, **kwargs):
+        delay, fails = self._genai.sample(self._prompt_chars(contents))
+        timeout = (request_options or {}).get("timeout")
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            self._genai.count_timeout()
+            raise TimeoutError(f"Fake model did not answer within {timeout} seconds")
+        await asyncio.sleep(delay)
+        return self._respond(fails, contents, generation_config, stream)
+
+    def count_tokens(self, contents):
+        return {"total_tokens": len(str(contents)) // 4}
+
+    def _prompt_chars(self, contents):
+        return len(self.system_instruction or "") + len(contents if isinstance(contents, str) else str(contents))
+
+    def _respond(self, fails, contents, generation_config, stream):
+        if fails:
+            raise ServiceUnavailable("503 The model is overloaded. Please try again later.")
+        text = self._genai.reply(self.system_instruction, contents, generation_config)
+        if stream:
+            return [FakeResponse(text[i:i + 16]) for i in range(0, len(text), 16)]
+        return FakeResponse(text)
+
+class ScriptedResponder():
+    """Plausible replies for every agent prompt, routed by keywords in the user message.
+
+    Schema replies follow the response schema with the decisions filled in:
+    the guard allows every turn, orders go to the order taking agent,
+    recommendation requests to the recommendation agent and the rest to the
+    details agent. Free-text prompts get a fixed answer.
+    """
+    ORDER_WORDS = re.compile(r"\b(like|get|have|order|add|want|take|that's all|please)\b", re.IGNORECASE)
+    RECOMMENDATION_WORDS = re.compile(r"\b(recommend|suggest|popular|goes well|should i)\b", re.IGNORECASE)
+
+    def __init__(self, text="Thanks for asking! Our Latte is made with a double shot of espresso and steamed milk."):
+        self.text = text
+
+    def __call__(self, system_instruction, contents, generation_config):
+        schema = (generation_config or {}).get("response_schema")
+        if not schema:
+            return self.text
+        contents = contents if isinstance(contents, str) else str(contents)
+        reply = schema_reply(schema)
+        route = self.route(contents)
+        if "decision" in reply:
+            reply["decision"] = route if "details_agent" in schema["properties"]["decision"].get("enum", []) else "allowed"
+        if "classification_decision" in reply:
+            reply["classification_decision"] = route
+        if "recommendation_type" in reply:
+            reply["recommendation_type"] = "popular"
+            reply["parameters"] = []
+        if "response" in reply:
+            reply["step number"] = "4"
+            reply["response"] = "Great choice! Would you like anything else?"
+        return json.dumps(reply)
+
+    def route(self, contents):
+        if self.RECOMMENDATION_WORDS.search(contents):
+            return "recommendation_agent"
+        if self.ORDER_WORDS.search(contents):
+            return "order_taking_agent"
+        return "details_agent"
+
+class FakeEmbeddings():
+    """Embedding client with the langchain interface, vectors are a deterministic function of the text."""
+    def __init__(self, dimension=768, latency=0.0, model="fake-embedding"):
+        self.dimension = dimension
+        self.latency = latency
+        self.model = model
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.vector(text)
+
+    async def aembed_query(self, text):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self.vector(text)
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self.vector(text) for text in texts]
+
+    def vector(self, text):
+        vector = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+class FakePineconeIndex():
+    """Pinecone index handle over a few documents held in memory."""
+    def __init__(self, documents, embeddings, latency=0.0):
+        self.latency = latency
+        self.ids = [str(index) for index in range(len(documents))]
+        self.documents = list(documents)
+        self.matrix = np.array([embeddings.vector(document) for document in documents], dtype=np.float32)
+        self.calls = 0
+
+    def query(self, vector, top_k=2, namespace=None, include_values=False, include_metadata=True, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        scores = self.matrix @ np.asarray(vector, dtype=np.float32)
+        top = np.argsort(-scores)[:top_k]
+        return {"matches": [{"id": self.ids[index], "score": float(scores[index]),
+                             "metadata": {"text": self.documents[index]}} for index in top]}
+
+    def describe_index_stats(self):
+        return {"total_vector_count": len(self.documents)}
+
+class FakeClientRegistry(ClientRegistry):
+    """ClientRegistry that hands out the fakes, install it with set_client_registry."""
+    def __init__(self, genai, embeddings, pinecone_index):
+        super().__init__(api_key="fake", genai=genai)
+        self.embeddings = embeddings
+        self.pinecone_index = pinecone_index
+
+    def get_embedding_client(self, model_name):
+        self._embedding_clients[model_name] = self.embeddings
+        return self.embeddings
+
+    def get_pinecone_index(self, index_name):
+        self._indexes[index_name] = self.pinecone_index
+        return self.pinecone_index
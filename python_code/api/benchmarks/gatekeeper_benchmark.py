@@ -0,0 +1,114 @@
+"""Side-by-side benchmark of the two-call pre-routing path against GatekeeperAgent.
+
+Run from the api folder with the usual environment variables set:
+
+    python -m benchmarks.gatekeeper_benchmark --repeat 3
+"""
+import argparse
+import json
+import statistics
+import time
+from agents import GuardAgent, ClassificationAgent, GatekeeperAgent
+
+UTTERANCES = [
+    "I would like one Latte please",
+    "Can I get two cappuccinos and a croissant?",
+    "that's all",
+    "What are your working hours?",
+    "Where is the coffee shop located?",
+    "Do you deliver to Greenpoint?",
+    "Is the cappuccino lactose-free?",
+    "What's in the almond croissant?",
+    "What do you recommend with my latte?",
+    "What are your most popular pastries?",
+    "Can you recommend something sweet?",
+    "What is the capital of France?",
+    "How do I make a latte at home?",
+    "Who is working at the counter today?",
+]
+
+class CountingClient():
+    """Wraps a GenerativeModel and records how many calls and prompt characters go through it."""
+    def __init__(self, client):
+        self.client = client
+        self.calls = 0
+        self.prompt_chars = 0
+
+    def generate_content(self, contents, **kwargs):
+        self.calls += 1
+        self.prompt_chars += len(contents) if isinstance(contents, str) else len(json.dumps(contents, default=str))
+        self.prompt_chars += len(kwargs.get("system_instruction") or "")
+        return self.client.generate_content(contents, **kwargs)
+
+def run_two_call_path(guard_agent, classification_agent, messages):
+    guard_response = guard_agent.get_response(messages)
+    if guard_response["memory"]["guard_decision"] == "not allowed":
+        return "not allowed", None
+    classification_response = classification_agent.get_response(messages)
+    return "allowed", classification_response["memory"]["classification_decision"]
+
+def run_gatekeeper_path(gatekeeper_agent, messages):
+    response = gatekeeper_agent.get_response(messages)
+    memory = response["memory"]
+    if memory["guard_decision"] == "not allowed":
+        return "not allowed", None
+    return "allowed", memory["classification_decision"]
+
+def summarize(latencies, clients, turns):
+    calls = sum(client.calls for client in clients)
+    prompt_chars = sum(client.prompt_chars for client in clients)
+    return {
+        "turns": turns,
+        "llm_calls": calls,
+        "llm_calls_per_turn": round(calls / turns, 2),
+        "prompt_chars_per_turn": round(prompt_chars / turns, 1),
+        "latency_ms_mean": round(statistics.mean(latencies), 1),
+        "latency_ms_p50": round(statistics.median(latencies), 1),
+        "latency_ms_p95": round(sorted(latencies)[int(0.95 * (len(latencies) - 1))], 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=1, help="How many times to send every utterance")
+    parser.add_argument("--output", help="Optional path for the JSON results")
+    args = parser.parse_args()
+
+    guard_agent = GuardAgent()
+    classification_agent = ClassificationAgent()
+    gatekeeper_agent = GatekeeperAgent()
+    guard_agent.client = CountingClient(guard_agent.client)
+    classification_agent.client = CountingClient(classification_agent.client)
+    gatekeeper_agent.client = CountingClient(gatekeeper_agent.client)
+
+    two_call_latencies, gatekeeper_latencies = [], []
+    agreements = 0
+    turns = 0
+    for _ in range(args.repeat):
+        for utterance in UTTERANCES:
+            messages = [{"role": "user", "content": utterance}]
+            turns += 1
+
+            start = time.perf_counter()
+            two_call_decision = run_two_call_path(guard_agent, classification_agent, messages)
+            two_call_latencies.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            gatekeeper_decision = run_gatekeeper_path(gatekeeper_agent, messages)
+            gatekeeper_latencies.append((time.perf_counter() - start) * 1000)
+
+            agreements += two_call_decision == gatekeeper_decision
+            print(f"{utterance!r}: two-call={two_call_decision} gatekeeper={gatekeeper_decision}")
+
+    results = {
+        "two_call": summarize(two_call_latencies, [guard_agent.client, classification_agent.client], turns),
+        "gatekeeper": summarize(gatekeeper_latencies, [gatekeeper_agent.client], turns),
+        "decision_agreement": round(agreements / turns, 3),
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Fuzz corpus for the local JSON repair that runs before any LLM repair.
+
+Valid replies of the guard, classification, order taking and recommendation
+prompts are broken the ways Gemini breaks them: code fences, text around the
+object, trailing commas, Python repr (single quotes, True/None), raw
+newlines and unescaped quotes inside strings, comments, unquoted keys,
+missing commas, and output cut off at the token limit. Each sample also gets
+a mix of two or three of these. A sample counts as repaired when
+parse_json_output returns the original object, or for a cut off reply, an
+object whose keys all belong to the original. The baseline column is what
+the old fence stripping plus json.loads recovered, every miss there was an
+LLM round trip. No Gemini request is made. Run from the api folder:
+
+    python -m benchmarks.json_repair --min-rate 0.95
+
+The script exits with status 1 if the local repair rate is below --min-rate.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from agents import parse_json_output, JsonRepairError
+
+BASE_OUTPUTS = [
+    {"chain of thought": "The user asks about opening hours, that is coffee shop related.",
+     "decision": "allowed", "message": ""},
+    {"chain of thought": "The user wants to know how to fix a car, it's not related to the coffee shop.",
+     "decision": "not allowed", "message": "Sorry, I can't help with that. Can I help you with your order?"},
+    {"chain of thought": "The user said \"I'd like a latte\", they want to place an order.",
+     "decision": "order_taking_agent", "message": ""},
+    {"chain of thought": "The user asked for something sweet to go with coffee.",
+     "recommendation_type": "popular by category", "parameters": ["Bakery", "Flavours"]},
+    {"chain of thought": "The user added two items, the order is not complete yet.",
+     "step number": "4",
+     "order": [{"item": "Latte", "quantity": 2, "price": 4.75},
+               {"item": "Almond Croissant", "quantity": 1, "price": 3.75}],
+     "response": "Great choice! Your order so far:\n- 2 Latte\n- 1 Almond Croissant\nAnything else?"},
+    {"chain of thought": "The user is done, summarise the order with the total.",
+     "step number": "6",
+     "order": [{"item": "Cappuccino", "quantity": 1, "price": 4.5}],
+     "response": "Your total is $4.50.\nThank you for your order, enjoy your \"Cappuccino\"!"},
+]
+
+PROSE_PREFIXES = ["Sure! Here is the JSON:\n", "Here's my answer:\n\n", "Output: "]
+PROSE_SUFFIXES = ["\nLet me know if you need anything else.", "\n\nI hope this helps!", ""]
+
+def fence(text, rng):
+    return f"```json\n{text}\n```"
+
+def prose(text, rng):
+    return rng.choice(PROSE_PREFIXES) + text + rng.choice(PROSE_SUFFIXES)
+
+def trailing_comma(text, rng):
+    return re.sub(r'\n(\s*)([}\]])', r',\n\1\2', text)
+
+def raw_newlines(text, rng):
+    return text.replace('\\n', '\n')
+
+def inner_quotes(text, rng):
+    return text.replace('\\"', '"')
+
+def comments(text, rng):
+    if '\n' not in text:
+        return text.replace('{', '{ /* ' + rng.choice(["keep this short", "required", "see above"]) + ' */ ', 1)
+    lines = text.split('\n')
+    index = rng.randrange(1, len(lines))
+    lines.insert(index, "  // " + rng.choice(["keep this short", "required", "see above"]))
+    return '\n'.join(lines)
+
+def unquoted_keys(text, rng):
+    return re.sub(r'"([A-Za-z_]+)":', r'\1:', text)
+
+def missing_commas(text, rng):
+    return text.replace(',\n', '\n')
+
+MUTATIONS = {
+    "fence": fence,
+    "prose": prose,
+    "trailing_comma": trailing_comma,
+    "raw_newlines": raw_newlines,
+    "inner_quotes": inner_quotes,
+    "comments": comments,
+    "unquoted_keys": unquoted_keys,
+    "missing_commas": missing_commas,
+}
+
+def build_corpus(samples, seed):
+    """(mutation, text, expected, truncated) tuples."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(samples):
+        output = rng.choice(BASE_OUTPUTS)
+        text = json.dumps(output, indent=rng.choice([None, 2, 4]))
+        corpus.append(("python_repr", repr(output), output, False))
+        for name, mutate in MUTATIONS.items():
+            corpus.append((name, mutate(text, rng), output, False))
+
+        names = rng.sample(sorted(MUTATIONS), rng.randint(2, 3))
+        mixed = text
+        for name in names:
+            mixed = MUTATIONS[name](mixed, rng)
+        corpus.append(("mixed", mixed, output, False))
+
+        cut = rng.randint(len(text) * 6 // 10, len(text) - 2)
+        corpus.append(("truncated", text[:cut], output, True))
+    return corpus
+
+def is_repaired(value, expected, truncated):
+    if truncated:
+        return isinstance(value, dict) and set(value) <= set(expected)
+    return value == expected
+
+def baseline_parse(text):
+    """What clean_json_response did before the local repair: strip fences and json.loads."""
+    return json.loads(re.sub(r'^```\w*\n|```$', '', text, flags=re.MULTILINE).strip())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=200, help="Base replies to mutate")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--min-rate", type=float, default=None, help="Fail when fewer samples are repaired locally")
+    parser.add_argument("--output", help="Optional path for the JSON report")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.samples, args.seed)
+    results = {}
+    failures = []
+    start = time.perf_counter()
+    for name, text, expected, truncated in corpus:
+        result = results.setdefault(name, {"samples": 0, "repaired": 0, "baseline": 0})
+        result["samples"] += 1
+        try:
+            value, _ = parse_json_output(text)
+            if is_repaired(value, expected, truncated):
+                result["repaired"] += 1
+            else:
+                failures.append((name, text))
+        except JsonRepairError:
+            failures.append((name, text))
+        try:
+            if is_repaired(baseline_parse(text), expected, truncated):
+                result["baseline"] += 1
+        except json.JSONDecodeError:
+            pass
+    elapsed = time.perf_counter() - start
+
+    total = len(corpus)
+    repaired = sum(result["repaired"] for result in results.values())
+    baseline = sum(result["baseline"] for result in results.values())
+    report = {
+        "samples": total,
+        "local_repair_rate": round(repaired / total, 4),
+        "baseline_rate": round(baseline / total, 4),
+        "llm_round_trips_avoided": repaired - baseline,
+        "mean_us": round(elapsed / total * 1e6, 2),
+        "mutations": {name: {**result, "rate": round(result["repaired"] / result["samples"], 4)}
+                      for name, result in results.items()},
+        "min_rate": args.min_rate
+    }
+    print(json.dumps(report, indent=2))
+    for name, text in failures[:5]:
+        print(f"Not repaired ({name}): {text!r}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.min_rate is not None and report["local_repair_rate"] < args.min_rate:
+        print(f"Local repair rate {report['local_repair_rate']} is below {args.min_rate}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
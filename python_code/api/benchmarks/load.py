@@ -0,0 +1,391 @@
+"""Offline load and latency benchmark of AgentController.
+
+Drives get_response, aget_response and stream_response with local
+stand-ins from benchmarks.fakes instead of Gemini, the embedding model and
+Pinecone: a latency-modeled GenerativeModel with scripted replies, a
+deterministic embedding client and an in-memory Pinecone index over the
+menu. Every combination of execution mode, entry point, concurrency level
+and history length is a cell. A cell sends --requests requests, with up to
+the cell's concurrency in flight, and reports the throughput, the p50, p95
+and p99 request latency and the same percentiles per pipeline stage. The
+stages come from the span tree each response carries with include_timings.
+
+The decision, embedding and answer caches are off unless --caches is set,
+so repeated utterances measure the full path. With --model-latency-ms 0
+the numbers are the pipeline's own overhead. Run from the api folder:
+
+    python -m benchmarks.load --concurrency 1,8,32 --history 1,9 --output load.json
+    python -m benchmarks.load --baseline load.json --max-regression 0.2
+
+Requests come from the built-in utterance mix, or from --workload, a JSONL
+file with one {"input": {...}} request per line. A workload written by
+benchmarks.workload holds conversations instead: their turns are sent one
+after the other with every reply added to the history of the next turn,
+concurrency is the number of conversations in flight and --requests the
+number of conversations (0 for all of them), the history lengths don't
+apply. With --open-loop each conversation starts at its arrival time, so
+bursts like the morning rush queue up as they would in production:
+
+    python -m benchmarks.workload --dates 2019-04-01 --speedup 120 --output workload.jsonl
+    python -m benchmarks.load --workload workload.jsonl --open-loop --requests 0 --concurrency 32
+
+With --baseline the p95
+latency of every cell is compared to the same cell of an earlier report and
+the script exits with status 1 if one is more than --max-regression slower.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("GEMINI_MODEL_NAME", "fake")
+os.environ.setdefault("EMBEDDING_MODEL_NAME", "fake-embedding")
+os.environ.setdefault("PINECONE_INDEX_NAME", "fake-index")
+os.environ["VECTOR_BACKEND"] = "pinecone"
+os.environ["CLIENT_WARMUP"] = "false"
+os.environ["SESSION_STORE"] = "none"
+os.environ["TRACING_ENABLED"] = "true"
+
+from agents import set_client_registry
+from benchmarks.fakes import FakeGenai, FakeEmbeddings, FakePineconeIndex, FakeClientRegistry, ScriptedResponder
+from benchmarks.workload import load_conversations
+
+UTTERANCES = [
+    "I would like one Latte please",
+    "Can I get two cappuccinos and a croissant?",
+    "What are your working hours?",
+    "Is the cappuccino lactose-free?",
+    "What's in the almond croissant?",
+    "What do you recommend with my latte?",
+    "What are your most popular pastries?",
+    "that's all",
+]
+PRIOR_ASSISTANT_TURN = {
+    "role": "assistant",
+    "content": "Great choice! I've added 1 x Latte to your order. Would you like anything else?",
+    "memory": {"agent": "order_taking_agent", "step number": "4",
+               "order": [{"item": "Latte", "quantity": 1, "price": 4.75}], "asked_recommendation_before": True}
+}
+ERROR_CONTENT = "encountered an error"
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(",") if item]
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+def summarize(values):
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "mean": round(statistics.mean(values), 3)
+    }
+
+def load_menu_documents():
+    documents = []
+    with open(os.path.join(API_DIR, '..', 'products', 'products.jsonl'), 'r') as file:
+        for line in file:
+            product = json.loads(line)
+            documents.append(f"{product['name']} ({product['category']}, ${product['price']}): {product['description']}")
+    return documents
+
+def build_controller(mode, args):
+    """AgentController for mode on a fresh set of fakes."""
+    genai = FakeGenai(latency=args.model_latency_ms / 1000, jitter=args.model_jitter_ms / 1000,
+                      latency_per_1k_chars=args.model_ms_per_1k_chars / 1000, responder=ScriptedResponder(), seed=args.seed)
+    embeddings = FakeEmbeddings(latency=args.embedding_latency_ms / 1000)
+    index = FakePineconeIndex(load_menu_documents(), embeddings, latency=args.pinecone_latency_ms / 1000)
+    set_client_registry(FakeClientRegistry(genai, embeddings, index))
+
+    # Imported after the environment is set, the controller reads it when it is built
+    from agent_controller import AgentController
+    return AgentController(execution_mode=mode, startup_mode="eager")
+
+def with_history(messages, history):
+    """Pad the conversation with earlier order turns up to history messages."""
+    pairs = max(0, (history - len(messages)) // 2)
+    return [{"role": "user", "content": "I would like one Latte please"}, PRIOR_ASSISTANT_TURN] * pairs + list(messages)
+
+def build_jobs(args, history):
+    if args.workload:
+        with open(args.workload, 'r') as file:
+            requests = [json.loads(line) for line in file if line.strip()]
+        requests = [request for request in requests if "input" in request]
+    else:
+        requests = [{"input": {"messages": [{"role": "user", "content": text}]}} for text in UTTERANCES]
+
+    jobs = []
+    for index in range(args.requests):
+        job_input = dict(requests[index % len(requests)]["input"])
+        if "messages" in job_input:
+            job_input["messages"] = with_history(job_input["messages"], history)
+        job_input["include_timings"] = True
+        jobs.append({"input": job_input})
+    return jobs
+
+def call(controller, entry, job):
+    if entry == "stream":
+        chunks = list(controller.stream_response(job))
+        return chunks[-1]
+    return controller.get_response(job)
+
+def run_cell(controller, entry, jobs, concurrency):
+    """Send the jobs with up to concurrency in flight, returns (wall seconds, [(latency ms, response)])."""
+    def timed(job):
+        start = time.perf_counter()
+        response = call(controller, entry, job)
+        return (time.perf_counter() - start) * 1000, response
+
+    async def atimed(job, semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await controller.aget_response(job)
+            return (time.perf_counter() - start) * 1000, response
+
+    async def arun():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(atimed(job, semaphore) for job in jobs))
+
+    start = time.perf_counter()
+    if entry == "async":
+        results = asyncio.run(arun())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed, jobs))
+    return time.perf_counter() - start, results
+
+def reply_message(response):
+    """The assistant message a client sends back with the next turn, without the timings."""
+    memory = {key: value for key, value in (response.get("memory") or {}).items() if key != "timings"}
+    return {"role": "assistant", "content": response.get("content", ""), "memory": memory}
+
+def turn_job(messages):
+    return {"input": {"messages": list(messages), "include_timings": True}}
+
+def play(controller, entry, conversation):
+    """Send the turns of a conversation in order, returns [(latency ms, response, intent)]."""
+    messages = []
+    results = []
+    for turn in conversation["turns"]:
+        messages.append({"role": "user", "content": turn["message"]})
+        start = time.perf_counter()
+        response = call(controller, entry, turn_job(messages))
+        results.append(((time.perf_counter() - start) * 1000, response, turn["intent"]))
+        messages.append(reply_message(response))
+    return results
+
+async def aplay(controller, conversation):
+    messages = []
+    results = []
+    for turn in conversation["turns"]:
+        messages.append({"role": "user", "content": turn["message"]})
+        start = time.perf_counter()
+        response = await controller.aget_response(turn_job(messages))
+        results.append(((time.perf_counter() - start) * 1000, response, turn["intent"]))
+        messages.append(reply_message(response))
+    return results
+
+def run_conversations(controller, entry, conversations, concurrency, open_loop=False):
+    """Replay the conversations with up to concurrency in flight.
+
+    With open_loop each one waits for its arrival_s before it takes a slot.
+    Returns (wall seconds, [(latency ms, response, intent)], [start lag ms]),
+    the lag is how long a conversation waited past its arrival for a slot.
+    """
+    origin = conversations[0].get("arrival_s", 0) if conversations else 0
+
+    def arrival(conversation):
+        return conversation.get("arrival_s", 0) - origin if open_loop else 0
+
+    def timed(conversation):
+        # The pool hands conversations out in arrival order, a free worker waits for the next one to arrive
+        delay = start + arrival(conversation) - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        lag = (time.perf_counter() - start - arrival(conversation)) * 1000
+        return play(controller, entry, conversation), lag
+
+    async def atimed(conversation, semaphore):
+        delay = start + arrival(conversation) - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with semaphore:
+            lag = (time.perf_counter() - start - arrival(conversation)) * 1000
+            return await aplay(controller, conversation), lag
+
+    async def arun():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(atimed(conversation, semaphore) for conversation in conversations))
+
+    start = time.perf_counter()
+    if entry == "async":
+        played = asyncio.run(arun())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            played = list(executor.map(timed, conversations))
+    wall = time.perf_counter() - start
+    return wall, [result for results, _ in played for result in results], [lag for _, lag in played]
+
+def collect_stages(span, stages):
+    for child in span.get("children", []):
+        stages[child["name"]].append(child["duration_ms"])
+        collect_stages(child, stages)
+
+def is_error(response):
+    memory = response.get("memory") or {}
+    return "error" in memory or ERROR_CONTENT in (response.get("content") or "")
+
+def summarize_results(results, wall):
+    """Request count, errors, throughput and latency of the (latency ms, response) pairs."""
+    latencies = [latency for latency, _ in results]
+    stages = defaultdict(list)
+    for _, response in results:
+        timings = (response.get("memory") or {}).get("timings")
+        if timings:
+            stages["request"].append(timings["duration_ms"])
+            collect_stages(timings, stages)
+    return {
+        "requests": len(results),
+        "errors": sum(is_error(response) for _, response in results),
+        "throughput_rps": round(len(results) / wall, 2),
+        "latency_ms": summarize(latencies),
+        "stages_ms": {name: {"count": len(values), **summarize(values)} for name, values in sorted(stages.items())}
+    }
+
+def measure(controller, mode, entry, concurrency, history, args):
+    run_cell(controller, entry, build_jobs(args, history)[:args.warmup], concurrency)
+    wall, results = run_cell(controller, entry, build_jobs(args, history), concurrency)
+    return {"mode": mode, "entry": entry, "concurrency": concurrency, "history": history, **summarize_results(results, wall)}
+
+def measure_conversations(controller, mode, entry, concurrency, conversations, args):
+    run_conversations(controller, entry, conversations[:args.warmup], concurrency)
+    wall, results, lags = run_conversations(controller, entry, conversations, concurrency, args.open_loop)
+
+    by_intent = defaultdict(list)
+    for latency, _, intent in results:
+        by_intent[intent].append(latency)
+    cell = {
+        "mode": mode,
+        "entry": entry,
+        "concurrency": concurrency,
+        "history": None,
+        "conversations": len(conversations),
+        **summarize_results([(latency, response) for latency, response, _ in results], wall),
+        "latency_by_intent_ms": {intent: {"count": len(values), **summarize(values)} for intent, values in sorted(by_intent.items())}
+    }
+    if args.open_loop:
+        cell["start_lag_ms"] = summarize(lags)
+    return cell
+
+def cell_key(cell):
+    return (cell["mode"], cell["entry"], cell["concurrency"], cell["history"])
+
+def compare(report, baseline, max_regression):
+    """Cells whose p95 latency is more than max_regression slower than in the baseline."""
+    baseline_cells = {cell_key(cell): cell for cell in baseline.get("results", [])}
+    regressions = []
+    for cell in report["results"]:
+        previous = baseline_cells.get(cell_key(cell))
+        if previous is None:
+            continue
+        before = previous["latency_ms"]["p95"]
+        after = cell["latency_ms"]["p95"]
+        if after > before * (1 + max_regression):
+            regressions.append({"cell": dict(zip(("mode", "entry", "concurrency", "history"), cell_key(cell))),
+                                "baseline_p95_ms": before, "p95_ms": after})
+    return regressions
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="sequential,speculative,gatekeeper", help="Comma-separated execution modes")
+    parser.add_argument("--entries", default="sync,async,stream", help="Comma-separated entry points: sync, async, stream")
+    parser.add_argument("--concurrency", default="1,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--history", default="1,9", help="Comma-separated history lengths in messages")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per cell")
+    parser.add_argument("--warmup", type=int, default=8, help="Unmeasured requests before each cell")
+    parser.add_argument("--workload", help="JSONL file of requests or conversations to replay instead of the built-in utterances")
+    parser.add_argument("--open-loop", action="store_true", help="Start each conversation at its arrival time")
+    parser.add_argument("--model-latency-ms", type=float, default=10.0)
+    parser.add_argument("--model-jitter-ms", type=float, default=5.0)
+    parser.add_argument("--model-ms-per-1k-chars", type=float, default=1.0, help="Extra model latency per 1000 prompt characters")
+    parser.add_argument("--embedding-latency-ms", type=float, default=5.0)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=5.0)
+    parser.add_argument("--caches", action="store_true", help="Keep the decision, embedding and answer caches on")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--baseline", help="Earlier JSON report to compare the p95 latencies against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed p95 slowdown against the baseline, 0.2 is 20%%")
+    parser.add_argument("--output", help="Optional path for the JSON report")
+    args = parser.parse_args()
+
+    if not args.caches:
+        for name in ("DECISION_CACHE_SIZE", "EMBEDDING_CACHE_SIZE", "ANSWER_CACHE_SIZE"):
+            os.environ[name] = "0"
+    logging.disable(logging.CRITICAL)
+
+    report = {
+        "meta": {
+            "commit": get_commit(),
+            "python": platform.python_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": vars(args)
+        },
+        "results": []
+    }
+    conversations = []
+    if args.workload:
+        conversations = [conversation for conversation in load_conversations(args.workload) if "turns" in conversation]
+        if args.requests:
+            conversations = conversations[:args.requests]
+    for mode in parse_list(args.modes):
+        controller = build_controller(mode, args)
+        for entry in parse_list(args.entries):
+            for concurrency in parse_list(args.concurrency, int):
+                for history in ([None] if conversations else parse_list(args.history, int)):
+                    if conversations:
+                        cell = measure_conversations(controller, mode, entry, concurrency, conversations, args)
+                    else:
+                        cell = measure(controller, mode, entry, concurrency, history, args)
+                    report["results"].append(cell)
+                    print(f"{mode:<12} {entry:<6} c={concurrency:<3} h={'-' if history is None else history:<3} "
+                          f"{cell['throughput_rps']:>8} rps  p50 {cell['latency_ms']['p50']:>8} ms  "
+                          f"p95 {cell['latency_ms']['p95']:>8} ms  p99 {cell['latency_ms']['p99']:>8} ms  "
+                          f"errors {cell['errors']}", file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            regressions = compare(report, json.load(file), args.max_regression)
+        report["regressions"] = regressions
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if regressions:
+        for regression in regressions:
+            print(f"p95 regression in {regression['cell']}: {regression['baseline_p95_ms']} ms -> "
+                  f"{regression['p95_ms']} ms", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
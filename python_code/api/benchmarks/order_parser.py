@@ -0,0 +1,104 @@
+"""Accuracy check of the menu order parser that lets OrderTakingAgent skip Gemini.
+
+Every case is an order turn and the order the parser must return for it, or
+None when the turn has to go to the LLM: edits, questions, ambiguous names
+and numbers the parser can't attach to an item. A wrong order is worse than
+a miss, it is committed without the LLM ever seeing the turn, so any
+mismatch fails the check. The hit rate is the share of turns answered
+locally. Run from the api folder:
+
+    python -m benchmarks.order_parser
+
+The script exits with status 1 if a case is parsed differently than expected.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from agents import MenuOrderParser
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ("I would like one Latte please", {"Latte": 1}),
+    ("two lattes and a croissant", {"Latte": 2, "Croissant": 1}),
+    ("Can I get two cappuccinos and a croissant?", {"Cappuccino": 2, "Croissant": 1}),
+    ("2x latte", {"Latte": 2}),
+    ("x3 cappuccino", {"Cappuccino": 3}),
+    ("a couple of lattes", {"Latte": 2}),
+    ("a dozen almond croissants", {"Almond Croissant": 12}),
+    ("can I get a large latte?", {"Latte": 1}),
+    ("latte lg", {"Latte": 1}),
+    ("3 lattes and 2 croissants", {"Latte": 3, "Croissant": 2}),
+    ("a latte and another latte", {"Latte": 2}),
+    ("one capuccino", {"Cappuccino": 1}),
+    ("an espresso shot and a hot chocolate", {"Espresso shot": 1, "Dark chocolate": 1}),
+    ("I'll take a vanilla syrup too", {"Sugar Free Vanilla syrup": 1}),
+    ("a latte and a caramel syrup", {"Latte": 1, "Carmel syrup": 1}),
+    ("twelve lattes", {"Latte": 12}),
+    # A number after the last item has no item to count
+    ("latte x2", None),
+    ("latte 2", None),
+    ("latte, 2 please", None),
+    ("3 lattes and 2", None),
+    ("latte lg x 2", None),
+    # Zero or implausibly large quantities
+    ("i would like 0 lattes", None),
+    ("100 lattes please", None),
+    ("13 croissants", None),
+    # Flavoured drinks are one item, not a drink plus a syrup
+    ("a vanilla latte", None),
+    ("a caramel cappuccino please", None),
+    ("two sugar free vanilla lattes", None),
+    ("a carmel latte", None),
+    # Two numbers in a row
+    ("2 2 lattes", None),
+    ("two 3 lattes", None),
+    # Edits, questions and ambiguous names
+    ("no latte, make it a cappuccino", None),
+    ("remove the croissant", None),
+    ("what is in the latte?", None),
+    ("a dark chocolate please", None),
+    ("a latte with oat milk", None),
+    ("I'd like a unicorn frappe", None),
+    ("that's all", None),
+]
+
+def as_quantities(items):
+    return None if items is None else {item["item"]: item["quantity"] for item in items}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--menu", default=os.path.join(API_DIR, '..', 'products', 'products.jsonl'))
+    parser.add_argument("--output", help="Optional path for the JSON report")
+    args = parser.parse_args()
+
+    order_parser = MenuOrderParser(args.menu)
+    mismatches = []
+    start = time.perf_counter()
+    parsed = [(text, expected, as_quantities(order_parser.parse(text))) for text, expected in CASES]
+    elapsed = time.perf_counter() - start
+    for text, expected, actual in parsed:
+        if actual != expected:
+            mismatches.append({"text": text, "expected": expected, "parsed": actual})
+
+    report = {
+        "cases": len(CASES),
+        "hit_rate": round(sum(actual is not None for _, _, actual in parsed) / len(CASES), 4),
+        "mean_us": round(elapsed / len(CASES) * 1e6, 2),
+        "mismatches": mismatches
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if mismatches:
+        for mismatch in mismatches:
+            print(f"{mismatch['text']!r}: expected {mismatch['expected']}, parsed {mismatch['parsed']}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Fault-injection check of the resilient Gemini call layer.
+
+Every scenario runs ModelClient against benchmarks.fakes.FakeGenai, no
+Gemini request is made:
+
+- transient: failure_rate of the calls fail with ServiceUnavailable, the
+  success rate with a single attempt is compared to the one with jittered
+  retries, and GuardAgent must answer every failed check with the
+  unavailable message instead of letting the turn through.
+- slow_tail: slow_rate of the calls take slow_latency seconds, the p99 with
+  hedging off is compared to the one with hedging at --hedge-percentile.
+- deadline: a request deadline shorter than the model latency, the call must
+  give up close to the deadline instead of waiting for the model.
+- outage: every call fails, the circuit must open, the guard and the
+  gatekeeper must hold every turn with the unavailable message and the
+  classifier must route from its local fallback, then the model recovers
+  and the circuit must close again.
+
+Run from the api folder:
+
+    python -m benchmarks.resilience --min-success-rate 0.99 --max-hedged-p99-ms 100
+
+The script exits with status 1 if a budget is missed or a scenario check fails.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("GEMINI_MODEL_NAME", "fake")
+os.environ["JSON_LLM_REPAIR"] = "false"
+
+from agents import (GuardAgent,
+                    ClassificationAgent,
+                    GatekeeperAgent,
+                    IntentClassifier,
+                    ResilientCaller,
+                    CircuitBreaker,
+                    ModelUnavailableError,
+                    request_deadline,
+                    get_fallback_stats
+                    )
+from agents.client_registry import ModelClient
+from agents.resilience import UNAVAILABLE_MESSAGE
+from agents.utils import get_generation_config
+from agents.response_schemas import GuardOutput
+from benchmarks.fakes import FakeGenai
+
+UTTERANCES = [
+    "I would like one Latte please",
+    "What are your working hours?",
+    "What do you recommend with my latte?",
+    "Can I get two cappuccinos and a croissant?",
+]
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+def is_unavailable(response):
+    return response["memory"].get("guard_decision") == "not allowed" and response["content"] == UNAVAILABLE_MESSAGE
+
+def call_model(client):
+    """One guard-sized structured call, returns (ok, seconds)."""
+    start = time.perf_counter()
+    try:
+        client.generate_content("Is this about the coffee shop?", generation_config=get_generation_config(schema=GuardOutput))
+        ok = True
+    except ModelUnavailableError:
+        ok = False
+    return ok, time.perf_counter() - start
+
+def run_transient(args):
+    results = {}
+    for label, max_attempts in (("single_attempt", 1), ("retries", args.max_attempts)):
+        fake = FakeGenai(latency=0.002, failure_rate=args.failure_rate, seed=args.seed)
+        # A breaker that never opens, this scenario is about retries
+        caller = ResilientCaller(label, max_attempts=max_attempts, base_delay=0.002, max_delay=0.02,
+                                 breaker=CircuitBreaker(failure_threshold=args.calls + 1))
+        client = ModelClient(fake, "fake", caller)
+        successes = sum(call_model(client)[0] for _ in range(args.calls))
+        results[label] = {
+            "success_rate": round(successes / args.calls, 4),
+            "model_calls": fake.calls,
+            "retries": caller.retries
+        }
+
+    # Failures that outlast the retries must hold the turn, not let it through unchecked
+    fake = FakeGenai(latency=0.002, failure_rate=args.failure_rate, seed=args.seed)
+    guard_agent = GuardAgent()
+    guard_agent.client = ModelClient(fake, "fake", ResilientCaller("guard", max_attempts=1,
+                                                                   breaker=CircuitBreaker(failure_threshold=args.calls + 1)))
+    responses = [guard_agent.get_response([{"role": "user", "content": UTTERANCES[turn % len(UTTERANCES)]}])
+                 for turn in range(args.calls)]
+    results["guard_failures"] = fake.failures
+    results["guard_unavailable"] = sum(is_unavailable(response) for response in responses)
+    return results
+
+def run_slow_tail(args):
+    results = {}
+    for label, hedge_percentile in (("no_hedging", None), ("hedging", args.hedge_percentile)):
+        fake = FakeGenai(latency=0.01, jitter=0.005, slow_rate=args.slow_rate, slow_latency=args.slow_latency, seed=args.seed)
+        caller = ResilientCaller(label, max_attempts=1, hedge_percentile=hedge_percentile, hedge_min_samples=20)
+        client = ModelClient(fake, "fake", caller)
+        latencies = [call_model(client)[1] for _ in range(args.calls)]
+        results[label] = {
+            "p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "hedges": caller.hedges,
+            "extra_calls_rate": round((fake.calls - args.calls) / args.calls, 4)
+        }
+    return results
+
+def run_deadline(args):
+    fake = FakeGenai(latency=args.deadline_ms / 1000 * 4)
+    client = ModelClient(fake, "fake", ResilientCaller("deadline", max_attempts=3, base_delay=0.001))
+    with request_deadline(args.deadline_ms / 1000):
+        ok, seconds = call_model(client)
+    return {
+        "deadline_ms": args.deadline_ms,
+        "answered": ok,
+        "elapsed_ms": round(seconds * 1000, 2),
+        "model_calls": fake.calls
+    }
+
+def run_outage(args):
+    fake = FakeGenai(latency=0.005, failure_rate=1.0, seed=args.seed)
+    caller = ResilientCaller("outage", max_attempts=2, base_delay=0.001,
+                             breaker=CircuitBreaker(failure_threshold=5, recovery_seconds=0.2))
+    client = ModelClient(fake, "fake", caller)
+    intent_classifier = IntentClassifier.load(os.path.join(API_DIR, 'classifier_objects', 'intent_classifier.npz'))
+    agents = {
+        "guard": GuardAgent(),
+        # A threshold above 1 sends every turn to the model, so only the fallback routes locally
+        "classification": ClassificationAgent(intent_classifier=intent_classifier, confidence_threshold=1.1),
+        "gatekeeper": GatekeeperAgent(),
+    }
+    for agent in agents.values():
+        agent.client = client
+
+    fallbacks_before = dict(get_fallback_stats().stats())
+    failed_open = 0
+    latencies = []
+    for turn in range(args.calls):
+        messages = [{"role": "user", "content": UTTERANCES[turn % len(UTTERANCES)]}]
+        for name, agent in agents.items():
+            start = time.perf_counter()
+            response = agent.get_response(messages)
+            latencies.append(time.perf_counter() - start)
+            failed_open += name != "classification" and not is_unavailable(response)
+    fallbacks = {name: count - fallbacks_before.get(name, 0) for name, count in get_fallback_stats().stats().items()}
+    circuit = caller.breaker.stats()
+
+    # The model is back, after recovery_seconds the probe closes the circuit
+    fake.failure_rate = 0.0
+    time.sleep(caller.breaker.recovery_seconds)
+    recovered, _ = call_model(client)
+    return {
+        "turns": args.calls * len(agents),
+        "model_calls": fake.calls - 1,
+        "failed_open": failed_open,
+        "fallbacks": fallbacks,
+        "p50_turn_ms": round(statistics.median(latencies) * 1000, 3),
+        "circuit": circuit,
+        "recovered": recovered,
+        "state_after_recovery": caller.breaker.state
+    }
+
+def check(report, args):
+    """Failed checks as messages, empty when every budget is met."""
+    problems = []
+    transient = report["transient"]
+    if args.min_success_rate is not None and transient["retries"]["success_rate"] < args.min_success_rate:
+        problems.append(f"success rate with retries {transient['retries']['success_rate']} is below {args.min_success_rate}")
+    if transient["guard_unavailable"] != transient["guard_failures"]:
+        problems.append(f"{transient['guard_failures']} guard calls failed but {transient['guard_unavailable']} "
+                        f"turns were held with the unavailable message")
+    slow_tail = report["slow_tail"]
+    if args.max_hedged_p99_ms is not None and slow_tail["hedging"]["p99_ms"] > args.max_hedged_p99_ms:
+        problems.append(f"p99 with hedging {slow_tail['hedging']['p99_ms']} ms is above {args.max_hedged_p99_ms} ms")
+    deadline = report["deadline"]
+    if deadline["answered"] or deadline["elapsed_ms"] > deadline["deadline_ms"] * 1.5:
+        problems.append(f"a call with a {deadline['deadline_ms']} ms deadline took {deadline['elapsed_ms']} ms")
+    outage = report["outage"]
+    if outage["failed_open"]:
+        problems.append(f"{outage['failed_open']} turns got past the guard or the gatekeeper during the outage")
+    if outage["circuit"]["times_opened"] < 1 or outage["model_calls"] >= outage["turns"]:
+        problems.append("the circuit did not open during the outage")
+    if not outage["recovered"] or outage["state_after_recovery"] != "closed":
+        problems.append("the circuit did not close after the model recovered")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400, help="Calls per scenario and variant")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--failure-rate", type=float, default=0.2, help="Transient failure rate of the fake model")
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="Share of calls in the slow tail")
+    parser.add_argument("--slow-latency", type=float, default=0.3, help="Seconds a slow call takes")
+    parser.add_argument("--hedge-percentile", type=float, default=90)
+    parser.add_argument("--deadline-ms", type=float, default=50)
+    parser.add_argument("--min-success-rate", type=float, default=None, help="Fail when the success rate with retries is lower")
+    parser.add_argument("--max-hedged-p99-ms", type=float, default=None, help="Fail when the p99 with hedging is higher")
+    parser.add_argument("--output", help="Optional path for the JSON report")
+    args = parser.parse_args()
+
+    # Every injected failure is logged by the call layer and the agents, the report counts them
+    logging.disable(logging.CRITICAL)
+
+    report = {
+        "transient": run_transient(args),
+        "slow_tail": run_slow_tail(args),
+        "deadline": run_deadline(args),
+        "outage": run_outage(args)
+    }
+    problems = check(report, args)
+    report["problems"] = problems
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if problems:
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
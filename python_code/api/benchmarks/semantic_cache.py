@@ -0,0 +1,145 @@
+"""Correctness and lookup cost of the DetailsAgent semantic answer cache.
+
+Question embeddings are placed at chosen cosine distances from each other,
+so every check is about the cache rules and not about a particular embedding
+model:
+
+- paraphrase: a rewording of a cached question, closer than max_distance,
+  must reuse its answer.
+- neighbour: "what's in a cappuccino" right next to the cached latte
+  question, with the same retrieved documents, must not get the latte answer.
+- distance: a question just past max_distance must miss.
+- ttl: an answer older than ttl_seconds must not be served, a fresh answer
+  stored for the same question must be.
+- version: a knowledge base version change must drop every answer, and
+  PineconeVectorIndex must report a new version once the namespace's vector
+  count changes (against benchmarks.fakes.FakePineconeIndex).
+
+Run from the api folder:
+
+    python -m benchmarks.semantic_cache
+
+The script exits with status 1 if a check fails.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from agents import SemanticAnswerCache, set_client_registry
+from agents.vector_index import PineconeVectorIndex
+from benchmarks.fakes import FakeGenai, FakeEmbeddings, FakePineconeIndex, FakeClientRegistry
+
+CONTEXT_IDS = ("3", "7")
+
+def load_menu_names():
+    with open(os.path.join(API_DIR, '..', 'products', 'products.jsonl'), 'r') as file:
+        return [json.loads(line)["name"] for line in file if line.strip()]
+
+def at_distance(base, distance, rng):
+    """Unit vector whose cosine distance to the unit vector base is distance."""
+    other = rng.standard_normal(base.shape[0])
+    other -= other @ base * base
+    other /= np.linalg.norm(other)
+    cosine = 1.0 - distance
+    return cosine * base + np.sqrt(1.0 - cosine ** 2) * other
+
+def build_cache(args, **kwargs):
+    return SemanticAnswerCache(max_size=args.size, max_distance=args.max_distance, key_terms=load_menu_names(), **kwargs)
+
+def run_checks(args, rng):
+    base = rng.standard_normal(args.dimension)
+    base /= np.linalg.norm(base)
+    latte_answer = "A Latte is a double shot of espresso with steamed milk."
+    results = {}
+
+    cache = build_cache(args)
+    cache.store("What's in a latte?", base, CONTEXT_IDS, latte_answer)
+    paraphrase = at_distance(base, args.max_distance / 2, rng)
+    results["paraphrase_hit"] = cache.lookup("What is in the Latte", paraphrase, CONTEXT_IDS) == latte_answer
+    neighbour = at_distance(base, args.max_distance / 4, rng)
+    results["neighbour_served_latte"] = cache.lookup("What's in a cappuccino?", neighbour, CONTEXT_IDS) == latte_answer
+    far = at_distance(base, args.max_distance * 1.5, rng)
+    results["past_distance_hit"] = cache.lookup("What's in a latte?", far, CONTEXT_IDS) is not None
+
+    cache = build_cache(args, ttl_seconds=0.05)
+    cache.store("What's in a latte?", base, CONTEXT_IDS, "old answer")
+    time.sleep(0.1)
+    results["expired_served"] = cache.lookup("What's in a latte?", base, CONTEXT_IDS) is not None
+    cache.store("What's in a latte?", base, CONTEXT_IDS, latte_answer)
+    results["refreshed_hit"] = cache.lookup("What's in a latte?", base, CONTEXT_IDS) == latte_answer
+
+    cache = build_cache(args)
+    cache.store("What's in a latte?", base, CONTEXT_IDS, latte_answer, knowledge_base_version="v1")
+    results["version_change_served"] = cache.lookup("What's in a latte?", base, CONTEXT_IDS, knowledge_base_version="v2") is not None
+
+    embeddings = FakeEmbeddings(dimension=8)
+    pinecone_index = FakePineconeIndex(["Latte: espresso and steamed milk"], embeddings)
+    set_client_registry(FakeClientRegistry(FakeGenai(), embeddings, pinecone_index))
+    vector_index = PineconeVectorIndex("fake-index", check_seconds=0.01)
+    before = vector_index.version
+    pinecone_index.documents.append("Cappuccino: espresso, steamed milk and foam")
+    time.sleep(0.02)
+    results["pinecone_version_follows_rebuild"] = vector_index.version != before
+    return results
+
+def measure_lookups(args, rng):
+    """Mean lookup time with a full cache, every question misses on the distance."""
+    cache = build_cache(args)
+    for index in range(args.size):
+        cache.store(f"question {index}", rng.standard_normal(args.dimension), CONTEXT_IDS, f"answer {index}")
+    queries = [rng.standard_normal(args.dimension) for _ in range(args.lookups)]
+    start = time.perf_counter()
+    for query in queries:
+        cache.lookup("What's in a latte?", query, CONTEXT_IDS)
+    return round((time.perf_counter() - start) / args.lookups * 1e6, 2)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-distance", type=float, default=float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.02")))
+    parser.add_argument("--size", type=int, default=512, help="Cache entries")
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Optional path for the JSON report")
+    args = parser.parse_args()
+
+    # Failed stats reads are logged by the index, the report shows the outcome
+    logging.disable(logging.CRITICAL)
+    rng = np.random.default_rng(args.seed)
+
+    checks = run_checks(args, rng)
+    expected = {
+        "paraphrase_hit": True,
+        "neighbour_served_latte": False,
+        "past_distance_hit": False,
+        "expired_served": False,
+        "refreshed_hit": True,
+        "version_change_served": False,
+        "pinecone_version_follows_rebuild": True,
+    }
+    problems = [f"{name} is {checks[name]}, expected {value}" for name, value in expected.items() if checks[name] != value]
+    report = {
+        "max_distance": args.max_distance,
+        "checks": checks,
+        "mean_lookup_us": measure_lookups(args, rng),
+        "problems": problems
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if problems:
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Parse failure check for the schema-constrained JSON agents.
+
+GuardAgent, ClassificationAgent, GatekeeperAgent, OrderTakingAgent and the
+recommendation classification run against a stub model twice. In free-text
+mode (RESPONSE_SCHEMA_ENABLED=false) the stub answers the way Gemini does
+without a schema: usually valid JSON with a chain of thought, sometimes
+fenced, cut off, with an off-schema value or a missing field, or prose with
+no JSON at all. In schema mode it answers like constrained decoding, with a
+reply generated from the response_schema it was sent. A turn fails when the
+agent falls back to its error response. The LLM repair is turned off so
+only local parsing and validation count. Output characters stand in for
+output tokens. No Gemini request is made. Run from the api folder:
+
+    python -m benchmarks.structured_output --max-failures 0
+
+The script exits with status 1 if schema mode has more than --max-failures
+failed turns.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("GEMINI_MODEL_NAME", "stub")
+os.environ["JSON_LLM_REPAIR"] = "false"
+
+from agents import (GuardAgent,
+                    ClassificationAgent,
+                    GatekeeperAgent,
+                    OrderTakingAgent,
+                    RecommendationAgent
+                    )
+
+ERROR_CONTENT = "encountered an error"
+UTTERANCES = [
+    "I would like one Latte please",
+    "Can I get two cappuccinos and a croissant?",
+    "What are your working hours?",
+    "What do you recommend with my latte?",
+    "What are your most popular pastries?",
+]
+STRING_VALUES = {
+    "item": "Latte",
+    "step number": "4",
+    "chain of thought": "The user wants to add a drink to the order, so the next step is to confirm it.",
+    "response": "Great choice! Would you like anything else?",
+    "message": "",
+}
+FREE_TEXT_REPLIES = {
+    "guard": {"chain of thought": STRING_VALUES["chain of thought"], "decision": "allowed", "message": ""},
+    "classification": {"chain of thought": STRING_VALUES["chain of thought"], "decision": "order_taking_agent", "message": ""},
+    "gatekeeper": {"guard_decision": "allowed", "classification_decision": "order_taking_agent", "message": ""},
+    "order": {"chain of thought": STRING_VALUES["chain of thought"], "step number": "4",
+              "order": [{"item": "Latte", "quantity": 1, "price": 4.75}], "response": STRING_VALUES["response"]},
+    "recommendation": {"chain of thought": STRING_VALUES["chain of thought"], "recommendation_type": "popular", "parameters": []},
+}
+OFF_SCHEMA_VALUES = {"decision": "Allowed", "guard_decision": "Allowed", "recommendation_type": "popular_by_category"}
+
+class StubResponse():
+    def __init__(self, text):
+        self.text = text
+
+class StubModel():
+    """Answers from the response_schema when one is sent, otherwise with free-text JSON of varying quality."""
+    def __init__(self, kind, seed):
+        self.kind = kind
+        self.rng = random.Random(seed)
+        self.output_chars = 0
+        self.calls = 0
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        schema = (generation_config or {}).get("response_schema")
+        text = json.dumps(self._from_schema(schema)) if schema else self._free_text()
+        self.calls += 1
+        self.output_chars += len(text)
+        return StubResponse(text)
+
+    def _from_schema(self, schema, key=None):
+        if "enum" in schema:
+            return self.rng.choice(schema["enum"])
+        kind = schema.get("type")
+        if kind == "object":
+            return {name: self._from_schema(value, name) for name, value in schema["properties"].items()}
+        if kind == "array":
+            return [self._from_schema(schema["items"], key) for _ in range(self.rng.randint(1, 2))]
+        if kind == "integer":
+            return self.rng.randint(1, 3)
+        if kind == "number":
+            return round(self.rng.uniform(2, 6), 2)
+        if kind == "boolean":
+            return True
+        return STRING_VALUES.get(key, "Latte")
+
+    def _free_text(self):
+        reply = dict(FREE_TEXT_REPLIES[self.kind])
+        text = json.dumps(reply, indent=4)
+        roll = self.rng.random()
+        if roll < 0.55:
+            return text
+        if roll < 0.7:
+            return f"```json\n{text}\n```\nLet me know if you need anything else."
+        if roll < 0.8:
+            return text[:len(text) // 2]
+        if roll < 0.88:
+            for key, value in OFF_SCHEMA_VALUES.items():
+                if key in reply:
+                    reply[key] = value
+            reply.pop("response", None)
+            return json.dumps(reply, indent=4)
+        return "Sure! I can help you with that."
+
+def build_agents(seed):
+    recommendation_agent = RecommendationAgent(
+        os.path.join(API_DIR, 'recommendation_objects', 'apriori_recommendations.json'),
+        os.path.join(API_DIR, 'recommendation_objects', 'popularity_recommendation.csv'))
+    order_taking_agent = OrderTakingAgent(recommendation_agent)
+    # The upsell is plain text and not part of this check
+    recommendation_agent.get_recommendations_from_order = lambda messages, order: {"content": ""}
+    agents = {
+        "guard": GuardAgent(),
+        "classification": ClassificationAgent(),
+        "gatekeeper": GatekeeperAgent(),
+        "order": order_taking_agent,
+        "recommendation": recommendation_agent,
+    }
+    for index, (kind, agent) in enumerate(agents.items()):
+        agent.client = StubModel(kind, seed + index)
+    return agents
+
+def is_failed(kind, agent, messages):
+    if kind == "recommendation":
+        return agent.recommendation_classification(messages) is None
+    return ERROR_CONTENT in agent.get_response(messages)["content"]
+
+def run(schema_enabled, turns, seed):
+    os.environ["RESPONSE_SCHEMA_ENABLED"] = "true" if schema_enabled else "false"
+    agents = build_agents(seed)
+    results = {}
+    for kind, agent in agents.items():
+        failures = 0
+        for turn in range(turns):
+            messages = [{"role": "user", "content": UTTERANCES[turn % len(UTTERANCES)]}]
+            failures += is_failed(kind, agent, messages)
+        client = agent.client
+        results[kind] = {
+            "turns": turns,
+            "failures": failures,
+            "mean_output_chars": round(client.output_chars / client.calls, 1) if client.calls else 0.0
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200, help="Turns per agent and mode")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--max-failures", type=int, default=None, help="Fail when schema mode has more failed turns")
+    parser.add_argument("--output", help="Optional path for the JSON report")
+    args = parser.parse_args()
+
+    # Every failed turn is logged by the agents, the report counts them
+    logging.disable(logging.CRITICAL)
+
+    report = {
+        "free_text": run(False, args.turns, args.seed),
+        "schema": run(True, args.turns, args.seed),
+        "max_failures": args.max_failures
+    }
+    for mode in ("free_text", "schema"):
+        report[f"{mode}_failures"] = sum(result["failures"] for result in report[mode].values())
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.max_failures is not None and report["schema_failures"] > args.max_failures:
+        print(f"{report['schema_failures']} failed turns in schema mode, more than {args.max_failures}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
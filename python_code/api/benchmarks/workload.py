@@ -0,0 +1,190 @@
+"""Multi-turn conversation workload generated from the April 2019 sales receipts.
+
+Every receipt (the line items of one transaction) becomes a scripted
+conversation. The items are ordered over one or more turns, and some
+conversations also ask a question about an item or the shop, or ask for a
+recommendation, before they finish with "that's all". Conversations start at
+the receipt's time of day, compressed by --speedup. Sampling receipts at
+random keeps the real arrival distribution, including the morning rush, and
+the real basket sizes and product mix. Run from the api folder:
+
+    python -m benchmarks.workload --dates 2019-04-01 --speedup 60 --output workload.jsonl
+    python -m benchmarks.load --workload workload.jsonl --open-loop
+
+Each JSONL line is one conversation:
+
+    {"conversation_id": "2019-04-01/3/7", "arrival_s": 394.7, "time_of_day": "12:04:43",
+     "outlet": 3, "instore": false, "items": [{"product": "Traditional Blend Chai", "size": "regular", "quantity": 1}],
+     "turns": [{"intent": "order", "message": "Hi, can I get a regular Traditional Blend Chai?"},
+               {"intent": "finish", "message": "That's all, thanks"}]}
+
+A summary with the arrivals per hour is printed to stderr.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+from collections import Counter, defaultdict
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET_DIR = os.path.join(API_DIR, '..', 'dataset')
+
+SIZES = {"Sm": "small", "Rg": "regular", "Lg": "large"}
+NUMBER_WORDS = {1: "a", 2: "two", 3: "three", 4: "four", 5: "five", 6: "six"}
+FIRST_ORDER_TEMPLATES = ["Hi, can I get {items}?", "I'd like {items} please", "{items}, please",
+                         "Could I have {items}?", "I want to order {items}"]
+NEXT_ORDER_TEMPLATES = ["Can I also get {items}?", "And {items} please", "Add {items} to my order",
+                        "I'll also take {items}"]
+FINISH_TEMPLATES = ["That's all, thanks", "that's all", "No, that's it", "Nothing else, thank you"]
+ITEM_QUESTION_TEMPLATES = ["What's in the {name}?", "Is the {name} lactose-free?", "How much is the {name}?",
+                           "Tell me about the {name}"]
+SHOP_QUESTIONS = ["What are your working hours?", "Where is the coffee shop located?", "Do you deliver?"]
+RECOMMENDATION_TEMPLATES = ["What goes well with my {name}?", "What do you recommend with a {name}?",
+                            "What are your most popular {category} items?", "Can you recommend something sweet?"]
+
+def load_products(path):
+    """product_id -> (name, size, category) from product.csv, the size is taken off the name."""
+    products = {}
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            words = row["product"].strip().split()
+            if words and words[-1].lower() == "promo":
+                words = words[:-1]
+            size = None
+            if words and words[-1] in SIZES:
+                size = SIZES[words.pop()]
+            products[row["product_id"]] = (" ".join(words), size, row["product_category"])
+    return products
+
+def load_receipts(path, dates=None):
+    """Line items grouped per transaction, in file order."""
+    receipts = defaultdict(list)
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            if dates and row["transaction_date"] not in dates:
+                continue
+            receipts[(row["transaction_date"], row["sales_outlet_id"], row["transaction_id"])].append(row)
+    return receipts
+
+def seconds_of_day(time_of_day):
+    hours, minutes, seconds = (int(part) for part in time_of_day.split(":"))
+    return hours * 3600 + minutes * 60 + seconds
+
+def plural(name):
+    return name + "es" if name.endswith(("s", "sh", "ch")) else name + "s"
+
+def item_phrase(item):
+    name = f"{item['size']} {item['product']}" if item["size"] else item["product"]
+    if item["quantity"] == 1:
+        article = "an" if name[0].lower() in "aeiou" else "a"
+        return f"{article} {name}"
+    return f"{NUMBER_WORDS.get(item['quantity'], item['quantity'])} {plural(name)}"
+
+def join_phrases(phrases):
+    return phrases[0] if len(phrases) == 1 else ", ".join(phrases[:-1]) + " and " + phrases[-1]
+
+def build_turns(items, rng, detail_rate, recommendation_rate, max_items_per_turn):
+    """The scripted user turns of one conversation."""
+    order_turns = []
+    remaining = list(items)
+    while remaining:
+        count = rng.randint(1, max_items_per_turn)
+        chunk, remaining = remaining[:count], remaining[count:]
+        templates = NEXT_ORDER_TEMPLATES if order_turns else FIRST_ORDER_TEMPLATES
+        message = rng.choice(templates).format(items=join_phrases([item_phrase(item) for item in chunk]))
+        order_turns.append({"intent": "order", "message": message[0].upper() + message[1:]})
+
+    turns = list(order_turns)
+    if rng.random() < detail_rate:
+        item = rng.choice(items)
+        if rng.random() < 0.7:
+            message = rng.choice(ITEM_QUESTION_TEMPLATES).format(name=item["product"])
+        else:
+            message = rng.choice(SHOP_QUESTIONS)
+        # Questions come before the order or between its turns
+        turns.insert(rng.randint(0, len(turns) - 1), {"intent": "details", "message": message})
+    if rng.random() < recommendation_rate:
+        item = rng.choice(items)
+        message = rng.choice(RECOMMENDATION_TEMPLATES).format(name=item["product"], category=item["category"].lower())
+        # A recommendation is asked for once something has been ordered
+        first_order = next(index for index, turn in enumerate(turns) if turn["intent"] == "order")
+        turns.insert(rng.randint(first_order + 1, len(turns)), {"intent": "recommendation", "message": message})
+    turns.append({"intent": "finish", "message": rng.choice(FINISH_TEMPLATES)})
+    return turns
+
+def generate(receipts, products, args):
+    rng = random.Random(args.seed)
+    keys = sorted(receipts, key=lambda key: (receipts[key][0]["transaction_time"], key))
+    if args.conversations and args.conversations < len(keys):
+        keys = sorted(rng.sample(keys, args.conversations), key=lambda key: (receipts[key][0]["transaction_time"], key))
+    if not keys:
+        return []
+    opening = seconds_of_day(receipts[keys[0]][0]["transaction_time"])
+
+    conversations = []
+    for key in keys:
+        rows = receipts[key]
+        items = []
+        for row in sorted(rows, key=lambda row: int(row["line_item_id"])):
+            name, size, category = products.get(row["product_id"], (f"product {row['product_id']}", None, "Coffee"))
+            items.append({"product": name, "size": size, "quantity": max(1, int(float(row["quantity"]))), "category": category})
+        time_of_day = rows[0]["transaction_time"]
+        conversations.append({
+            "conversation_id": "/".join(key),
+            "arrival_s": round((seconds_of_day(time_of_day) - opening) / args.speedup, 3),
+            "time_of_day": time_of_day,
+            "outlet": int(rows[0]["sales_outlet_id"]),
+            "instore": rows[0]["instore_yn"] == "Y",
+            "items": [{key: value for key, value in item.items() if key != "category"} for item in items],
+            "turns": build_turns(items, rng, args.detail_rate, args.recommendation_rate, args.max_items_per_turn)
+        })
+    return conversations
+
+def load_conversations(path):
+    """Conversations of a workload file, ordered by arrival."""
+    with open(path, 'r') as file:
+        conversations = [json.loads(line) for line in file if line.strip()]
+    return sorted(conversations, key=lambda conversation: conversation.get("arrival_s", 0))
+
+def summarize(conversations):
+    turns = [turn for conversation in conversations for turn in conversation["turns"]]
+    per_hour = Counter(int(conversation["time_of_day"][:2]) for conversation in conversations)
+    return {
+        "conversations": len(conversations),
+        "turns": len(turns),
+        "turns_per_conversation": round(len(turns) / len(conversations), 2) if conversations else 0.0,
+        "intents": dict(Counter(turn["intent"] for turn in turns)),
+        "duration_s": conversations[-1]["arrival_s"] if conversations else 0.0,
+        "arrivals_per_hour": {f"{hour:02d}:00": count for hour, count in sorted(per_hour.items())}
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", default=os.path.join(DATASET_DIR, '201904 sales reciepts.csv'))
+    parser.add_argument("--products", default=os.path.join(DATASET_DIR, 'product.csv'))
+    parser.add_argument("--dates", help="Comma-separated transaction dates, all of April by default")
+    parser.add_argument("--conversations", type=int, default=0, help="Receipts sampled at random, 0 keeps them all")
+    parser.add_argument("--speedup", type=float, default=60.0, help="How much faster than real time the arrivals replay")
+    parser.add_argument("--detail-rate", type=float, default=0.3, help="Share of conversations that ask a question")
+    parser.add_argument("--recommendation-rate", type=float, default=0.25, help="Share of conversations that ask for a recommendation")
+    parser.add_argument("--max-items-per-turn", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="JSONL file to write, stdout by default")
+    args = parser.parse_args()
+
+    dates = set(args.dates.split(",")) if args.dates else None
+    conversations = generate(load_receipts(args.receipts, dates), load_products(args.products), args)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for conversation in conversations:
+            output.write(json.dumps(conversation) + "\n")
+    finally:
+        if args.output:
+            output.close()
+    print(json.dumps(summarize(conversations), indent=2), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
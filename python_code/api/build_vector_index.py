@@ -0,0 +1,68 @@
+"""Build the local vector index used by DetailsAgent when VECTOR_BACKEND=local.
+
+Embeds the same documents as build_vector_database.ipynb (every product, the
+about-us text and the menu text) and writes them to vector_objects/. Run from
+the api folder with GOOGLE_API_KEY and EMBEDDING_MODEL_NAME set. Embeddings go
+through the embedding cache, so with EMBEDDING_CACHE_PATH set a rebuild only
+embeds documents that changed:
+
+    python build_vector_index.py --int8
+"""
+import argparse
+import json
+import os
+import time
+from dotenv import load_dotenv
+from agents.vector_index import LocalVectorIndex
+from agents.utils import get_document_embeddings
+from agents.client_registry import get_client_registry
+
+load_dotenv()
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PRODUCTS_DIR = os.path.join(current_dir, '..', 'products')
+DEFAULT_OUTPUT_DIR = os.path.join(current_dir, 'vector_objects')
+
+def load_documents(products_dir):
+    """Return the knowledge base texts in the same format as the Pinecone index."""
+    texts = []
+    with open(os.path.join(products_dir, 'products.jsonl'), 'r') as file:
+        for line in file:
+            if line.strip():
+                product = json.loads(line)
+                texts.append(f"{product['name']} : {product['description']}"
+                             f" -- Ingredients: {product['ingredients']}"
+                             f" -- Price: {product['price']}"
+                             f" -- rating: {product['rating']}")
+
+    with open(os.path.join(products_dir, "Merry's_way_about_us.txt"), 'r') as file:
+        texts.append("Coffee shop Merry's Way about section: " + file.read())
+
+    with open(os.path.join(products_dir, 'menu_items_text.txt'), 'r') as file:
+        texts.append("Menu Items: " + file.read())
+
+    return texts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products-dir", default=DEFAULT_PRODUCTS_DIR, help="Folder with products.jsonl and the text files")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_DIR, help="Index directory to write")
+    parser.add_argument("--int8", action="store_true", help="Store int8-quantized embeddings with per-row scales")
+    args = parser.parse_args()
+
+    texts = load_documents(args.products_dir)
+    ids = [text.split(":")[0].strip() for text in texts]
+
+    embedding_model_name = os.getenv("EMBEDDING_MODEL_NAME")
+    embedding_client = get_client_registry().get_embedding_client(embedding_model_name)
+    embeddings = get_document_embeddings(embedding_client, texts)
+
+    LocalVectorIndex.build(args.output, ids, texts, embeddings, embedding_model_name, quantize=args.int8)
+
+    start = time.perf_counter()
+    index = LocalVectorIndex(args.output)
+    load_ms = (time.perf_counter() - start) * 1000
+    print(f"Wrote {len(texts)} documents of dimension {index.matrix.shape[1]} to {args.output} (loads in {load_ms:.1f} ms)")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,28 @@
+import os
 from agent_controller import AgentController
 import runpod
 
 def main():
     agent_controller = AgentController()
-    runpod.serverless.start({"handler": agent_controller.get_response})
+
+    # "sync" serves one conversation per worker, "async" lets one worker multiplex
+    # up to RUNPOD_MAX_CONCURRENCY conversations while they wait on Gemini and
+    # "stream" yields partial chunks as the reply is generated
+    handler_mode = os.getenv("RUNPOD_HANDLER_MODE", "sync")
+    if handler_mode == "stream":
+        runpod.serverless.start({
+            "handler": agent_controller.stream_response,
+            "return_aggregate_stream": True
+        })
+    elif handler_mode == "async":
+        max_concurrency = int(os.getenv("RUNPOD_MAX_CONCURRENCY", "32"))
+        runpod.serverless.start({
+            "handler": agent_controller.aget_response,
+            "concurrency_modifier": lambda current_concurrency: max_concurrency
+        })
+    else:
+        runpod.serverless.start({"handler": agent_controller.get_response})
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,80 @@
+"""Publish the recommendation artifacts to the versioned artifact store.
+
+Compiles apriori_recommendations.json and popularity_recommendation.csv (by
+default the ones in recommendation_objects/, e.g. fresh output of
+../train_recommendations.py) into the binary tables, writes them as a new
+version with a checksummed manifest and activates it. Workers started with
+RECOMMENDATION_STORE_PATH pointing at the same store pick the version up on
+their next check without a restart:
+
+    python publish_recommendations.py --store /runpod-volume/recommendations
+    python publish_recommendations.py --store /runpod-volume/recommendations --activate 20261018-020000
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from agents.artifact_store import ArtifactStore
+from agents.recommendation_tables import RecommendationTables
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_APRIORI_PATH = os.path.join(current_dir, 'recommendation_objects', 'apriori_recommendations.json')
+DEFAULT_POPULARITY_PATH = os.path.join(current_dir, 'recommendation_objects', 'popularity_recommendation.csv')
+
+def compile_tables(apriori_path, popularity_path):
+    """Compiled and validated tables, unlike the agent this fails on a missing or broken file."""
+    with open(apriori_path, 'r') as file:
+        apriori_recommendations = json.load(file)
+    with open(popularity_path, 'r', newline='') as file:
+        popularity_rows = list(csv.DictReader(file))
+
+    tables = RecommendationTables(popularity_rows, apriori_recommendations)
+    tables.validate()
+    return tables
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", default=os.getenv("RECOMMENDATION_STORE_PATH"), help="Artifact store directory")
+    parser.add_argument("--apriori", default=DEFAULT_APRIORI_PATH, help="Apriori recommendations JSON")
+    parser.add_argument("--popularity", default=DEFAULT_POPULARITY_PATH, help="Popularity recommendations CSV")
+    parser.add_argument("--version", help="Version name, defaults to the current time")
+    parser.add_argument("--no-activate", action="store_true", help="Write the version without making it active")
+    parser.add_argument("--activate", metavar="VERSION", help="Only make an existing version active, e.g. to roll back")
+    parser.add_argument("--list", action="store_true", help="List the versions in the store")
+    args = parser.parse_args()
+
+    if not args.store:
+        parser.error("--store or RECOMMENDATION_STORE_PATH is required")
+    store = ArtifactStore(args.store)
+
+    if args.list:
+        current = store.current_version()
+        for version in store.versions():
+            print(f"{'*' if version == current else ' '} {version}")
+        return
+
+    if args.activate:
+        store.verify(args.activate)
+        store.activate(args.activate)
+        print(f"Activated {args.activate}")
+        return
+
+    start = time.perf_counter()
+    os.makedirs(args.store, exist_ok=True)
+    tables = compile_tables(args.apriori, args.popularity)
+    version = store.publish(tables, version=args.version, activate=not args.no_activate)
+
+    # Read it back the way a worker would before reporting success
+    store.load_tables(version)
+    manifest = store.read_manifest(version)
+    print(json.dumps({
+        "version": version,
+        "active": store.current_version() == version,
+        "items": len(tables.item_names),
+        "bytes": sum(entry["bytes"] for entry in manifest["files"].values()),
+        "seconds": round(time.perf_counter() - start, 3)
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
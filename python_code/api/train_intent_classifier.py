@@ -0,0 +1,63 @@
+"""Train the local intent classifier used by ClassificationAgent.
+
+Run from the api folder:
+
+    python train_intent_classifier.py --threshold 0.8
+"""
+import argparse
+import json
+import os
+import time
+from agents.intent_classifier import IntentClassifier
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_PATH = os.path.join(current_dir, '..', 'dataset', 'intent_utterances.jsonl')
+DEFAULT_OUTPUT_PATH = os.path.join(current_dir, 'classifier_objects', 'intent_classifier.npz')
+
+def load_utterances(path):
+    texts, labels = [], []
+    with open(path, 'r') as file:
+        for line in file:
+            if line.strip():
+                row = json.loads(line)
+                texts.append(row["text"])
+                labels.append(row["label"])
+    return texts, labels
+
+def leave_one_out(texts, labels, threshold, temperature):
+    """Accuracy of the fast path and the share of utterances it would answer at the threshold."""
+    answered, correct = 0, 0
+    for i in range(len(texts)):
+        classifier = IntentClassifier.train(texts[:i] + texts[i + 1:], labels[:i] + labels[i + 1:], temperature)
+        label, confidence = classifier.predict(texts[i])
+        if confidence >= threshold:
+            answered += 1
+            correct += label == labels[i]
+    return {
+        "fast_path_rate": round(answered / len(texts), 3),
+        "fast_path_accuracy": round(correct / answered, 3) if answered else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH, help="JSONL file of {\"text\", \"label\"} rows")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="Where to write the .npz artifact")
+    parser.add_argument("--temperature", type=float, default=0.05, help="Softmax temperature for the confidence")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Confidence threshold to evaluate")
+    args = parser.parse_args()
+
+    texts, labels = load_utterances(args.data)
+    print(f"Loaded {len(texts)} utterances, labels: {sorted(set(labels))}")
+
+    print(f"Leave-one-out at threshold {args.threshold}: {leave_one_out(texts, labels, args.threshold, args.temperature)}")
+
+    classifier = IntentClassifier.train(texts, labels, args.temperature)
+    classifier.save(args.output)
+
+    start = time.perf_counter()
+    IntentClassifier.load(args.output)
+    load_ms = (time.perf_counter() - start) * 1000
+    print(f"Saved {args.output} ({len(classifier.vocabulary)} terms, {os.path.getsize(args.output)} bytes, loads in {load_ms:.1f} ms)")
+
+if __name__ == "__main__":
+    main()
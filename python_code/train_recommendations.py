@@ -0,0 +1,421 @@
+"""Train the recommendation artifacts from sales receipt CSVs without loading them into memory.
+
+Streaming version of recommendation_engine_training.ipynb. Receipts are read in
+chunks with the csv module, every basket becomes an item bitset, and identical
+baskets share one counter, so support counting is a vectorized pass over the
+distinct basket patterns instead of a dense transaction x product matrix.
+Writes the same three artifacts as the notebook:
+
+    api/recommendation_objects/popularity_recommendation.csv
+    api/recommendation_objects/apriori_recommendations.json
+    rules_basket.pkl
+
+Run from the python_code folder, one or more receipt files sorted by date:
+
+    python train_recommendations.py "dataset/201904 sales reciepts.csv"
+
+By default baskets are keyed like the notebook, on transaction_id and
+customer_id only, so the command above writes the same recommendations and
+counts as the files shipped in api/recommendation_objects. Transaction IDs restart every day, so
+over more than a few days that merges unrelated receipts and every basket
+has to stay open until the end. --basket-key receipt adds the date and the
+outlet and closes baskets whenever the date changes, which keeps memory
+bounded by one day of receipts. It also changes the artifacts: fewer lines
+fall into multi-line baskets, so the popularity counts drop (Almond Croissant
+goes from 347 to 118 on the April receipts) and the apriori lists differ.
+Write those to another folder with --output-dir unless the change is meant.
+
+For a nightly refresh, keep the support counters in a state file and pass
+only the new receipt files. Each file is folded into persistent item, pair
+and triple counts, optionally decayed by the days since the last update, and
+the artifacts are derived from the counters, so the cost follows the new
+data and not the length of the history. State files always use the receipt
+key:
+
+    python train_recommendations.py "dataset/20190405 receipts.csv" --state recommendation_state.npz --half-life-days 28
+
+The state file records the SHA-256 of every absorbed file. A file that was
+already absorbed, under any name, is skipped, so rerunning a nightly job
+doesn't count its receipts twice. Pass --force to absorb it again anyway.
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+from datetime import date
+import json
+import os
+import resource
+import time
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RECEIPTS = [os.path.join(current_dir, 'dataset', '201904 sales reciepts.csv')]
+DEFAULT_PRODUCTS = os.path.join(current_dir, 'dataset', 'product.csv')
+DEFAULT_OBJECTS_DIR = os.path.join(current_dir, 'api', 'recommendation_objects')
+DEFAULT_RULES_PATH = os.path.join(current_dir, 'rules_basket.pkl')
+
+PRODUCTS_TO_TAKE = ['Cappuccino', 'Latte', 'Espresso shot',
+                    'Dark chocolate', 'Sugar Free Vanilla syrup', 'Chocolate syrup',
+                    'Carmel syrup', 'Hazelnut syrup', 'Ginger Scone',
+                    'Chocolate Croissant', 'Jumbo Savory Scone', 'Cranberry Scone', 'Hazelnut Biscotti',
+                    'Croissant', 'Almond Croissant', 'Oatmeal Scone', 'Chocolate Chip Biscotti',
+                    'Ginger Biscotti']
+
+SIZE_SUFFIXES = (' Rg', ' Sm', ' Lg')
+
+def load_products(products_path):
+    """Map product_id to its (product, category) variant index and list the variants.
+
+    Sizes are folded into one product, but a product sold in two categories
+    (drinking and packaged dark chocolate) keeps one variant per category.
+    """
+    product_variants = {}
+    with open(products_path, 'r', newline='') as file:
+        for row in csv.DictReader(file):
+            name = row['product']
+            for suffix in SIZE_SUFFIXES:
+                name = name.replace(suffix, '')
+            if name in PRODUCTS_TO_TAKE:
+                product_variants[row['product_id']] = (name, row['product_category'])
+    variants = sorted(set(product_variants.values()))
+    products = {product_id: variants.index(variant) for product_id, variant in product_variants.items()}
+    return products, variants
+
+class BasketCounter():
+    """Collects receipt lines into baskets and counts the closed baskets by item bitset.
+
+    Like the notebook, only baskets with more than one line are kept and
+    popularity counts lines, not baskets.
+    """
+    def __init__(self, variants):
+        self.variant_bits = [1 << PRODUCTS_TO_TAKE.index(name) for name, _ in variants]
+        self.open_baskets = {}
+        self.pattern_counts = {}
+        self.variant_lines = np.zeros(len(variants), dtype=np.int64)
+        self.peak_open_baskets = 0
+        self.last_date = None
+
+    def add(self, key, variant):
+        basket = self.open_baskets.get(key)
+        if basket is None:
+            basket = self.open_baskets[key] = []
+        basket.append(variant)
+
+    def close_all(self):
+        self.peak_open_baskets = max(self.peak_open_baskets, len(self.open_baskets))
+        for basket in self.open_baskets.values():
+            if len(basket) > 1:
+                mask = 0
+                for variant in basket:
+                    mask |= self.variant_bits[variant]
+                    self.variant_lines[variant] += 1
+                self.pattern_counts[mask] = self.pattern_counts.get(mask, 0) + 1
+        self.open_baskets.clear()
+
+def stream_receipts(receipt_paths, products, counter, basket_key, chunk_rows):
+    """Feed every receipt line into the counter, returns the number of rows read."""
+    rows = 0
+    for path in receipt_paths:
+        with open(path, 'r', newline='') as file:
+            reader = csv.DictReader(file)
+            current_date = None
+            while True:
+                chunk = list(itertools.islice(reader, chunk_rows))
+                if not chunk:
+                    break
+                rows += len(chunk)
+                for row in chunk:
+                    variant = products.get(row['product_id'])
+                    if variant is None:
+                        continue
+                    if row['transaction_date'] != current_date:
+                        if basket_key == 'receipt':
+                            counter.close_all()
+                        current_date = row['transaction_date']
+                        counter.last_date = max(counter.last_date or current_date, current_date)
+                    if basket_key == 'receipt':
+                        key = (row['transaction_date'], row['sales_outlet_id'], row['transaction_id'], row['customer_id'])
+                    else:
+                        key = f"{row['transaction_id']}_{row['customer_id']}"
+                    counter.add(key, variant)
+        if basket_key == 'receipt':
+            counter.close_all()
+    counter.close_all()
+    return rows
+
+def frequent_itemsets(pattern_counts, n_items, min_support):
+    """Level-wise apriori over basket bitsets, returns {itemset mask: support}."""
+    patterns = np.array(list(pattern_counts.keys()), dtype=np.int64)
+    weights = np.array(list(pattern_counts.values()), dtype=np.int64)
+    total = weights.sum()
+
+    def support(candidates):
+        candidates = np.array(candidates, dtype=np.int64)[:, None]
+        contained = (patterns[None, :] & candidates) == candidates
+        return contained.astype(np.int64) @ weights / total
+
+    frequent = {}
+    level = [1 << i for i in range(n_items)]
+    size = 1
+    while level:
+        supports = support(level)
+        current = {mask: float(value) for mask, value in zip(level, supports) if value >= min_support}
+        frequent.update(current)
+
+        # Join frequent sets that differ by one item and keep candidates whose subsets are all frequent
+        size += 1
+        masks = sorted(current)
+        candidates = set()
+        for a, b in itertools.combinations(masks, 2):
+            union = a | b
+            if bin(union).count('1') == size and all(union & ~(1 << i) in current
+                                                     for i in range(n_items) if union >> i & 1):
+                candidates.add(union)
+        level = sorted(candidates)
+    return frequent
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class SupportCounters():
+    """Persistent item, pair and triple counts of closed baskets.
+
+    Counts are floats so that older baskets can be decayed, every absorbed
+    receipt file first scales the existing counts by 0.5 ** (days / half life)
+    when a half life is set. Itemsets of up to three products are derived
+    from the counters, the cost depends on the number of products only.
+    absorbed lists the path and SHA-256 of every receipt file in the counts.
+    """
+    def __init__(self, variants):
+        n_items = len(PRODUCTS_TO_TAKE)
+        self.variants = [tuple(variant) for variant in variants]
+        self.baskets = 0.0
+        self.items = np.zeros(n_items)
+        self.pairs = np.zeros((n_items, n_items))
+        self.triples = np.zeros((n_items, n_items, n_items))
+        self.variant_lines = np.zeros(len(variants))
+        self.last_date = None
+        self.absorbed = []
+
+    @classmethod
+    def load(cls, path, variants):
+        data = np.load(path)
+        if [tuple(variant) for variant in json.loads(str(data["variants"]))] != [tuple(variant) for variant in variants]:
+            raise ValueError(f"{path} was built for a different product list, retrain from the full history")
+        counters = cls(variants)
+        counters.baskets = float(data["baskets"])
+        counters.items = data["items"]
+        counters.pairs = data["pairs"]
+        counters.triples = data["triples"]
+        counters.variant_lines = data["variant_lines"]
+        counters.last_date = str(data["last_date"]) or None
+        # State files written before the absorbed files were recorded have no list
+        counters.absorbed = json.loads(str(data["absorbed"])) if "absorbed" in data.files else []
+        return counters
+
+    def save(self, path):
+        """Write to a temporary file and swap it in, a crash mid-write leaves the old state intact."""
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as file:
+            np.savez(file, variants=json.dumps(self.variants), baskets=self.baskets, items=self.items,
+                     pairs=self.pairs, triples=self.triples, variant_lines=self.variant_lines,
+                     last_date=self.last_date or "", absorbed=json.dumps(self.absorbed))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+
+    def is_absorbed(self, sha256):
+        return any(source["sha256"] == sha256 for source in self.absorbed)
+
+    def absorb(self, counter, half_life_days=None, source=None):
+        """Add the closed baskets of one receipt file, decaying the existing counts first.
+
+        source, a {"path", "sha256"} dict, is recorded in absorbed.
+        """
+        if half_life_days and self.last_date and counter.last_date and counter.last_date > self.last_date:
+            days = (date.fromisoformat(counter.last_date) - date.fromisoformat(self.last_date)).days
+            factor = 0.5 ** (days / half_life_days)
+            self.baskets *= factor
+            for counts in (self.items, self.pairs, self.triples, self.variant_lines):
+                counts *= factor
+
+        for mask, count in counter.pattern_counts.items():
+            index = [i for i in range(len(PRODUCTS_TO_TAKE)) if mask >> i & 1]
+            self.items[index] += count
+            self.pairs[np.ix_(index, index)] += count
+            self.triples[np.ix_(index, index, index)] += count
+        self.baskets += sum(counter.pattern_counts.values())
+        self.variant_lines += counter.variant_lines
+        if counter.last_date:
+            self.last_date = max(self.last_date or counter.last_date, counter.last_date)
+        if source is not None:
+            self.absorbed.append(source)
+
+    def frequent_itemsets(self, min_support):
+        """{itemset mask: support} for the frequent itemsets of one to three products."""
+        frequent = {}
+        if not self.baskets:
+            return frequent
+        for size, counts in ((1, self.items), (2, self.pairs), (3, self.triples)):
+            combinations = np.array(list(itertools.combinations(range(len(PRODUCTS_TO_TAKE)), size)))
+            supports = counts[tuple(combinations.T)] / self.baskets
+            for combination in combinations[supports >= min_support]:
+                frequent[sum(1 << int(i) for i in combination)] = float(counts[tuple(combination)] / self.baskets)
+        return frequent
+
+def item_names(mask):
+    return [name for i, name in enumerate(PRODUCTS_TO_TAKE) if mask >> i & 1]
+
+def association_rules(frequent, min_lift=1.0):
+    """Rules between frequent itemsets with the same metrics as mlxtend's association_rules."""
+    rules = []
+    for itemset, support in frequent.items():
+        if bin(itemset).count('1') < 2:
+            continue
+        antecedent = (itemset - 1) & itemset
+        while antecedent:
+            consequent = itemset ^ antecedent
+            antecedent_support = frequent[antecedent]
+            consequent_support = frequent[consequent]
+            confidence = support / antecedent_support
+            lift = confidence / consequent_support
+            if lift >= min_lift:
+                leverage = support - antecedent_support * consequent_support
+                rules.append({
+                    "antecedents": antecedent,
+                    "consequents": consequent,
+                    "antecedent support": antecedent_support,
+                    "consequent support": consequent_support,
+                    "support": support,
+                    "confidence": confidence,
+                    "lift": lift,
+                    "representativity": 1.0,
+                    "leverage": leverage,
+                    "conviction": (1 - consequent_support) / (1 - confidence) if confidence < 1 else np.inf,
+                    "zhangs_metric": leverage / max(support * (1 - antecedent_support),
+                                                    antecedent_support * (consequent_support - support)),
+                    "jaccard": support / (antecedent_support + consequent_support - support),
+                    "certainty": (confidence - consequent_support) / (1 - consequent_support) if consequent_support < 1 else 0.0,
+                    "kulczynski": (support / antecedent_support + support / consequent_support) / 2
+                })
+            antecedent = (antecedent - 1) & itemset
+    rules.sort(key=lambda rule: (bin(rule["antecedents"]).count('1'), rule["antecedents"], -rule["confidence"]))
+    return rules
+
+def build_apriori_recommendations(rules, categories):
+    """Per antecedent, the consequent products by descending confidence, as in the notebook."""
+    recommendations = {}
+    for rule in sorted(rules, key=lambda rule: (-rule["confidence"], item_names(rule["consequents"]))):
+        key = "_".join(item_names(rule["antecedents"]))
+        current = recommendations.setdefault(key, [])
+        for product in item_names(rule["consequents"]):
+            if any(rec['product'] == product for rec in current):
+                continue
+            current.append({'product': product, 'product_category': categories[product], 'confidence': rule["confidence"]})
+    return recommendations
+
+def write_rules(rules, path):
+    """Save the rules as the pandas DataFrame the notebook pickled."""
+    import pandas as pd
+    frame = pd.DataFrame([{**rule,
+                           "antecedents": frozenset(item_names(rule["antecedents"])),
+                           "consequents": frozenset(item_names(rule["consequents"]))} for rule in rules])
+    frame.to_pickle(path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("receipts", nargs="*", default=DEFAULT_RECEIPTS, help="Receipt CSVs, each sorted by date")
+    parser.add_argument("--products", default=DEFAULT_PRODUCTS, help="product.csv")
+    parser.add_argument("--output-dir", default=DEFAULT_OBJECTS_DIR, help="Folder for the popularity and apriori files")
+    parser.add_argument("--rules-output", default=DEFAULT_RULES_PATH, help="Pickle of the association rules, empty to skip")
+    parser.add_argument("--basket-key", choices=["receipt", "notebook"], default=None,
+                        help="notebook by default, receipt with --state")
+    parser.add_argument("--min-support", type=float, default=0.05)
+    parser.add_argument("--min-lift", type=float, default=1.0)
+    parser.add_argument("--chunk-rows", type=int, default=10000, help="Receipt lines read per chunk")
+    parser.add_argument("--state", help="Support counter file to update with the given receipts, created if missing")
+    parser.add_argument("--half-life-days", type=float, default=None, help="Decay older baskets when updating --state")
+    parser.add_argument("--force", action="store_true", help="Absorb receipt files the --state file already contains")
+    args = parser.parse_args()
+    if args.basket_key is None:
+        args.basket_key = "receipt" if args.state else "notebook"
+    if args.state and args.basket_key == "notebook":
+        parser.error("--state needs the receipt basket key, notebook baskets span files")
+
+    start = time.perf_counter()
+    products, variants = load_products(args.products)
+    skipped = []
+
+    if args.state:
+        # Fold each new file into the persistent counters and derive itemsets from them
+        counters = SupportCounters.load(args.state, variants) if os.path.exists(args.state) else SupportCounters(variants)
+        rows, counter = 0, None
+        for path in args.receipts:
+            sha256 = file_sha256(path)
+            if counters.is_absorbed(sha256) and not args.force:
+                skipped.append(path)
+                continue
+            counter = BasketCounter(variants)
+            rows += stream_receipts([path], products, counter, args.basket_key, args.chunk_rows)
+            counters.absorb(counter, args.half_life_days, {"path": path, "sha256": sha256})
+        read_seconds = time.perf_counter() - start
+        counters.save(args.state)
+        frequent = counters.frequent_itemsets(args.min_support)
+        variant_lines = counters.variant_lines
+        baskets = counters.baskets
+    else:
+        counter = BasketCounter(variants)
+        rows = stream_receipts(args.receipts, products, counter, args.basket_key, args.chunk_rows)
+        read_seconds = time.perf_counter() - start
+        frequent = frequent_itemsets(counter.pattern_counts, len(PRODUCTS_TO_TAKE), args.min_support)
+        variant_lines = counter.variant_lines
+        baskets = sum(counter.pattern_counts.values())
+
+    rules = association_rules(frequent, args.min_lift)
+    # A product sold in two categories is listed under the last one, which matches the notebook artifacts
+    categories = {name: category for (name, category), lines in zip(variants, variant_lines) if lines}
+    recommendations = build_apriori_recommendations(rules, categories)
+
+    # Antecedents whose recommendations changed since the last artifacts
+    apriori_path = os.path.join(args.output_dir, 'apriori_recommendations.json')
+    previous = {}
+    if os.path.exists(apriori_path):
+        with open(apriori_path, 'r') as file:
+            previous = json.load(file)
+    changed = sorted(key for key in set(previous) | set(recommendations)
+                     if [rec['product'] for rec in previous.get(key, [])] != [rec['product'] for rec in recommendations.get(key, [])])
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, 'popularity_recommendation.csv'), 'w', newline='') as file:
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(['product', 'product_category', 'number_of_transactions'])
+        for (name, category), lines in zip(variants, variant_lines):
+            if lines:
+                # Decayed counts are fractional, plain counts stay integers
+                writer.writerow([name, category, int(lines) if float(lines).is_integer() else round(float(lines), 3)])
+    with open(apriori_path, 'w') as file:
+        json.dump(recommendations, file)
+    if args.rules_output:
+        write_rules(rules, args.rules_output)
+
+    total_seconds = time.perf_counter() - start
+    print(json.dumps({
+        "rows": rows,
+        "skipped_receipts": skipped,
+        "baskets": round(float(baskets), 3),
+        "peak_open_baskets": counter.peak_open_baskets if counter is not None else 0,
+        "frequent_itemsets": len(frequent),
+        "rules": len(rules),
+        "changed_antecedents": changed,
+        "rows_per_second": round(rows / read_seconds) if read_seconds else None,
+        "seconds": round(total_seconds, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()